@@ -1,214 +1,196 @@
-from flask import Flask, render_template, redirect, url_for, session, request
-from app_routes import admin, auth, case
-from services.db_service import init_db, get_db_connection
+from flask import Flask, render_template, redirect, url_for, session, request, jsonify
+from app_routes import admin, auth, case, chunked_upload, metrics
+from services.db_service import init_db
 import os
 import re
-from services.blob_service import blob_service_client, create_container
-import hashlib
-import json
-from datetime import datetime
-import zipfile
-import io
+from services.blob_service import get_blob_service_client
+from services.case_stats import record_change
+from services.inventory_service import get_inventory
+from services.metrics import span
+from services.secret_cache import lookup_container
+from services.startup import run_startup
+from services.upload_admission import UploadRejected, admit_upload
+from services.upload_service import UploadBatch, describe_upload, process_files, start_verification
+from services.compression_service import COMPRESSION_CHOICES, get_case_compression, parse_compression
+from services.upload_queue import UPLOAD_FOLDER, UPLOAD_QUEUE, enqueue_files, get_upload_job, start_workers
 
 app = Flask(__name__)
 app.secret_key = os.environ.get("SECRET_KEY", "default-secret-key")
 
-UPLOAD_FOLDER = os.environ.get("UPLOAD_FOLDER", "./uploads")
+# Most hashes accepted by one "have you got this?" check
+MAX_CHECK_HASHES = 1000
+
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 # Initialize database
 init_db(app)
 
-# Ensure the default case exists
-conn = get_db_connection()
-cursor = conn.cursor()
-cursor.execute("SELECT container_name FROM Cases WHERE container_name = 'uploads'")
-if not cursor.fetchone():
-    create_container("uploads")
-    cursor.execute(
-        "INSERT INTO Cases (name, container_name, secret) VALUES (?, ?, ?)",
-        ("default", "uploads", "0000-0000-0000-0000"),
-    )
-    conn.commit()
-
 # Register Blueprints
 app.register_blueprint(admin.bp)
 app.register_blueprint(auth.bp)
 app.register_blueprint(case.bp)
+app.register_blueprint(chunked_upload.bp)
+app.register_blueprint(metrics.bp)
 
-def load_blobinventory(container_client):
-    inventory_client = container_client.get_blob_client('.blobinventory')
-    if inventory_client.exists():
-        content = inventory_client.download_blob().readall()
-        try:
-            return json.loads(content.decode('utf-8'))
-        except Exception:
-            return []
-    return []
-
-def save_blobinventory(container_client, inventory):
-    inventory_client = container_client.get_blob_client('.blobinventory')
-    inventory_bytes = json.dumps(inventory, indent=2).encode('utf-8')
-    inventory_client.upload_blob(inventory_bytes, overwrite=True)
-
-def update_blobinventory_on_upload(container_client, file, unzipped_hash, zipped_hash):
-    inventory = load_blobinventory(container_client)
-    # Remove any existing entry for this file name
-    inventory = [entry for entry in inventory if entry['name'] != file.filename]
-    # Add new entry
-    entry = {
-        "name": file.filename,
-        "unzipped_hash": unzipped_hash,
-        "zipped_hash": zipped_hash,
-        "size": file.content_length,
-        "upload_date": datetime.utcnow().isoformat() + "Z"
-    }
-    inventory.append(entry)
-    save_blobinventory(container_client, inventory)
-
-def update_blobinventory_on_delete(container_client, filename):
-    inventory = load_blobinventory(container_client)
-    inventory = [entry for entry in inventory if entry['name'] != filename]
-    save_blobinventory(container_client, inventory)
-
-def compress_and_secure_file(file, password="infected"):
-    """Compress and secure the file with a password."""
-    zip_buffer = io.BytesIO()
-    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-        zip_info = zipfile.ZipInfo(file.filename)
-        zip_file.writestr(zip_info, file.read(), compress_type=zipfile.ZIP_DEFLATED)
-        zip_file.setpassword(password.encode())
-    zip_buffer.seek(0)
-    return zip_buffer
-
-def is_compressed_with_password(file, password="infected"):
-    """Check if the file is a ZIP file secured with the given password."""
-    try:
-        with zipfile.ZipFile(file) as zip_file:
-            # Test if the file can be opened with the password
-            zip_file.setpassword(password.encode())
-            zip_file.testzip()  # Will raise an exception if the password is incorrect
-        return True
-    except (zipfile.BadZipFile, RuntimeError, zipfile.LargeZipFile):
-        return False
+# Schema upgrades and the default case are set up by the first request, not at import
+app.before_request(run_startup)
+
+# Process queued uploads in this process unless UPLOAD_QUEUE_WORKERS is 0
+start_workers()
 
 @app.route('/')
 def index():
     return render_template('index.html')
 
+@app.context_processor
+def compression_choices():
+    return {"compression_choices": COMPRESSION_CHOICES}
+
 @app.route('/upload')
 def upload_page():
     return render_template('upload.html')
 
 @app.route('/upload', methods=['POST'])
 def upload_file():
-    secret = request.form.get('secret')
+    # The form is read under the upload admission limits, whose slots are held until the files are stored
+    try:
+        with admit_upload(request.stream, request.content_type, request.content_length, upload_case) as upload:
+            return store_upload(upload.form, upload.files, upload.container_name)
+    except UploadRejected as e:
+        return upload_response(f"{e}", "error"), 429, {"Retry-After": str(e.retry_after)}
+
+def upload_response(message, message_type, job_id=None, uploaded=(), duplicates=()):
+    """Render the outcome of a form upload; as JSON for the upload page's script, which asks for it."""
+    if request.accept_mimetypes.best == "application/json":
+        return jsonify({
+            "message": message, "message_type": message_type, "job_id": job_id,
+            "uploaded": list(uploaded), "duplicates": list(duplicates),
+        })
+    return render_template('upload.html', message=message, message_type=message_type, job_id=job_id)
+
+def upload_case(secret):
+    """Container name of the case a well-formed secret belongs to, else None."""
+    if not re.match(r"^\d{4}-\d{4}-\d{4}-\d{4}$", secret):
+        return None
+    with span("upload.secret_lookup"):
+        return lookup_container(secret)
+
+def store_upload(form, files, container_name):
+    """Store the files of an admitted upload form in the case the secret named."""
+    secret = form.get('secret')
     if not secret or not re.match(r"^\d{4}-\d{4}-\d{4}-\d{4}$", secret):
-        return render_template('upload.html', message="Invalid or missing secret key. Format: xxxx-xxxx-xxxx-xxxx", message_type="error")
+        return upload_response("Invalid or missing secret key. Format: xxxx-xxxx-xxxx-xxxx", "error")
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT container_name FROM Cases WHERE secret = ?", (secret,))
-    result = cursor.fetchone()
-    if not result:
-        return render_template('upload.html', message="Invalid secret key. No matching case found.", message_type="error")
+    if not container_name:
+        return upload_response("Invalid secret key. No matching case found.", "error")
 
-    container_name = result[0]
-
-    if 'files' not in request.files:
-        return render_template('upload.html', message="No files part", message_type="error")
-    files = request.files.getlist('files')
+    if 'files' not in files:
+        return upload_response("No files part", "error")
+    files = files.getlist('files')
     if not files or all(file.filename == '' for file in files):
-        return render_template('upload.html', message="No selected files", message_type="error")
+        return upload_response("No selected files", "error")
+
+    # The uploader may pick the compression; otherwise the case's choice applies
+    with span("upload.case_compression"):
+        compression = form.get('compression') or get_case_compression(container_name)
+    if compression:
+        try:
+            parse_compression(compression)
+        except ValueError as e:
+            return upload_response(f"{e}", "error")
+
+    files = [file for file in files if file.filename]
+    # Files the browser left out because the case already holds their content
+    skipped = form.getlist('skipped')
+
+    if UPLOAD_QUEUE:
+        try:
+            with span("upload.enqueue"):
+                job_id = enqueue_files(container_name, files, compression, skipped)
+        except Exception as e:
+            return upload_response(f"Error uploading files: {e}", "error")
+        return upload_response(
+            f"Files received: {', '.join(file.filename for file in files)}. Processing...", "success", job_id=job_id
+        )
+
+    try:
+        container_client = get_blob_service_client().get_container_client(container_name)
+        with span("upload.inventory_load"):
+            inventory = get_inventory(container_client)
+        batch = UploadBatch(container_client, inventory, compression)
+        with span("upload.process_files"):
+            entries, uploaded_files, duplicate_files, error = process_files(batch, files)
+        uploaded_files = [describe_upload(entry) for entry in entries]
+        duplicate_files += skipped
+
+        # Save the updated inventory once for the whole batch
+        with span("upload.inventory_write"):
+            inventory.add(*entries)
+        with span("upload.record_stats"):
+            record_change(container_name, len(entries), sum(entry['stored_size'] for entry in entries))
+        start_verification(container_name, entries)
+        if error:
+            raise error
+
+        message, message_type = upload_message(uploaded_files, duplicate_files)
+        return upload_response(message, message_type, uploaded=uploaded_files, duplicates=duplicate_files)
+    except Exception as e:
+        return upload_response(f"Error uploading files: {e}", "error")
+
+def upload_message(uploaded_files, duplicate_files):
+    """Return the (message, message_type) summarising an upload."""
+    if uploaded_files and not duplicate_files:
+        return f"Files uploaded successfully: {', '.join(uploaded_files)}", "success"
+    elif duplicate_files and not uploaded_files:
+        return f"The following files were not uploaded because duplicates already exist: {', '.join(duplicate_files)}", "warning"
+    elif uploaded_files and duplicate_files:
+        return (
+            f"Files uploaded successfully: {', '.join(uploaded_files)}. The following files were not uploaded because duplicates already exist: {', '.join(duplicate_files)}",
+            "warning",
+        )
+    return "No files were uploaded.", "warning"
+
+@app.route('/upload/jobs/<job_id>')
+def upload_job_status(job_id):
+    """
+    Report the progress of a queued upload; the upload page polls this.
+    """
+    job = get_upload_job(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown upload job."}), 404
+    if job['status'] in ('completed', 'failed'):
+        message, message_type = upload_message(job['result']['uploaded'], job['result']['duplicates'])
+        if job['status'] == 'failed':
+            message, message_type = f"{message} Error uploading files: {job['error']}", "error"
+        job.update(message=message, message_type=message_type)
+    return jsonify(job), 200
+
+@app.route('/upload/check', methods=['POST'])
+def check_hashes():
+    """
+    Report which of a batch of SHA-256 hashes the case already holds, so the
+    browser can skip sending their content.
+    """
+    data = request.get_json(silent=True) or {}
+    secret = data.get('secret')
+    if not secret or not re.match(r"^\d{4}-\d{4}-\d{4}-\d{4}$", secret):
+        return jsonify({"error": "Invalid or missing secret key. Format: xxxx-xxxx-xxxx-xxxx"}), 400
+    container_name = lookup_container(secret)
+    if not container_name:
+        return jsonify({"error": "Invalid secret key. No matching case found."}), 403
+
+    hashes = data.get('hashes')
+    if not isinstance(hashes, list) or len(hashes) > MAX_CHECK_HASHES:
+        return jsonify({"error": f"Provide a list of at most {MAX_CHECK_HASHES} hashes."}), 400
+    hashes = {str(file_hash).lower() for file_hash in hashes}
 
     try:
-        container_client = blob_service_client.get_container_client(container_name)
-        inventory = load_blobinventory(container_client)
-        inventory_hash_map = {entry['unzipped_hash']: entry for entry in inventory}
-        zipped_hash_map = {entry['zipped_hash']: entry for entry in inventory}
-        updated_inventory = inventory.copy()
-
-        duplicate_files = []
-        uploaded_files = []
-
-        for file in files:
-            file.seek(0)
-            file_bytes = file.read()
-            unzipped_hash = hashlib.sha256(file_bytes).hexdigest()
-            file.seek(0)  # Reset file pointer for further processing
-
-            # Check if the file is already compressed with the password
-            if is_compressed_with_password(file):
-                compressed_file = file  # Use the file as-is
-                compressed_file.seek(0)
-                compressed_bytes = compressed_file.read()
-                zipped_hash = hashlib.sha256(compressed_bytes).hexdigest()
-            else:
-                # Compress and secure the file
-                compressed_file = compress_and_secure_file(file)
-                compressed_file.seek(0)
-                compressed_bytes = compressed_file.read()
-                zipped_hash = hashlib.sha256(compressed_bytes).hexdigest()
-
-            # Check if the file already exists in the inventory
-            if unzipped_hash in inventory_hash_map or zipped_hash in zipped_hash_map:
-                existing_entry = inventory_hash_map.get(unzipped_hash) or zipped_hash_map.get(zipped_hash)
-                blob_client = container_client.get_blob_client(existing_entry['name'])
-                if blob_client.exists():
-                    # File already exists, skip re-upload
-                    duplicate_files.append(file.filename)
-                    continue
-
-            # Handle name collision
-            original_filename = file.filename + ".zip"
-            blob_client = container_client.get_blob_client(original_filename)
-            if blob_client.exists():
-                base_name, extension = os.path.splitext(file.filename)
-                counter = 1
-                while True:
-                    new_filename = f"{base_name}_{counter}{extension}.zip"
-                    blob_client = container_client.get_blob_client(new_filename)
-                    if not blob_client.exists():
-                        break
-                    counter += 1
-                file.filename = new_filename
-            else:
-                file.filename = original_filename
-
-            # Upload the file
-            blob_client.upload_blob(io.BytesIO(compressed_bytes))
-
-            # Add the file to the updated inventory
-            updated_inventory.append({
-                "name": file.filename,
-                "unzipped_hash": unzipped_hash,
-                "zipped_hash": zipped_hash,
-                "size": len(file_bytes),
-                "upload_date": datetime.utcnow().isoformat() + "Z"
-            })
-            uploaded_files.append(file.filename)
-
-        # Save the updated inventory
-        save_blobinventory(container_client, updated_inventory)
-
-        if uploaded_files and not duplicate_files:
-            return render_template('upload.html', message="Files uploaded successfully", message_type="success")
-        elif duplicate_files and not uploaded_files:
-            return render_template(
-                'upload.html',
-                message=f"The following files were not uploaded because duplicates already exist: {', '.join(duplicate_files)}",
-                message_type="warning"
-            )
-        elif uploaded_files and duplicate_files:
-            return render_template(
-                'upload.html',
-                message=f"Files uploaded successfully: {', '.join(uploaded_files)}. The following files were not uploaded because duplicates already exist: {', '.join(duplicate_files)}",
-                message_type="warning"
-            )
-        else:
-            return render_template('upload.html', message="No files were uploaded.", message_type="warning")
+        container_client = get_blob_service_client().get_container_client(container_name)
+        batch = UploadBatch(container_client, get_inventory(container_client))
+        present = sorted(file_hash for file_hash in hashes if re.fullmatch(r"[0-9a-f]{64}", file_hash) and batch.find_duplicate(file_hash))
     except Exception as e:
-        return render_template('upload.html', message=f"Error uploading files: {e}", message_type="error")
+        return jsonify({"error": f"Error checking files: {e}"}), 500
+    return jsonify({"present": present}), 200
 
 @app.route('/about')
 def about():
@@ -1,166 +1,276 @@
 from flask import Blueprint, request, render_template
-from services.db_service import get_db_connection
-from services.blob_service import create_container, blob_service_client, generate_secret
+from services.db_service import db_connection, db_pool
+from services.blob_service import create_container, get_blob_service_client, generate_secret
+from services.inventory_service import get_inventory, INVENTORY_BLOB, INVENTORY_LOG_BLOB
+from services.job_service import start_job, get_job
+from services.metrics import BYTES_HASHED, count, span
+from services.case_deletion import start_case_deletion
+from services.case_stats import is_stale, refresh_stats
+from services.compression_service import parse_compression
+from services.content_store import linked_content, source_blob_client, stored_size
+from services.secret_cache import secret_cache
 from utils.auth import login_required
+from azure.core.exceptions import ResourceNotFoundError
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import hashlib
+import os
 import uuid
 import secrets
-import json
 from datetime import datetime
 
 bp = Blueprint('admin', __name__, url_prefix='/admin')
 
-def update_blobinventory(container_client):
-    blobs = list(container_client.list_blobs())
-    inventory = []
-    for blob in blobs:
-        if blob.name == '.blobinventory':
-            continue
-        blob_client = container_client.get_blob_client(blob.name)
-        blob_bytes = blob_client.download_blob().readall()
-        file_hash = None
+REBUILD_CONTAINER_WORKERS = int(os.environ.get("REBUILD_CONTAINER_WORKERS", 4))
+REBUILD_HASH_WORKERS = int(os.environ.get("REBUILD_HASH_WORKERS", 8))
+
+def hash_blob(blob_client):
+    """Hash a stored blob from a streamed, chunked download."""
+    digest = hashlib.sha256()
+    with span("rebuild.hash"):
+        for chunk in blob_client.download_blob().chunks():
+            digest.update(chunk)
+            count(BYTES_HASHED, len(chunk))
+    return digest.hexdigest()
+
+def update_blobinventory(container_client, job, hash_executor):
+    """Bring a container's inventory in line with its blobs.
+
+    Blobs whose ETag and size match their inventory entry are skipped; the
+    rest are re-hashed on hash_executor. Only the differences are written
+    back, so uploads that land while the rebuild runs are not lost.
+    """
+    inventory = get_inventory(container_client)
+    known = {entry['name']: entry for entry in inventory.entries()}
+    listed = set()
+    changed = []
+    with span("rebuild.list"):
+        for blob in container_client.list_blobs(include=['metadata']):
+            if blob.name in (INVENTORY_BLOB, INVENTORY_LOG_BLOB):
+                continue
+            listed.add(blob.name)
+            entry = known.get(blob.name)
+            if not entry or entry.get('etag') != blob.etag.strip('"') or entry.get('stored_size') != stored_size(blob):
+                changed.append(blob)
+    job.add_total(len(listed))
+    job.advance(len(listed) - len(changed))
+
+    hashes = {}
+    futures = {hash_executor.submit(hash_blob, source_blob_client(container_client, blob)): blob for blob in changed}
+    for future in as_completed(futures):
+        blob = futures[future]
         try:
-            import hashlib
-            file_hash = hashlib.sha256(blob_bytes).hexdigest()
+            hashes[blob.name] = future.result()
+            job.advance(message=f"{container_client.container_name}: {blob.name}")
         except Exception:
-            file_hash = ""
+            job.advance(failed=True)
+
+    inventory.refresh()
+    entries = []
+    for blob in changed:
+        zipped_hash = hashes.get(blob.name)
+        if zipped_hash is None:
+            continue
+        current = inventory.get(blob.name) or {}
+        if current.get('etag') == blob.etag.strip('"'):
+            continue  # Re-uploaded while we were hashing; its entry is already accurate
+        same_content = current.get('zipped_hash') == zipped_hash
+        content_hash = linked_content(blob)
         entry = {
             "name": blob.name,
-            "type": blob.content_settings.content_type if hasattr(blob, "content_settings") else "",
-            "size": blob.size,
-            "upload_date": blob.last_modified.isoformat() if hasattr(blob, "last_modified") else "",
-            "hash": file_hash
+            # A link blob is named after its unzipped content, so that hash is always known
+            "unzipped_hash": content_hash or (current.get('unzipped_hash') if same_content else None),
+            "zipped_hash": zipped_hash,
+            "size": current.get('size', stored_size(blob)) if same_content else stored_size(blob),
+            "stored_size": stored_size(blob),
+            "etag": blob.etag.strip('"'),
+            "type": blob.content_settings.content_type if blob.content_settings else "",
+            "upload_date": current.get('upload_date') or blob.last_modified.isoformat(),
         }
-        inventory.append(entry)
-    inventory_client = container_client.get_blob_client('.blobinventory')
-    inventory_bytes = json.dumps(inventory, indent=2).encode('utf-8')
-    inventory_client.upload_blob(inventory_bytes, overwrite=True)
+        if content_hash:
+            entry["content"] = content_hash
+        entries.append(entry)
+    removed = [name for name in known if name not in listed]
+    with span("rebuild.inventory_write"):
+        inventory.add(*entries)
+        inventory.remove(*removed)
+    return {"hashed": len(entries), "unchanged": len(listed) - len(changed), "removed": len(removed)}
+
+def update_blobinventories(job, containers):
+    """Rebuild the inventories of several containers in parallel."""
+    updated = []
+    failed = []
+    with ThreadPoolExecutor(max_workers=REBUILD_HASH_WORKERS) as hash_executor, \
+            ThreadPoolExecutor(max_workers=REBUILD_CONTAINER_WORKERS) as container_executor:
+        futures = {}
+        for container_name in containers:
+            container_client = get_blob_service_client().get_container_client(container_name)
+            futures[container_executor.submit(update_blobinventory, container_client, job, hash_executor)] = container_name
+        for future in as_completed(futures):
+            container_name = futures[future]
+            try:
+                future.result()
+                updated.append(container_name)
+            except ResourceNotFoundError:
+                pass  # Case without a container
+            except Exception:
+                failed.append(container_name)
+    job.message = f"Updated blob inventory for: {', '.join(updated)}"
+    return {"updated": updated, "failed": failed}
 
 @bp.route('/', methods=['GET', 'POST'])
 @login_required
 def admin_portal():
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
-    if request.method == 'POST':
-        case_name = request.form.get('case_name')
-        if not case_name:
-            return "Case name is required.", 400
-
-        # Ensure unique case name and container name
-        original_case_name = case_name
-        original_container_name = f"case-{uuid.uuid4().hex[:8]}"
-        container_name = original_container_name
-        counter = 1
-
-        while True:
-            cursor.execute("SELECT 1 FROM Cases WHERE name = ? OR container_name = ?", (case_name, container_name))
-            if not cursor.fetchone():
-                break
-            case_name = f"{original_case_name}_{counter}"
-            container_name = f"{original_container_name}_{counter}"
-            counter += 1
-
-        secret = generate_secret()
+    with span("admin.cases"), db_connection() as conn:
+        cursor = conn.cursor()
 
-        try:
-            create_container(container_name)
-            cursor.execute(
-                "INSERT INTO Cases (name, container_name, secret) VALUES (?, ?, ?)",
-                (case_name, container_name, secret),
-            )
-            conn.commit()
-        except Exception as e:
-            return f"Error creating case: {e}", 500
+        if request.method == 'POST':
+            case_name = request.form.get('case_name')
+            if not case_name:
+                return "Case name is required.", 400
+
+            # Ensure unique case name and container name
+            original_case_name = case_name
+            original_container_name = f"case-{uuid.uuid4().hex[:8]}"
+            container_name = original_container_name
+            counter = 1
+
+            while True:
+                cursor.execute("SELECT 1 FROM Cases WHERE name = ? OR container_name = ?", (case_name, container_name))
+                if not cursor.fetchone():
+                    break
+                case_name = f"{original_case_name}_{counter}"
+                container_name = f"{original_container_name}_{counter}"
+                counter += 1
+
+            secret = generate_secret()
+
+            try:
+                create_container(container_name)
+                cursor.execute(
+                    "INSERT INTO Cases (name, container_name, secret, file_count, total_size, stats_updated_at) "
+                    "VALUES (?, ?, ?, 0, 0, ?)",
+                    (case_name, container_name, secret, datetime.utcnow()),
+                )
+                conn.commit()
+                secret_cache.invalidate(secret)
+            except Exception as e:
+                return f"Error creating case: {e}", 500
+
+        # Fetch all current cases with their stored statistics
+        cursor.execute("SELECT name, secret, container_name, file_count, total_size, stats_updated_at, compression, delete_job FROM Cases")
+        rows = cursor.fetchall()
+
+    # Recompute missing or outdated statistics, all stale cases at once
+    force_refresh = request.args.get('refresh') == '1'
+    stale = [row[2] for row in rows if force_refresh or is_stale(row[5])]
+    try:
+        with span("admin.refresh_stats"):
+            refreshed = refresh_stats(stale)
+    except Exception:
+        refreshed = {}
 
-    # Fetch all current cases with additional details
-    cursor.execute("SELECT name, secret, container_name FROM Cases")
     cases = []
-    for row in cursor.fetchall():
-        case_name, secret, container_name = row
-        try:
-            container_client = blob_service_client.get_container_client(container_name)
-            blobs = list(container_client.list_blobs())
-            file_count = len(blobs)
-            total_size = sum(blob.size for blob in blobs)
-        except Exception:
-            file_count = 0
-            total_size = 0
+    for case_name, secret, container_name, file_count, total_size, _, compression, delete_job in rows:
+        if container_name in refreshed:
+            file_count, total_size = refreshed[container_name]
         cases.append({
             "name": case_name,
             "secret": secret,
-            "file_count": file_count,
-            "total_size": total_size,
+            "file_count": file_count or 0,
+            "total_size": total_size or 0,
             "container_name": container_name,
+            "compression": compression or "",
+            "deleting": delete_job is not None,
         })
 
-    return render_template('admin.html', cases=cases)
+    with span("admin.render"):
+        return render_template('admin.html', cases=cases)
 
 @bp.route('/api/cases', methods=['GET'])
 @login_required
 def get_cases():
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT name FROM Cases")
-    cases = [row[0] for row in cursor.fetchall()]
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT name FROM Cases")
+        cases = [row[0] for row in cursor.fetchall()]
     return {"cases": cases}, 200
 
+@bp.route('/api/db_pool', methods=['GET'])
+@login_required
+def get_db_pool_stats():
+    return db_pool.stats(), 200
+
+@bp.route('/api/secret_cache', methods=['GET'])
+@login_required
+def get_secret_cache_stats():
+    return secret_cache.stats(), 200
+
 @bp.route('/delete_case/<container_name>', methods=['POST'])
 @login_required
 def delete_case(container_name):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
     # Ensure the default case cannot be deleted
     if container_name == "uploads":
         return "The default case cannot be deleted.", 400
 
+    # Files are deleted in batches by a background job; poll /admin/jobs/<job_id>
     try:
-        # Delete the blob container and its files
-        container_client = blob_service_client.get_container_client(container_name)
-        if container_client.exists():
-            blobs = container_client.list_blobs()
-            for blob in blobs:
-                container_client.delete_blob(blob.name)
-            container_client.delete_container()
-
-        # Delete the case entry from the database
-        cursor.execute("DELETE FROM Cases WHERE container_name = ?", (container_name,))
-        conn.commit()
-        return "Case deleted successfully.", 200
+        job_id = start_case_deletion(container_name)
     except Exception as e:
         return f"Error deleting case: {e}", 500
+    if job_id is None:
+        return "Case not found.", 404
+    return {"job_id": job_id}, 202
 
 @bp.route('/update_blobinventory', methods=['POST'])
 @login_required
 def update_all_blobinventories():
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT container_name FROM Cases")
-    containers = [row[0] for row in cursor.fetchall()]
-    updated = []
-    for container_name in containers:
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT container_name FROM Cases")
+        containers = [row[0] for row in cursor.fetchall()]
+    job = start_job("update_blobinventory", update_blobinventories, containers, params={"containers": containers})
+    return {"job_id": job.id}, 202
+
+@bp.route('/jobs/<job_id>', methods=['GET'])
+@login_required
+def job_status(job_id):
+    job = get_job(job_id)
+    if job is None:
+        return {"error": "Job not found."}, 404
+    return job, 200
+
+@bp.route('/compression/<container_name>', methods=['POST'])
+@login_required
+def set_compression(container_name):
+    compression = request.form.get('compression') or None
+    if compression:
         try:
-            container_client = blob_service_client.get_container_client(container_name)
-            if container_client.exists():
-                update_blobinventory(container_client)
-                updated.append(container_name)
-        except Exception:
-            pass
-    return f"Updated blob inventory for: {', '.join(updated)}", 200
+            parse_compression(compression)
+        except ValueError as e:
+            return f"{e}", 400
+    try:
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("UPDATE Cases SET compression = ? WHERE container_name = ?", (compression, container_name))
+            conn.commit()
+        return "Compression updated successfully.", 200
+    except Exception as e:
+        return f"Error updating compression: {e}", 500
 
 @bp.route('/rotate_secret/<container_name>', methods=['POST'])
 @login_required
 def rotate_secret(container_name):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
     try:
         # Generate a new secret
         new_secret = generate_secret()
 
         # Update the secret in the database
-        cursor.execute("UPDATE Cases SET secret = ? WHERE container_name = ?", (new_secret, container_name))
-        conn.commit()
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("UPDATE Cases SET secret = ? WHERE container_name = ?", (new_secret, container_name))
+            conn.commit()
+        secret_cache.invalidate_container(container_name)
+        secret_cache.invalidate(new_secret)
 
         return "Secret rotated successfully.", 200
     except Exception as e:
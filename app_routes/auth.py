@@ -1,6 +1,7 @@
 from flask import Blueprint, redirect, session, url_for, request, current_app
 from msal import ConfidentialClientApplication
 import os
+import threading
 
 bp = Blueprint('auth', __name__, url_prefix='/auth')
 
@@ -11,11 +12,20 @@ AUTHORITY = f"https://login.microsoftonline.com/{TENANT_ID}"
 REDIRECT_PATH = "/auth/callback"
 SCOPE = ["User.Read"]
 
-msal_app = ConfidentialClientApplication(
-    CLIENT_ID,
-    authority=AUTHORITY,
-    client_credential=CLIENT_SECRET,
-)
+_msal_app = None
+_msal_app_lock = threading.Lock()
+
+def get_msal_app():
+    """Return the shared MSAL client, created on first sign-in; creating it contacts the authority."""
+    global _msal_app
+    with _msal_app_lock:
+        if _msal_app is None:
+            _msal_app = ConfidentialClientApplication(
+                CLIENT_ID,
+                authority=AUTHORITY,
+                client_credential=CLIENT_SECRET,
+            )
+        return _msal_app
 
 def get_redirect_uri():
     """Generate the redirect URI dynamically based on the request."""
@@ -24,7 +34,7 @@ def get_redirect_uri():
 @bp.route('/login')
 def login():
     redirect_uri = get_redirect_uri()
-    auth_url = msal_app.get_authorization_request_url(SCOPE, redirect_uri=redirect_uri)
+    auth_url = get_msal_app().get_authorization_request_url(SCOPE, redirect_uri=redirect_uri)
     return redirect(auth_url)
 
 @bp.route('/callback')
@@ -33,7 +43,7 @@ def callback():
     if code:
         try:
             redirect_uri = get_redirect_uri()
-            result = msal_app.acquire_token_by_authorization_code(
+            result = get_msal_app().acquire_token_by_authorization_code(
                 code,
                 scopes=SCOPE,
                 redirect_uri=redirect_uri,
@@ -1,30 +1,77 @@
-from flask import Blueprint, render_template, request, jsonify
-from services.db_service import get_db_connection
-from services.blob_service import blob_service_client
+from flask import Blueprint, Response, redirect, render_template, request, jsonify, stream_with_context
+from werkzeug.http import http_date, is_resource_modified
+from services.db_service import db_connection
+from services.blob_service import get_blob_service_client, generate_download_url
+from services.case_files import CASE_FILES_PAGE_SIZE, list_files, parse_date
+from services.case_stats import record_change
+from services.content_store import (
+    CONTENT_CONTAINER, content_archive, content_blob_client, linked_content, release_reference, stored_size,
+)
+from services.export_service import stream_tar, stream_zip
+from services.inventory_service import get_inventory, INVENTORY_BLOB, INVENTORY_LOG_BLOB
+from services.metrics import BYTES_TRANSFERRED, count, span
 from utils.auth import login_required
-import json
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceNotFoundError
+import os
 
 bp = Blueprint('case', __name__, url_prefix='/case')
 
-def load_blobinventory(container_client):
-    inventory_client = container_client.get_blob_client('.blobinventory')
-    if inventory_client.exists():
-        content = inventory_client.download_blob().readall()
-        try:
-            return json.loads(content.decode('utf-8'))
-        except Exception:
-            return []
-    return []
+# Redirect downloads to short-lived SAS URLs instead of proxying them
+DOWNLOAD_SAS_REDIRECT = os.environ.get("DOWNLOAD_SAS_REDIRECT", "0") == "1"
+
+def _counted(chunks):
+    """Pass chunks through, timing the whole transfer and counting its bytes."""
+    with span("download.stream"):
+        for chunk in chunks:
+            count(BYTES_TRANSFERRED, len(chunk), direction="download")
+            yield chunk
+
+def stream_blob(blob_client, properties, filename, archive=None):
+    """
+    Stream a blob to the client, honouring conditional and Range requests.
+    archive, if given, is the blob renamed for this case file and is sent instead.
+    """
+    etag = properties.etag.strip('"')
+    size = archive.size if archive else properties.size
+    headers = {
+        "Content-Disposition": f"attachment; filename={filename}",
+        "Accept-Ranges": "bytes",
+        "ETag": f'"{etag}"',
+        "Last-Modified": http_date(properties.last_modified),
+    }
+    if not is_resource_modified(request.environ, etag=etag, last_modified=properties.last_modified):
+        return Response(status=304, headers=headers)
 
-def save_blobinventory(container_client, inventory):
-    inventory_client = container_client.get_blob_client('.blobinventory')
-    inventory_bytes = json.dumps(inventory, indent=2).encode('utf-8')
-    inventory_client.upload_blob(inventory_bytes, overwrite=True)
+    # A Range request only applies if its If-Range (if any) still matches the blob
+    if_range = request.if_range
+    range_applies = (
+        if_range.etag is None and if_range.date is None
+        or if_range.etag == etag
+        or if_range.date is not None and if_range.date >= properties.last_modified
+    )
+    start, length, status = 0, size, 200
+    if request.range and len(request.range.ranges) == 1 and range_applies:
+        byte_range = request.range.range_for_length(size)
+        if byte_range is None:
+            headers["Content-Range"] = f"bytes */{size}"
+            return Response(status=416, headers=headers)
+        start, stop = byte_range
+        length, status = stop - start, 206
+        headers["Content-Range"] = f"bytes {start}-{stop - 1}/{size}"
 
-def update_blobinventory_on_delete(container_client, filename):
-    inventory = load_blobinventory(container_client)
-    inventory = [entry for entry in inventory if entry['name'] != filename]
-    save_blobinventory(container_client, inventory)
+    headers["Content-Length"] = str(length)
+    if length == 0:
+        return Response(b"", status=status, headers=headers, mimetype="application/octet-stream")
+    if archive:
+        chunks = archive.chunks(start, length)
+    else:
+        # Pin the download to the version we just described in the headers
+        chunks = blob_client.download_blob(
+            offset=start, length=length, etag=properties.etag, match_condition=MatchConditions.IfNotModified
+        ).chunks()
+    return Response(stream_with_context(_counted(chunks)), status=status, headers=headers,
+                    mimetype="application/octet-stream", direct_passthrough=True)
 
 @bp.route('/<case_id>', methods=['GET'])
 @login_required
@@ -32,52 +79,62 @@ def view_case(case_id):
     """
     View details of a specific case, including files in its blob container.
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
     # Fetch case details from the database
-    cursor.execute("SELECT name, container_name FROM Cases WHERE container_name = ?", (case_id,))
-    case = cursor.fetchone()
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT name, container_name FROM Cases WHERE container_name = ?", (case_id,))
+        case = cursor.fetchone()
     if not case:
         return "Case not found.", 404
 
     case_name, container_name = case
 
-    # List blobs in the container
-    try:
-        container_client = blob_service_client.get_container_client(container_name)
-        blobs = container_client.list_blobs()
-        blob_list = [{"name": blob.name, "size": blob.size} for blob in blobs]
-    except Exception as e:
-        return f"Error fetching blobs: {e}", 500
-
-    return render_template('case.html', case={"name": case_name, "container_name": container_name}, blobs=blob_list)
+    # The files themselves are loaded page by page from list_case_files
+    return render_template('case.html', case={"name": case_name, "container_name": container_name})
 
 @bp.route('/<case_id>/files', methods=['GET'])
 @login_required
 def list_case_files(case_id):
     """
-    API endpoint to list files in a specific case's blob container.
+    API endpoint to list one page of the files in a case's blob container.
+    Accepts prefix, q (name contains), min_size, max_size, since, until,
+    sort (name, size or date), order (asc or desc), limit and cursor.
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
     # Fetch the container name for the case
-    cursor.execute("SELECT container_name FROM Cases WHERE id = ?", (case_id,))
-    result = cursor.fetchone()
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT container_name FROM Cases WHERE container_name = ?", (case_id,))
+        result = cursor.fetchone()
     if not result:
         return jsonify({"error": "Case not found."}), 404
 
     container_name = result[0]
 
-    # List blobs in the container
+    args = request.args
+    try:
+        filters = {
+            "prefix": args.get('prefix') or None,
+            "search": args.get('q') or None,
+            "min_size": args.get('min_size', type=int),
+            "max_size": args.get('max_size', type=int),
+            "since": parse_date(args['since']) if args.get('since') else None,
+            "until": parse_date(args['until']) if args.get('until') else None,
+            "sort": args.get('sort', 'name'),
+            "descending": args.get('order') == 'desc',
+            "limit": args.get('limit', CASE_FILES_PAGE_SIZE, type=int),
+            "cursor": args.get('cursor') or None,
+        }
+    except ValueError as e:
+        return jsonify({"error": f"Invalid filter: {e}"}), 400
+
     try:
-        container_client = blob_service_client.get_container_client(container_name)
-        blobs = container_client.list_blobs()
-        blob_list = [{"name": blob.name, "size": blob.size} for blob in blobs]
-        return jsonify(blob_list), 200
+        container_client = get_blob_service_client().get_container_client(container_name)
+        files, next_cursor = list_files(container_client, **filters)
+    except ValueError as e:
+        return jsonify({"error": f"{e}"}), 400
     except Exception as e:
         return jsonify({"error": f"Error fetching blobs: {e}"}), 500
+    return jsonify({"files": files, "cursor": next_cursor}), 200
 
 @bp.route('/<case_id>/files/<filename>', methods=['DELETE'])
 @login_required
@@ -85,26 +142,30 @@ def delete_file(case_id, filename):
     """
     API endpoint to delete a specific file from a case's blob container.
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
     # Fetch the container name for the case
-    cursor.execute("SELECT container_name FROM Cases WHERE container_name = ?", (case_id,))
-    result = cursor.fetchone()
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT container_name FROM Cases WHERE container_name = ?", (case_id,))
+        result = cursor.fetchone()
     if not result:
         return jsonify({"error": "Case not found."}), 404
 
     container_name = result[0]
 
     try:
-        container_client = blob_service_client.get_container_client(container_name)
+        container_client = get_blob_service_client().get_container_client(container_name)
         blob_client = container_client.get_blob_client(filename)
-        if blob_client.exists():
-            blob_client.delete_blob()
-            update_blobinventory_on_delete(container_client, filename)
-            return jsonify({"message": "File deleted successfully."}), 200
-        else:
+        try:
+            properties = blob_client.get_blob_properties()
+        except ResourceNotFoundError:
             return jsonify({"error": "File not found."}), 404
+        blob_client.delete_blob()
+        get_inventory(container_client).remove(filename)
+        content_hash = linked_content(properties)
+        if content_hash:
+            release_reference(content_hash)
+        record_change(container_name, -1, -stored_size(properties))
+        return jsonify({"message": "File deleted successfully."}), 200
     except Exception as e:
         return jsonify({"error": f"Error deleting file: {e}"}), 500
 
@@ -114,27 +175,94 @@ def download_file(case_id, filename):
     """
     API endpoint to download a specific file from a case's blob container.
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
     # Fetch the container name for the case
-    cursor.execute("SELECT container_name FROM Cases WHERE container_name = ?", (case_id,))
-    result = cursor.fetchone()
+    with span("download.case_lookup"), db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT container_name FROM Cases WHERE container_name = ?", (case_id,))
+        result = cursor.fetchone()
     if not result:
         return jsonify({"error": "Case not found."}), 404
 
     container_name = result[0]
 
     try:
-        container_client = blob_service_client.get_container_client(container_name)
+        container_client = get_blob_service_client().get_container_client(container_name)
         blob_client = container_client.get_blob_client(filename)
-        if blob_client.exists():
-            file_stream = blob_client.download_blob().readall()
-            return file_stream, 200, {
-                "Content-Disposition": f"attachment; filename={filename}",
-                "Content-Type": "application/octet-stream",
-            }
-        else:
+        try:
+            with span("download.properties"):
+                properties = blob_client.get_blob_properties()
+        except ResourceNotFoundError:
             return jsonify({"error": "File not found."}), 404
+
+        # Files linked to the shared content store are served from there
+        content_hash = linked_content(properties)
+        if content_hash:
+            blob_client = content_blob_client(content_hash)
+            with span("download.content_properties"):
+                properties = blob_client.get_blob_properties()
+
+        # Let large downloads bypass the app tier entirely. Storage serves the
+        # content as stored, so the member keeps its content-hash name.
+        if DOWNLOAD_SAS_REDIRECT:
+            if content_hash:
+                return redirect(generate_download_url(CONTENT_CONTAINER, content_hash, filename=filename))
+            return redirect(generate_download_url(container_name, filename))
+
+        archive = None
+        if content_hash:
+            with span("download.rename"):
+                archive = content_archive(blob_client, properties, filename)
+        return stream_blob(blob_client, properties, filename, archive)
+    except Exception as e:
+        return jsonify({"error": f"Error downloading file: {e}"}), 500
+
+
+@bp.route('/<case_id>/export', methods=['GET', 'POST'])
+@login_required
+def export_case(case_id):
+    """
+    Stream a whole case, or the files selected by name or hash, as one archive.
+    """
+    archive_format = request.values.get('format', 'zip')
+    if archive_format not in ('zip', 'tar'):
+        return jsonify({"error": "Unsupported format. Use zip or tar."}), 400
+
+    # Fetch the container name for the case
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT container_name FROM Cases WHERE container_name = ?", (case_id,))
+        result = cursor.fetchone()
+    if not result:
+        return jsonify({"error": "Case not found."}), 404
+
+    container_name = result[0]
+
+    try:
+        container_client = get_blob_service_client().get_container_client(container_name)
+        inventory = get_inventory(container_client)
+
+        names = set(request.values.getlist('names'))
+        for file_hash in request.values.getlist('hashes'):
+            entry = inventory.find_by_unzipped_hash(file_hash) or inventory.find_by_zipped_hash(file_hash)
+            if entry:
+                names.add(entry['name'])
+        selected = bool(request.values.getlist('names') or request.values.getlist('hashes'))
+
+        blobs = [
+            blob for blob in container_client.list_blobs(include=['metadata'])
+            if blob.name not in (INVENTORY_BLOB, INVENTORY_LOG_BLOB) and (not selected or blob.name in names)
+        ]
+        manifest = {
+            "case": container_name,
+            "files": [inventory.get(blob.name) or {"name": blob.name, "stored_size": stored_size(blob)} for blob in blobs],
+        }
     except Exception as e:
-        return jsonify({"error": f"Error downloading file: {e}"}), 500
\ No newline at end of file
+        return jsonify({"error": f"Error exporting case: {e}"}), 500
+
+    stream = stream_zip if archive_format == 'zip' else stream_tar
+    return Response(
+        stream_with_context(stream(container_client, blobs, manifest)),
+        mimetype="application/zip" if archive_format == 'zip' else "application/x-tar",
+        headers={"Content-Disposition": f"attachment; filename={container_name}.{archive_format}"},
+        direct_passthrough=True,
+    )
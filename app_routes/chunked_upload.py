@@ -0,0 +1,205 @@
+from flask import Blueprint, current_app, request, jsonify
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+from services.chunked_upload_service import (
+    CHUNKED_UPLOAD_CHUNK_SIZE, CHUNKED_UPLOAD_MAX_AGE, MAX_CHUNKS,
+    assemble_upload, chunk_count, chunk_length, received_chunks, stage_chunk, start_commit,
+)
+from services.compression_service import parse_compression
+from services.job_service import get_job
+from services.secret_cache import lookup_container
+from services.upload_admission import READ_SIZE, UploadRejected, admit_case
+from services.upload_queue import UPLOAD_QUEUE, enqueue_staged
+from services.upload_service import describe_upload
+import os
+import re
+import uuid
+
+bp = Blueprint('chunked_upload', __name__, url_prefix='/upload/chunked')
+
+def _serializer():
+    return URLSafeTimedSerializer(current_app.secret_key, salt='chunked-upload')
+
+def _container_for_secret(secret):
+    if not secret or not re.match(r"^\d{4}-\d{4}-\d{4}-\d{4}$", secret):
+        return None
+    return lookup_container(secret)
+
+def _rejected(e):
+    # Read what the client sent, so a keep-alive connection is left at the next request
+    while request.stream.read(READ_SIZE):
+        pass
+    return jsonify({"error": f"{e}"}), 429, {"Retry-After": str(e.retry_after)}
+
+def _load_upload(upload_id):
+    """Decode an upload token and check the caller still holds the case secret.
+
+    Returns (upload, error response).
+    """
+    try:
+        upload = _serializer().loads(upload_id, max_age=CHUNKED_UPLOAD_MAX_AGE)
+    except BadSignature:
+        return None, (jsonify({"error": "Unknown or expired upload."}), 404)
+    if _container_for_secret(request.headers.get('X-Case-Secret')) != upload['container']:
+        return None, (jsonify({"error": "Invalid secret key for this upload."}), 403)
+    return upload, None
+
+@bp.route('', methods=['POST'])
+def init_upload():
+    """
+    Start a chunked upload. Returns the upload id and the chunk size to use.
+    """
+    data = request.get_json(silent=True) or {}
+    container_name = _container_for_secret(data.get('secret'))
+    if not container_name:
+        return jsonify({"error": "Invalid secret key. No matching case found."}), 403
+
+    filename = os.path.basename(str(data.get('filename') or '').replace('\\', '/'))
+    size = data.get('size')
+    if not filename or not isinstance(size, int) or size < 0:
+        return jsonify({"error": "A filename and a size in bytes are required."}), 400
+    chunk_size = max(CHUNKED_UPLOAD_CHUNK_SIZE, -(-size // MAX_CHUNKS))
+    compression = data.get('compression') or None
+    if compression:
+        try:
+            parse_compression(compression)
+        except ValueError as e:
+            return jsonify({"error": f"{e}"}), 400
+
+    # The id is a signed token, so no upload state is kept on the server
+    upload = {
+        "id": uuid.uuid4().hex,
+        "container": container_name,
+        "filename": filename,
+        "size": size,
+        "chunk_size": chunk_size,
+        "compression": compression,
+    }
+    return jsonify({
+        "upload_id": _serializer().dumps(upload),
+        "chunk_size": chunk_size,
+        "chunk_count": chunk_count(size, chunk_size),
+    }), 201
+
+@bp.route('/<upload_id>', methods=['GET'])
+def upload_status(upload_id):
+    """
+    List the chunks received so far, so an interrupted upload can resume.
+    """
+    upload, error = _load_upload(upload_id)
+    if error:
+        return error
+    try:
+        received = received_chunks(upload)
+    except Exception as e:
+        return jsonify({"error": f"Error reading upload status: {e}"}), 500
+    return jsonify({
+        "filename": upload['filename'],
+        "chunk_size": upload['chunk_size'],
+        "chunk_count": chunk_count(upload['size'], upload['chunk_size']),
+        "received": received,
+    }), 200
+
+@bp.route('/<upload_id>/chunks/<int:index>', methods=['PUT'])
+def put_chunk(upload_id, index):
+    """
+    Store one chunk. Chunks may arrive in any order and be retried.
+    """
+    upload, error = _load_upload(upload_id)
+    if error:
+        return error
+    if index >= chunk_count(upload['size'], upload['chunk_size']):
+        return jsonify({"error": "Chunk index out of range."}), 400
+    expected = chunk_length(upload, index)
+    if request.content_length != expected:
+        return jsonify({"error": f"Chunk {index} must be {expected} bytes."}), 400
+
+    # Chunks take the same upload slots as form uploads, and their bodies are read at the same rates
+    try:
+        admission = admit_case(upload['container'])
+    except UploadRejected as e:
+        return _rejected(e)
+    try:
+        parts = []
+        received = 0
+        while received < expected:
+            part = admission.read(request.stream)
+            if not part:
+                break
+            parts.append(part)
+            received += len(part)
+        data = b"".join(parts)
+        if len(data) != expected:
+            return jsonify({"error": f"Chunk {index} must be {expected} bytes."}), 400
+        stage_chunk(upload, index, data)
+    except Exception as e:
+        return jsonify({"error": f"Error storing chunk: {e}"}), 500
+    finally:
+        admission.release()
+    return jsonify({"index": index}), 200
+
+@bp.route('/<upload_id>/commit', methods=['POST'])
+def commit(upload_id):
+    """
+    Assemble the chunks and store the file in the case, zipped and inventoried.
+    The file is stored by a background job, or queued with the upload queue on;
+    either way the job id is returned for the client to poll.
+    """
+    upload, error = _load_upload(upload_id)
+    if error:
+        return error
+    if UPLOAD_QUEUE:
+        try:
+            assemble_upload(upload)
+            job_id = enqueue_staged(upload)
+        except ValueError as e:
+            return jsonify({"error": f"{e}"}), 409
+        except Exception as e:
+            return jsonify({"error": f"Error uploading file: {e}"}), 500
+        return jsonify({"status": "queued", "job_id": job_id}), 202
+    job = get_job(upload['id'])
+    if job is not None and job['status'] != "failed":
+        return _commit_response(upload, job)
+    # The job storing the file holds the upload slots until it ends
+    try:
+        admission = admit_case(upload['container'])
+    except UploadRejected as e:
+        return _rejected(e)
+    try:
+        job = start_commit(upload, admission)
+    except ValueError as e:
+        return jsonify({"error": f"{e}"}), 409
+    except Exception as e:
+        return jsonify({"error": f"Error uploading file: {e}"}), 500
+    return _commit_response(upload, job)
+
+@bp.route('/<upload_id>/commit', methods=['GET'])
+def commit_progress(upload_id):
+    """
+    Report the outcome of a commit; the upload page polls this until the file is stored.
+    """
+    upload, error = _load_upload(upload_id)
+    if error:
+        return error
+    job = get_job(upload['id'])
+    if job is None:
+        return jsonify({"error": "This upload has not been committed."}), 404
+    return _commit_response(upload, job)
+
+def _commit_response(upload, job):
+    if job['status'] in ("queued", "running"):
+        return jsonify({"status": "processing", "job_id": job['id']}), 202
+    if job['status'] == "failed":
+        return jsonify({"error": f"Error uploading file: {job['error']}"}), 500
+    entry = job['result']
+    if entry is None:
+        return jsonify({
+            "status": "duplicate",
+            "message": f"{upload['filename']} was not uploaded because a duplicate already exists.",
+        }), 200
+    return jsonify({
+        "status": "uploaded",
+        "name": entry['name'],
+        "unzipped_hash": entry['unzipped_hash'],
+        "compression": entry.get('compression'),
+        "description": describe_upload(entry),
+    }), 201
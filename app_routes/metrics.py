@@ -0,0 +1,102 @@
+from flask import Blueprint, Response, g, redirect, request, session, url_for
+from services.metrics import finish_profile, render, start_profile
+from utils.auth import login_required
+from collections import OrderedDict
+import cProfile
+import hmac
+import io
+import os
+import pstats
+import threading
+import uuid
+
+bp = Blueprint('metrics', __name__, url_prefix='/metrics')
+
+# Bearer token a Prometheus scraper presents; without one only signed-in admins can read /metrics
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+# A signed-in admin sending this header with the value 1 gets the request profiled
+PROFILE_HEADER = "X-Profile"
+# Profiles kept in memory per worker process
+PROFILE_HISTORY = 20
+# Functions listed in a stored profile
+PROFILE_FUNCTIONS = 40
+
+_profiles = OrderedDict()
+_profiles_lock = threading.Lock()
+
+@bp.route('', methods=['GET'])
+def metrics():
+    """
+    Timings and counters of this worker process for Prometheus.
+    """
+    authorized = METRICS_TOKEN and hmac.compare_digest(
+        request.headers.get("Authorization", "").encode(), f"Bearer {METRICS_TOKEN}".encode()
+    )
+    if not authorized and "user" not in session:
+        if METRICS_TOKEN:
+            return "Unauthorized", 401
+        return redirect(url_for("auth.login"))
+    return Response(render(), mimetype="text/plain; version=0.0.4")
+
+@bp.route('/profiles/<profile_id>', methods=['GET'])
+@login_required
+def get_profile(profile_id):
+    """
+    A stored request profile, by the id returned in its X-Profile-Id header.
+    """
+    with _profiles_lock:
+        profile = _profiles.get(profile_id)
+    if profile is None:
+        return "Profile not found. Profiles are kept per worker process and only for the latest requests.", 404
+    return Response(profile, mimetype="text/plain")
+
+@bp.before_app_request
+def start_request_profile():
+    if request.headers.get(PROFILE_HEADER) != "1" or "user" not in session:
+        return
+    g.profile_token = start_profile()
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+        g.profiler = profiler
+    except ValueError:
+        pass  # Another request holds the interpreter's profiler; record spans only
+
+def _stop_profile():
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+    return profiler, finish_profile(g.pop('profile_token'))
+
+@bp.after_app_request
+def attach_request_profile(response):
+    """Report the spans of a profiled request in Server-Timing and keep its profile for /metrics/profiles."""
+    if 'profile_token' not in g:
+        return response
+    profiler, totals = _stop_profile()
+    response.headers["Server-Timing"] = ", ".join(
+        f'{stage};dur={seconds * 1000:.1f};desc="{runs}x"' for stage, (seconds, runs) in totals.items()
+    )
+
+    report = io.StringIO()
+    report.write(f"{request.method} {request.full_path} -> {response.status}\n\n")
+    for stage, (seconds, runs) in totals.items():
+        report.write(f"{stage:<40} {seconds * 1000:10.1f} ms {runs:6d}x\n")
+    if profiler is not None:
+        # Only this request's thread is profiled; spans cover its worker threads too
+        report.write("\n")
+        pstats.Stats(profiler, stream=report).sort_stats("cumulative").print_stats(PROFILE_FUNCTIONS)
+
+    profile_id = uuid.uuid4().hex
+    with _profiles_lock:
+        _profiles[profile_id] = report.getvalue()
+        while len(_profiles) > PROFILE_HISTORY:
+            _profiles.popitem(last=False)
+    response.headers["X-Profile-Id"] = profile_id
+    return response
+
+@bp.teardown_app_request
+def discard_request_profile(exc):
+    # Requests that never reached after_request still release the profiler
+    if 'profile_token' in g:
+        _stop_profile()
@@ -0,0 +1,323 @@
+"""End-to-end benchmarks of the app on local storage and SQLite.
+
+Drives the upload, download, admin portal and inventory rebuild routes
+through Flask's test client with synthetic artifact sets (many small files,
+a few large ones, and a set with a high share of duplicates), plus
+concurrent writers on one case inventory. Reports throughput, latency
+percentiles and peak RSS per scenario.
+
+    python -m benchmarks.run [--small-files 500] [--large-files 3] [--large-size-mb 32] [--json results.json]
+"""
+import argparse
+import json
+import os
+import random
+import re
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+def configure(workdir, concurrency):
+    """Point the app at a scratch directory; must run before the app is imported."""
+    os.environ.update({
+        "STORAGE_BACKEND": "local",
+        "LOCAL_STORAGE_PATH": os.path.join(workdir, "storage"),
+        "DB_BACKEND": "sqlite",
+        "SQLITE_DATABASE": os.path.join(workdir, "cases.sqlite3"),
+        "UPLOAD_FOLDER": os.path.join(workdir, "uploads"),
+    })
+    os.environ.setdefault("UPLOAD_QUEUE", "0")
+    # Concurrent uploads to one case queue for its slots rather than being turned away
+    os.environ.setdefault("UPLOAD_MAX_WAITING_PER_CASE", str(concurrency))
+
+def peak_rss_mb():
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+class Recorder:
+    """Collects per-operation latencies and bytes moved for one scenario."""
+
+    def __init__(self, name):
+        self.name = name
+        self.latencies = []
+        self.bytes = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+        self._started = time.perf_counter()
+        self.seconds = None
+
+    def record(self, seconds, size=0, ok=True):
+        with self._lock:
+            self.latencies.append(seconds)
+            self.bytes += size
+            self.errors += not ok
+
+    def finish(self):
+        self.seconds = time.perf_counter() - self._started
+        return self
+
+    def summary(self):
+        seconds = self.seconds or 1e-9
+        return {
+            "scenario": self.name,
+            "operations": len(self.latencies),
+            "errors": self.errors,
+            "seconds": round(seconds, 3),
+            "ops_per_second": round(len(self.latencies) / seconds, 1),
+            "mb_per_second": round(self.bytes / seconds / 1e6, 1),
+            "p50_ms": round(percentile(self.latencies, 0.5) * 1000, 1),
+            "p90_ms": round(percentile(self.latencies, 0.9) * 1000, 1),
+            "p99_ms": round(percentile(self.latencies, 0.99) * 1000, 1),
+            "max_ms": round(max(self.latencies, default=0) * 1000, 1),
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+        }
+
+def timed(recorder, func, *args):
+    started = time.perf_counter()
+    try:
+        size, ok = func(*args)
+    except Exception as e:
+        print(f"{recorder.name}: {e}", file=sys.stderr)
+        size, ok = 0, False
+    recorder.record(time.perf_counter() - started, size, ok)
+
+def run_concurrently(recorder, func, items, concurrency):
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in [executor.submit(timed, recorder, func, *item) for item in items]:
+            future.result()
+    return recorder.finish()
+
+def make_dataset(directory, sizes, duplicate_ratio, rng):
+    """Write files of the given sizes, half compressible text and half random, some of them copies."""
+    os.makedirs(directory)
+    paths = []
+    for index, size in enumerate(sizes):
+        path = os.path.join(directory, f"artifact-{index:05d}.bin")
+        if paths and rng.random() < duplicate_ratio:
+            shutil.copyfile(rng.choice(paths), path)
+        else:
+            with open(path, 'wb') as f:
+                remaining = size
+                text = index % 2 == 0
+                while remaining > 0:
+                    block = min(remaining, 1024 * 1024)
+                    if text:
+                        line = f"{index} {rng.random()} event=process_start user=svc host=ws{rng.randint(1, 99)}\n".encode()
+                        f.write((line * (block // len(line) + 1))[:block])
+                    else:
+                        f.write(rng.randbytes(block))
+                    remaining -= block
+        paths.append(path)
+    return paths
+
+def bench_import():
+    """Time importing the app; returns the app and the recorder."""
+    recorder = Recorder("import app")
+    started = time.perf_counter()
+    from app import app
+    recorder.record(time.perf_counter() - started)
+    return app, recorder.finish()
+
+def bench_first_request(app):
+    """Time the first request, which runs the startup tasks."""
+    recorder = Recorder("first request")
+
+    def first_request():
+        response = app.test_client().get('/')
+        return len(response.data), response.status_code == 200
+
+    timed(recorder, first_request)
+    return recorder.finish()
+
+def create_case(client, name):
+    from services.db_service import db_connection
+    client.post('/admin/', data={"case_name": name})
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT container_name, secret FROM Cases WHERE name = ?", (name,))
+        return cursor.fetchone()
+
+def wait_for_upload_job(client, response):
+    """With the upload queue on, follow the queued job until it finishes."""
+    match = re.search(rb'data-job-id="([0-9a-f]{32})"', response.data)
+    while match:
+        job = client.get(f'/upload/jobs/{match.group(1).decode()}').get_json()
+        if job["status"] in ("completed", "failed"):
+            return job["status"] == "completed"
+        time.sleep(0.05)
+    return True
+
+def bench_upload(app, name, secret, paths, batch_size, concurrency):
+    batches = [(paths[start:start + batch_size],) for start in range(0, len(paths), batch_size)]
+
+    def upload(batch):
+        client = app.test_client()
+        files = [(open(path, 'rb'), os.path.basename(path)) for path in batch]
+        try:
+            response = client.post('/upload', data={"secret": secret, "files": files}, content_type='multipart/form-data')
+        finally:
+            for handle, _ in files:
+                handle.close()
+        ok = response.status_code == 200 and b"alert-error" not in response.data and wait_for_upload_job(client, response)
+        return sum(os.path.getsize(path) for path in batch), ok
+
+    return run_concurrently(Recorder(f"upload {name}"), upload, batches, concurrency)
+
+def bench_download(app, name, container_name, concurrency):
+    from services.blob_service import get_blob_service_client
+    from services.inventory_service import INVENTORY_BLOB, INVENTORY_LOG_BLOB
+    blobs = [
+        (blob.name,) for blob in get_blob_service_client().get_container_client(container_name).list_blobs()
+        if blob.name not in (INVENTORY_BLOB, INVENTORY_LOG_BLOB)
+    ]
+
+    def download(blob_name):
+        client = logged_in(app)
+        response = client.get(f'/case/{container_name}/files/{blob_name}')
+        size = sum(len(chunk) for chunk in response.response)
+        response.close()
+        return size, response.status_code == 200
+
+    return run_concurrently(Recorder(f"download {name}"), download, blobs, concurrency)
+
+def bench_admin(app, requests_count, concurrency):
+    def admin_portal(refresh):
+        response = logged_in(app).get('/admin/' + ('?refresh=1' if refresh else ''))
+        return len(response.data), response.status_code == 200
+
+    return run_concurrently(Recorder("admin portal"), admin_portal, [(i % 4 == 0,) for i in range(requests_count)], concurrency)
+
+def bench_rebuild(app, container_names, forget):
+    """Time one inventory rebuild of every case; with forget, drop the inventories first so every blob is re-hashed."""
+    from services.blob_service import get_blob_service_client
+    from services.inventory_service import INVENTORY_BLOB, INVENTORY_LOG_BLOB, forget_inventory
+    if forget:
+        for container_name in container_names:
+            container_client = get_blob_service_client().get_container_client(container_name)
+            for blob_name in (INVENTORY_BLOB, INVENTORY_LOG_BLOB):
+                try:
+                    container_client.delete_blob(blob_name)
+                except Exception:
+                    pass
+            forget_inventory(container_name)
+    recorder = Recorder("rebuild inventories" + (" (cold)" if forget else " (warm)"))
+
+    def rebuild():
+        client = logged_in(app)
+        job_id = client.post('/admin/update_blobinventory').get_json()["job_id"]
+        while True:
+            job = client.get(f'/admin/jobs/{job_id}').get_json()
+            if job["status"] in ("completed", "failed"):
+                return 0, job["status"] == "completed" and not job["result"]["failed"]
+            time.sleep(0.05)
+
+    timed(recorder, rebuild)
+    return recorder.finish()
+
+def bench_inventory_contention(container_name, writers, entries_per_writer):
+    """Several writers, each with its own inventory instance as separate workers would have, adding to one case."""
+    from services.blob_service import get_blob_service_client
+    from services.inventory_service import BlobInventory, get_inventory
+    container_client = get_blob_service_client().get_container_client(container_name)
+    before = len(get_inventory(container_client))
+    items = [(writer, index) for writer in range(writers) for index in range(entries_per_writer)]
+    inventories = [BlobInventory(container_client).refresh() for _ in range(writers)]
+
+    def add(writer, index):
+        inventories[writer].add({"name": f"contention-{writer}-{index}", "unzipped_hash": f"{writer:032x}{index:032x}"})
+        return 0, True
+
+    recorder = run_concurrently(Recorder(f"inventory contention ({writers} writers)"), add, items, writers)
+    lost = before + len(items) - len(BlobInventory(container_client).refresh())
+    if lost:
+        print(f"inventory contention: {lost} entries lost", file=sys.stderr)
+        recorder.errors += lost
+    return recorder
+
+def logged_in(app):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["user"] = {"name": "benchmark"}
+    return client
+
+def print_table(results):
+    columns = ["scenario", "operations", "errors", "seconds", "ops_per_second", "mb_per_second",
+               "p50_ms", "p90_ms", "p99_ms", "max_ms", "peak_rss_mb"]
+    widths = {column: max(len(column), *(len(str(result[column])) for result in results)) for column in columns}
+    print("  ".join(column.ljust(widths[column]) for column in columns))
+    for result in results:
+        print("  ".join(str(result[column]).ljust(widths[column]) for column in columns))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--small-files", type=int, default=500)
+    parser.add_argument("--small-max-kb", type=int, default=64)
+    parser.add_argument("--large-files", type=int, default=3)
+    parser.add_argument("--large-size-mb", type=int, default=32)
+    parser.add_argument("--duplicate-files", type=int, default=300)
+    parser.add_argument("--duplicate-ratio", type=float, default=0.8)
+    parser.add_argument("--batch-size", type=int, default=20, help="files per upload request")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--admin-requests", type=int, default=40)
+    parser.add_argument("--inventory-writers", type=int, default=8)
+    parser.add_argument("--inventory-entries", type=int, default=100, help="entries added per writer")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--workdir", help="scratch directory (default: a temporary one, removed afterwards)")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args(argv)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="artifact-bench-")
+    configure(workdir, args.concurrency)
+    rng = random.Random(args.seed)
+    try:
+        datasets = {
+            "small files": make_dataset(
+                os.path.join(workdir, "data", "small"),
+                [rng.randint(1, args.small_max_kb * 1024) for _ in range(args.small_files)], 0, rng),
+            "large files": make_dataset(
+                os.path.join(workdir, "data", "large"), [args.large_size_mb * 1024 * 1024] * args.large_files, 0, rng),
+            "duplicates": make_dataset(
+                os.path.join(workdir, "data", "duplicates"),
+                [rng.randint(1, args.small_max_kb * 1024) for _ in range(args.duplicate_files)], args.duplicate_ratio, rng),
+        }
+
+        results = []
+        app, recorder = bench_import()
+        results.append(recorder.summary())
+        results.append(bench_first_request(app).summary())
+        admin = logged_in(app)
+        cases = {}
+        for name, paths in datasets.items():
+            container_name, secret = create_case(admin, f"bench {name}")
+            cases[name] = container_name
+            batch_size = 1 if name == "large files" else args.batch_size
+            results.append(bench_upload(app, name, secret, paths, batch_size, args.concurrency).summary())
+        for name, container_name in cases.items():
+            results.append(bench_download(app, name, container_name, args.concurrency).summary())
+        results.append(bench_admin(app, args.admin_requests, args.concurrency).summary())
+        results.append(bench_rebuild(app, list(cases.values()), forget=False).summary())
+        results.append(bench_rebuild(app, list(cases.values()), forget=True).summary())
+        results.append(bench_inventory_contention(
+            cases["small files"], args.inventory_writers, args.inventory_entries).summary())
+
+        print_table(results)
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(results, f, indent=2)
+        return 1 if any(result["errors"] for result in results) else 0
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,134 @@
+"""Serve a stored single-file ZIP with its member renamed, without rewriting the blob.
+
+Content archives name their member after the content hash, so nothing of the
+name a file was first uploaded under is shared with the other cases linking
+to it; downloads and exports put back the name of the case's own file. Only
+the local header and the central directory hold the name. The data between
+them is passed through byte for byte, so Range requests still map onto
+ranges of the stored blob.
+"""
+from azure.core import MatchConditions
+import struct
+
+LOCAL_HEADER_SIGNATURE = b"PK\x03\x04"
+CENTRAL_HEADER_SIGNATURE = b"PK\x01\x02"
+END_SIGNATURE = b"PK\x05\x06"
+ZIP64_END_SIGNATURE = b"PK\x06\x06"
+ZIP64_LOCATOR_SIGNATURE = b"PK\x06\x07"
+LOCAL_HEADER_SIZE = 30
+CENTRAL_HEADER_SIZE = 46
+END_SIZE = 22
+ZIP64_LOCATOR_SIZE = 20
+# General purpose flag marking a UTF-8 member name
+UTF8_FLAG = 0x800
+# Bytes read from each end of the blob to find the headers
+HEADER_READ_SIZE = 64 * 1024
+
+class RenamedArchive:
+    """The bytes of a renamed archive: new headers around the stored member data."""
+
+    def __init__(self, blob_client, etag, head, data_start, data_end, tail):
+        self.blob_client = blob_client
+        self._etag = etag
+        self._parts = [head, (data_start, data_end), tail]
+        self.size = len(head) + data_end - data_start + len(tail)
+
+    def chunks(self, offset=0, length=None):
+        """Yield the bytes in [offset, offset + length), reading the member data from the blob."""
+        end = self.size if length is None else min(self.size, offset + length)
+        position = 0
+        for part in self._parts:
+            part_size = len(part) if isinstance(part, bytes) else part[1] - part[0]
+            start, stop = max(offset, position) - position, min(end, position + part_size) - position
+            if start < stop:
+                if isinstance(part, bytes):
+                    yield part[start:stop]
+                else:
+                    yield from self.blob_client.download_blob(
+                        offset=part[0] + start, length=stop - start,
+                        etag=self._etag, match_condition=MatchConditions.IfNotModified,
+                    ).chunks()
+            position += part_size
+
+def _read(blob_client, etag, offset, length):
+    return blob_client.download_blob(
+        offset=offset, length=length, etag=etag, match_condition=MatchConditions.IfNotModified
+    ).readall()
+
+def rename_member(blob_client, properties, name):
+    """Return a RenamedArchive of the blob with its only member called name.
+
+    Returns None if the blob is not a ZIP holding exactly one member, which
+    is then served as it is stored.
+    """
+    size, etag = properties.size, properties.etag
+    new_name = name.encode('utf-8')
+    if size < LOCAL_HEADER_SIZE + CENTRAL_HEADER_SIZE + END_SIZE or len(new_name) > 0xFFFF:
+        return None
+
+    head = _read(blob_client, etag, 0, min(size, HEADER_READ_SIZE))
+    if head[:4] != LOCAL_HEADER_SIGNATURE:
+        return None
+    flags, = struct.unpack_from("<H", head, 6)
+    name_length, extra_length = struct.unpack_from("<HH", head, 26)
+    data_start = LOCAL_HEADER_SIZE + name_length + extra_length
+    if data_start > len(head):
+        return None
+    old_name = head[LOCAL_HEADER_SIZE:LOCAL_HEADER_SIZE + name_length]
+
+    tail_start = max(0, size - HEADER_READ_SIZE)
+    tail = head[tail_start:] if size <= len(head) else _read(blob_client, etag, tail_start, size - tail_start)
+    # Archives written by this app have no comment, so the end record closes the blob
+    end = len(tail) - END_SIZE
+    signature, _, _, _, entries, directory_size, directory_offset, comment_length = struct.unpack_from(
+        "<4sHHHHIIH", tail, end
+    )
+    if signature != END_SIGNATURE or comment_length:
+        return None
+    zip64_end = None
+    locator = end - ZIP64_LOCATOR_SIZE
+    if locator >= 0 and tail[locator:locator + 4] == ZIP64_LOCATOR_SIGNATURE:
+        # ZIP64 end records, which readers prefer over the classic one
+        zip64_end_offset, = struct.unpack_from("<Q", tail, locator + 8)
+        zip64_end = zip64_end_offset - tail_start
+        if zip64_end < 0 or tail[zip64_end:zip64_end + 4] != ZIP64_END_SIGNATURE:
+            return None
+        entries, directory_size, directory_offset = struct.unpack_from("<QQQ", tail, zip64_end + 32)
+    directory = directory_offset - tail_start
+    if entries != 1 or directory < 0 or tail[directory:directory + 4] != CENTRAL_HEADER_SIGNATURE:
+        return None
+
+    central_name_length, central_extra_length, comment_length = struct.unpack_from("<HHH", tail, directory + 28)
+    local_header_offset, = struct.unpack_from("<I", tail, directory + 42)
+    entry_end = directory + CENTRAL_HEADER_SIZE + central_name_length + central_extra_length + comment_length
+    central_name = tail[directory + CENTRAL_HEADER_SIZE:directory + CENTRAL_HEADER_SIZE + central_name_length]
+    if central_name != old_name or local_header_offset != 0 or entry_end != directory + directory_size:
+        return None
+
+    delta = len(new_name) - len(old_name)
+    flags = flags | UTF8_FLAG if not new_name.isascii() else flags & ~UTF8_FLAG
+    new_head = b"".join([
+        head[:6], struct.pack("<H", flags), head[8:26], struct.pack("<HH", len(new_name), extra_length),
+        new_name, head[LOCAL_HEADER_SIZE + name_length:data_start],
+    ])
+    central_flags, = struct.unpack_from("<H", tail, directory + 8)
+    central_flags = central_flags | UTF8_FLAG if not new_name.isascii() else central_flags & ~UTF8_FLAG
+    records = bytearray(tail[entry_end:])
+    if zip64_end is not None:
+        zip64_end -= entry_end
+        struct.pack_into("<QQ", records, zip64_end + 40, directory_size + delta, directory_offset + delta)
+        struct.pack_into("<Q", records, locator - entry_end + 8, zip64_end_offset + 2 * delta)
+    end -= entry_end
+    # Directory size and offset, unless they are ZIP64 placeholders
+    for field in (end + 12, end + 16):
+        value, = struct.unpack_from("<I", records, field)
+        if value != 0xFFFFFFFF:
+            if value + delta >= 0xFFFFFFFF:
+                return None
+            struct.pack_into("<I", records, field, value + delta)
+    new_tail = b"".join([
+        tail[directory:directory + 8], struct.pack("<H", central_flags), tail[directory + 10:directory + 28],
+        struct.pack("<H", len(new_name)), tail[directory + 30:directory + CENTRAL_HEADER_SIZE], new_name,
+        tail[directory + CENTRAL_HEADER_SIZE + central_name_length:entry_end], bytes(records),
+    ])
+    return RenamedArchive(blob_client, etag, new_head, data_start, directory_offset, new_tail)
@@ -1,18 +1,179 @@
-from azure.storage.blob import BlobServiceClient
+from azure.storage.blob import BlobServiceClient, BlobBlock, BlobSasPermissions, generate_blob_sas
 from azure.identity import DefaultAzureCredential
+from azure.core import MatchConditions
+from services.local_storage import LocalBlobServiceClient
+from services.metrics import BYTES_TRANSFERRED, count, count_azure_call, span
+from datetime import datetime, timedelta, timezone
+import base64
+import hashlib
+import io
 import os
 import re
 import secrets
+import threading
+
+# Size of each staged block; bounds the memory held per in-flight upload.
+BLOCK_SIZE = int(os.environ.get("UPLOAD_CHUNK_SIZE", 4 * 1024 * 1024))
+
+# Lifetime of the SAS URLs handed out for direct downloads
+DOWNLOAD_SAS_TTL = int(os.environ.get("DOWNLOAD_SAS_TTL", 300))
+
+# "azure", or "local" to keep blobs in a directory tree for development and benchmarks
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "azure")
+LOCAL_STORAGE_PATH = os.environ.get("LOCAL_STORAGE_PATH", "./storage")
 
 STORAGE_ACCOUNT_URL = os.environ.get("STORAGE_ACCOUNT_URL")
-blob_service_client = BlobServiceClient(
-    account_url=STORAGE_ACCOUNT_URL,
-    credential=DefaultAzureCredential()
-)
+
+_credential = None
+_blob_service_client = None
+_blob_service_client_lock = threading.Lock()
+
+def get_blob_service_client():
+    """Return the shared BlobServiceClient, created on first use rather than at import."""
+    global _credential, _blob_service_client
+    if _blob_service_client is None:
+        with _blob_service_client_lock:
+            if _blob_service_client is None:
+                if STORAGE_BACKEND == "local":
+                    _blob_service_client = LocalBlobServiceClient(LOCAL_STORAGE_PATH, max_chunk_get_size=BLOCK_SIZE)
+                else:
+                    _credential = DefaultAzureCredential()
+                    _blob_service_client = BlobServiceClient(
+                        account_url=STORAGE_ACCOUNT_URL,
+                        credential=_credential,
+                        # Downloads are streamed chunk by chunk, so keep the first GET as small as the rest
+                        max_single_get_size=BLOCK_SIZE,
+                        max_chunk_get_size=BLOCK_SIZE,
+                        raw_response_hook=count_azure_call,
+                    )
+    return _blob_service_client
+
+_user_delegation_key = None
+_user_delegation_key_lock = threading.Lock()
 
 def generate_secret():
     return '-'.join(f"{secrets.randbelow(10000):04}" for _ in range(4))
 
 def create_container(container_name):
-    container_client = blob_service_client.get_container_client(container_name)
-    container_client.create_container()
\ No newline at end of file
+    container_client = get_blob_service_client().get_container_client(container_name)
+    container_client.create_container()
+
+def get_user_delegation_key():
+    """Return a user delegation key for signing SAS URLs, renewed an hour before it expires."""
+    global _user_delegation_key
+    with _user_delegation_key_lock:
+        now = datetime.now(timezone.utc)
+        if _user_delegation_key is None or _user_delegation_key[1] - now < timedelta(hours=1):
+            expiry = now + timedelta(hours=6)
+            key = get_blob_service_client().get_user_delegation_key(now - timedelta(minutes=5), expiry)
+            _user_delegation_key = (key, expiry)
+        return _user_delegation_key[0]
+
+def generate_download_url(container_name, blob_name, filename=None, ttl=DOWNLOAD_SAS_TTL):
+    """Return a short-lived, read-only SAS URL for downloading a blob directly from storage."""
+    blob_service_client = get_blob_service_client()
+    now = datetime.now(timezone.utc)
+    sas = generate_blob_sas(
+        account_name=blob_service_client.account_name,
+        container_name=container_name,
+        blob_name=blob_name,
+        user_delegation_key=get_user_delegation_key(),
+        permission=BlobSasPermissions(read=True),
+        start=now - timedelta(minutes=5),
+        expiry=now + timedelta(seconds=ttl),
+        content_disposition=f"attachment; filename={filename or blob_name}",
+    )
+    return f"{blob_service_client.get_blob_client(container_name, blob_name).url}?{sas}"
+
+class BlockBlobWriter(io.RawIOBase):
+    """Writable stream that stages its data as blocks of a block blob.
+
+    Data is hashed as it is written and flushed to storage every BLOCK_SIZE
+    bytes, so only one block is ever buffered. Nothing is visible in the
+    container until commit() writes the block list.
+    """
+
+    def __init__(self, blob_client, block_size=BLOCK_SIZE):
+        self.blob_client = blob_client
+        self.block_size = block_size
+        self.size = 0
+        self._buffer = bytearray()
+        self._blocks = []
+        self._digest = hashlib.sha256()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._buffer += data
+        self._digest.update(data)
+        self.size += len(data)
+        while len(self._buffer) >= self.block_size:
+            self._stage_block(bytes(self._buffer[:self.block_size]))
+            del self._buffer[:self.block_size]
+        return len(data)
+
+    def tell(self):
+        return self.size
+
+    def _stage_block(self, data):
+        block_id = base64.b64encode(f"{len(self._blocks):08d}".encode()).decode()
+        with span("storage.stage_block"):
+            self.blob_client.stage_block(block_id, data)
+        count(BYTES_TRANSFERRED, len(data), direction="upload")
+        self._blocks.append(BlobBlock(block_id=block_id))
+
+    def commit(self, **kwargs):
+        """Stage any buffered remainder and commit the block list."""
+        if self._buffer:
+            self._stage_block(bytes(self._buffer))
+            self._buffer.clear()
+        with span("storage.commit_blocks"):
+            return self.blob_client.commit_block_list(self._blocks, **kwargs)
+
+    def hexdigest(self):
+        return self._digest.hexdigest()
+
+class BlobReader(io.RawIOBase):
+    """Seekable, read-only stream over a committed blob.
+
+    Each read is a ranged GET pinned to the blob's ETag, so the blob can be
+    hashed and unzipped in place without downloading it to the worker first.
+    """
+
+    def __init__(self, blob_client):
+        properties = blob_client.get_blob_properties()
+        self.blob_client = blob_client
+        self.size = properties.size
+        self._etag = properties.etag
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError("negative seek position")
+        self._position = offset
+        return self._position
+
+    def readinto(self, buffer):
+        length = min(len(buffer), self.size - self._position)
+        if length <= 0:
+            return 0
+        data = self.blob_client.download_blob(
+            offset=self._position, length=length, etag=self._etag, match_condition=MatchConditions.IfNotModified
+        ).readall()
+        buffer[:len(data)] = data
+        self._position += len(data)
+        return len(data)
@@ -0,0 +1,174 @@
+from azure.core.exceptions import ResourceExistsError, ResourceNotFoundError
+from services.blob_service import get_blob_service_client
+from services.content_store import linked_content, release_reference
+from services.db_service import db_connection
+from services.inventory_service import forget_inventory
+from services.job_service import get_job, start_job
+from services.secret_cache import secret_cache
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timedelta
+import os
+import time
+import traceback
+
+# A batch request deletes at most 256 blobs
+DELETE_BATCH_SIZE = 256
+# Batch requests in flight at once while a case is deleted
+CASE_DELETE_WORKERS = int(os.environ.get("CASE_DELETE_WORKERS", 8))
+# A deletion whose job has not reported progress for this long is taken to have died with its worker
+STALE_DELETION = timedelta(minutes=5)
+# Further attempts, this many seconds apart, to release the content of a deleted link
+RELEASE_RETRY_DELAYS = (1, 5, 15)
+
+def ensure_deletion_column(cursor):
+    """Add the column recording a case's running deletion job to the Cases table if it is missing."""
+    cursor.execute(
+        "IF COL_LENGTH('Cases', 'delete_job') IS NULL "
+        "ALTER TABLE Cases ADD delete_job CHAR(32) NULL"
+    )
+
+def _release(blob):
+    """Release the content a deleted link referenced. Returns False if that failed."""
+    content_hash = linked_content(blob)
+    if content_hash:
+        try:
+            release_reference(content_hash)
+        except Exception:
+            traceback.print_exc()
+            return False
+    return True
+
+def _delete_batch(container_client, blobs):
+    """Delete one batch of blobs and release the content their links referenced, blob by blob.
+
+    Blobs already gone count as deleted. Returns the number that could not be
+    deleted and the deleted links whose content could not be released.
+    """
+    responses = container_client.delete_blobs(*(blob.name for blob in blobs), raise_on_any_failure=False)
+    failed = 0
+    unreleased = []
+    for blob, response in zip(blobs, responses):
+        if response.status_code == 202:
+            if not _release(blob):
+                unreleased.append(blob)
+        elif response.status_code != 404:
+            failed += 1
+    return failed, unreleased
+
+def _retry_releases(container_client, blobs):
+    """Retry releasing the content of deleted links; returns the number still unreleased.
+
+    A link whose content still cannot be released is put back, so that the
+    next deletion of the case lists it and releases it then.
+    """
+    for delay in RELEASE_RETRY_DELAYS:
+        if not blobs:
+            break
+        time.sleep(delay)
+        blobs = [blob for blob in blobs if not _release(blob)]
+    for blob in blobs:
+        try:
+            container_client.get_blob_client(blob.name).upload_blob(b"", metadata=blob.metadata)
+        except ResourceExistsError:
+            pass
+        except Exception:
+            traceback.print_exc()
+    return len(blobs)
+
+def delete_case_storage(job, container_name):
+    """Delete every blob of a case in parallel batches, then its container and its Cases row.
+
+    Only what is still listed is deleted, so running it again after a failure
+    resumes where the last attempt stopped. The Cases row is kept until the
+    container is gone.
+    """
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("UPDATE Cases SET delete_job = ? WHERE container_name = ?", (job.id, container_name))
+        conn.commit()
+    # The case's secret stops working once it is marked for deletion
+    secret_cache.invalidate_container(container_name)
+
+    container_client = get_blob_service_client().get_container_client(container_name)
+    failed = 0
+    unreleased = []
+    try:
+        pages = container_client.list_blobs(include=['metadata'], results_per_page=DELETE_BATCH_SIZE).by_page()
+        with ThreadPoolExecutor(max_workers=CASE_DELETE_WORKERS) as executor:
+            pending = {}
+            for page in pages:
+                blobs = list(page)
+                if not blobs:
+                    continue
+                job.add_total(len(blobs))
+                # Keep listing only a little ahead of the deletes
+                while len(pending) >= CASE_DELETE_WORKERS * 2:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    failed += _collect(job, pending, done, unreleased)
+                pending[executor.submit(_delete_batch, container_client, blobs)] = len(blobs)
+            failed += _collect(job, pending, list(pending), unreleased)
+    except ResourceNotFoundError:
+        pass  # The container is already gone
+    if unreleased:
+        still_unreleased = _retry_releases(container_client, unreleased)
+        if len(unreleased) - still_unreleased:
+            job.advance(len(unreleased) - still_unreleased)
+        if still_unreleased:
+            job.advance(still_unreleased, failed=True)
+        failed += still_unreleased
+    if failed:
+        raise RuntimeError(f"{failed} files could not be deleted. Delete the case again to retry.")
+
+    try:
+        container_client.delete_container()
+    except ResourceNotFoundError:
+        pass
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM Cases WHERE container_name = ?", (container_name,))
+        conn.commit()
+    secret_cache.invalidate_container(container_name)
+    forget_inventory(container_name)
+    job.message = f"Deleted case {container_name}"
+    return {"deleted": job.done - job.failed}
+
+def _collect(job, pending, done, unreleased):
+    """Record finished batches; deleted links whose content is still to be released go to unreleased."""
+    failed = 0
+    for future in done:
+        count = pending.pop(future)
+        try:
+            batch_failed, batch_unreleased = future.result()
+        except Exception:
+            batch_failed, batch_unreleased = count, []
+        unreleased += batch_unreleased
+        if count - batch_failed - len(batch_unreleased):
+            job.advance(count - batch_failed - len(batch_unreleased))
+        if batch_failed:
+            job.advance(batch_failed, failed=True)
+        failed += batch_failed
+    return failed
+
+def _running(job_id):
+    job = get_job(job_id) if job_id else None
+    if job is None or job['status'] not in ("queued", "running"):
+        return False
+    updated_at = datetime.fromisoformat(job['updated_at'].rstrip('Z'))
+    return datetime.utcnow() - updated_at < STALE_DELETION
+
+def start_case_deletion(container_name):
+    """Start deleting a case in the background, or return its deletion already in progress.
+
+    Returns the job id, or None if there is no such case.
+    """
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT delete_job FROM Cases WHERE container_name = ?", (container_name,))
+        result = cursor.fetchone()
+    if not result:
+        return None
+    delete_job = result[0].strip() if result[0] else None
+    if _running(delete_job):
+        return delete_job
+    job = start_job("delete_case", delete_case_storage, container_name, params={"container_name": container_name})
+    return job.id
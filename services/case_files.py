@@ -0,0 +1,121 @@
+from services.content_store import stored_size
+from services.inventory_service import get_inventory, INVENTORY_BLOB, INVENTORY_LOG_BLOB
+from datetime import datetime, timezone
+import base64
+import bisect
+import json
+import os
+
+# Files returned per page of the case file listing unless the caller asks for fewer
+CASE_FILES_PAGE_SIZE = int(os.environ.get("CASE_FILES_PAGE_SIZE", 200))
+MAX_PAGE_SIZE = 1000
+SORT_KEYS = ("name", "size", "date")
+
+def encode_cursor(cursor):
+    return base64.urlsafe_b64encode(json.dumps(cursor, separators=(',', ':')).encode()).decode()
+
+def decode_cursor(token):
+    """Return the cursor a page token was made from; raises ValueError for a malformed token."""
+    try:
+        cursor = json.loads(base64.urlsafe_b64decode(token.encode()))
+    except Exception:
+        raise ValueError("Invalid cursor.")
+    if not isinstance(cursor, dict):
+        raise ValueError("Invalid cursor.")
+    return cursor
+
+def parse_date(value):
+    """Parse an ISO date or timestamp, taking naive values as UTC."""
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+def _entry_date(entry):
+    try:
+        return parse_date(entry['upload_date'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+def _file(entry, date=None):
+    return {
+        "name": entry['name'],
+        "size": entry.get('stored_size', entry.get('size')),
+        "original_size": entry.get('size'),
+        "unzipped_hash": entry.get('unzipped_hash'),
+        "upload_date": date.isoformat() if date else entry.get('upload_date'),
+    }
+
+def _sort_key(entry, sort):
+    if sort == "size":
+        return [entry.get('stored_size') or 0, entry['name']]
+    if sort == "date":
+        date = _entry_date(entry)
+        return [date.timestamp() if date else 0, entry['name']]
+    return [entry['name']]
+
+def _list_from_storage(container_client, inventory, prefix, limit, token):
+    """One page of a plain name listing, straight from the container's continuation tokens."""
+    pages = container_client.list_blobs(
+        name_starts_with=prefix or None, include=['metadata'], results_per_page=limit
+    ).by_page(continuation_token=token)
+    page = next(pages, [])
+    files = []
+    for blob in page:
+        if blob.name in (INVENTORY_BLOB, INVENTORY_LOG_BLOB):
+            continue
+        entry = inventory.get(blob.name) or {"name": blob.name, "upload_date": blob.last_modified.isoformat()}
+        files.append(dict(_file(entry), size=stored_size(blob)))
+    next_token = getattr(pages, 'continuation_token', None)
+    return files, encode_cursor({"token": next_token}) if next_token else None
+
+def _list_from_inventory(inventory, prefix, search, min_size, max_size, since, until, sort, descending, limit, after):
+    """One page of a filtered, sorted listing from the inventory, paged by the last key returned."""
+    search = search.lower() if search else None
+    matched = []
+    for entry in inventory.entries():
+        name = entry['name']
+        if prefix and not name.startswith(prefix):
+            continue
+        if search and search not in name.lower():
+            continue
+        size = entry.get('stored_size') or 0
+        if min_size is not None and size < min_size or max_size is not None and size > max_size:
+            continue
+        if since or until:
+            date = _entry_date(entry)
+            if date is None or since and date < since or until and date >= until:
+                continue
+        matched.append((_sort_key(entry, sort), entry))
+    matched.sort(key=lambda item: item[0])
+    keys = [key for key, _ in matched]
+
+    if descending:
+        end = bisect.bisect_left(keys, after) if after is not None else len(matched)
+        page = matched[max(0, end - limit):end][::-1]
+        more = end - limit > 0
+    else:
+        start = bisect.bisect_right(keys, after) if after is not None else 0
+        page = matched[start:start + limit]
+        more = start + limit < len(matched)
+    files = [_file(entry, _entry_date(entry)) for _, entry in page]
+    return files, encode_cursor({"after": page[-1][0]}) if page and more else None
+
+def list_files(container_client, prefix=None, search=None, min_size=None, max_size=None, since=None, until=None,
+               sort="name", descending=False, limit=CASE_FILES_PAGE_SIZE, cursor=None):
+    """Return (files, next cursor) for one page of a case's files.
+
+    A name-ordered listing, optionally by prefix, pages through the container
+    itself; searching, size or date filters and other orders are answered
+    from the inventory. Pass the returned cursor, with the same filters, to
+    get the next page; it is None on the last page.
+    """
+    if sort not in SORT_KEYS:
+        raise ValueError(f"Unknown sort: {sort}. Use one of {', '.join(SORT_KEYS)}.")
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    cursor = decode_cursor(cursor) if cursor else {}
+    inventory = get_inventory(container_client)
+    filtered = search or min_size is not None or max_size is not None or since or until
+    if sort == "name" and not descending and not filtered and "after" not in cursor:
+        return _list_from_storage(container_client, inventory, prefix, limit, cursor.get("token"))
+    return _list_from_inventory(
+        inventory, prefix, search, min_size, max_size, since, until, sort, descending, limit, cursor.get("after")
+    )
@@ -0,0 +1,76 @@
+from azure.core.exceptions import ResourceNotFoundError
+from services.blob_service import get_blob_service_client
+from services.db_service import db_connection
+from services.content_store import stored_size
+from services.inventory_service import INVENTORY_BLOB, INVENTORY_LOG_BLOB
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import os
+
+# Stored statistics older than this are recomputed from the container listing
+CASE_STATS_MAX_AGE = timedelta(seconds=float(os.environ.get("CASE_STATS_MAX_AGE", 3600)))
+CASE_STATS_WORKERS = int(os.environ.get("CASE_STATS_WORKERS", 8))
+
+def ensure_stats_columns(cursor):
+    """Add the statistics columns to the Cases table if they are missing."""
+    cursor.execute(
+        "IF COL_LENGTH('Cases', 'file_count') IS NULL "
+        "ALTER TABLE Cases ADD file_count BIGINT NULL, total_size BIGINT NULL, stats_updated_at DATETIME2 NULL"
+    )
+
+def is_stale(stats_updated_at):
+    return stats_updated_at is None or datetime.utcnow() - stats_updated_at > CASE_STATS_MAX_AGE
+
+def record_change(container_name, file_count, total_size):
+    """Apply an upload (positive) or delete (negative) to a case's stored statistics."""
+    if not file_count:
+        return
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "UPDATE Cases SET file_count = file_count + ?, total_size = total_size + ? "
+            "WHERE container_name = ? AND file_count IS NOT NULL",
+            (file_count, total_size, container_name),
+        )
+        conn.commit()
+
+def compute_stats(container_name):
+    """Count the files in a container and sum their size from a full listing."""
+    container_client = get_blob_service_client().get_container_client(container_name)
+    file_count = 0
+    total_size = 0
+    try:
+        for blob in container_client.list_blobs(include=['metadata']):
+            if blob.name in (INVENTORY_BLOB, INVENTORY_LOG_BLOB):
+                continue
+            file_count += 1
+            total_size += stored_size(blob)
+    except ResourceNotFoundError:
+        pass
+    return file_count, total_size
+
+def refresh_stats(container_names):
+    """Recompute the statistics of several cases concurrently and store them.
+
+    Lists up to CASE_STATS_WORKERS containers at a time, each on a thread of
+    its own through the shared client. Returns a mapping of container name
+    to (file_count, total_size).
+    """
+    if not container_names:
+        return {}
+    with ThreadPoolExecutor(max_workers=CASE_STATS_WORKERS) as executor:
+        stats = dict(zip(container_names, executor.map(compute_stats, container_names)))
+    store_stats(stats)
+    return stats
+
+def store_stats(stats):
+    """Save recomputed statistics, a mapping of container name to (file_count, total_size)."""
+    now = datetime.utcnow()
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        for container_name, (file_count, total_size) in stats.items():
+            cursor.execute(
+                "UPDATE Cases SET file_count = ?, total_size = ?, stats_updated_at = ? WHERE container_name = ?",
+                (file_count, total_size, now, container_name),
+            )
+        conn.commit()
@@ -0,0 +1,149 @@
+from azure.core.exceptions import ResourceExistsError, ResourceNotFoundError
+from azure.storage.blob import BlobBlock
+from services.blob_service import get_blob_service_client, BlobReader
+from services.case_stats import record_change
+from services.compression_service import get_case_compression
+from services.inventory_service import get_inventory
+from services.job_service import get_job, start_job
+from services.upload_service import UploadBatch, process_file, start_verification
+import base64
+import io
+import os
+
+# Size of each chunk the browser sends; each one is staged as one block
+CHUNKED_UPLOAD_CHUNK_SIZE = int(os.environ.get("CHUNKED_UPLOAD_CHUNK_SIZE", 8 * 1024 * 1024))
+# Raw uploads are assembled here, outside the case containers, until they are processed
+CHUNKED_UPLOAD_STAGING_CONTAINER = os.environ.get("CHUNKED_UPLOAD_STAGING_CONTAINER", "upload-staging")
+# Storage discards uncommitted blocks after seven days, so uploads cannot be resumed later than that
+CHUNKED_UPLOAD_MAX_AGE = int(os.environ.get("CHUNKED_UPLOAD_MAX_AGE", 7 * 24 * 3600))
+# A block blob holds at most 50,000 blocks
+MAX_CHUNKS = 50000
+# Read buffer for the staged blob; larger reads go straight to ranged GETs
+STAGED_READ_BUFFER = 256 * 1024
+
+_container_ready = False
+
+def _staging_container():
+    global _container_ready
+    container_client = get_blob_service_client().get_container_client(CHUNKED_UPLOAD_STAGING_CONTAINER)
+    if not _container_ready:
+        try:
+            container_client.create_container()
+        except ResourceExistsError:
+            pass
+        _container_ready = True
+    return container_client
+
+def staging_blob(upload_id):
+    return _staging_container().get_blob_client(upload_id)
+
+def chunk_count(size, chunk_size):
+    return -(-size // chunk_size)
+
+def chunk_length(upload, index):
+    """Expected length of a chunk; only the last one may be short."""
+    return min(upload['chunk_size'], upload['size'] - index * upload['chunk_size'])
+
+def block_id(index):
+    return base64.b64encode(f"{index:08d}".encode()).decode()
+
+def block_index(block_name):
+    return int(base64.b64decode(block_name).decode())
+
+def stage_chunk(upload, index, data):
+    """Stage one chunk as a block of the upload's staging blob."""
+    staging_blob(upload['id']).stage_block(block_id(index), data, length=len(data), validate_content=True)
+
+def _parse_blocks(upload, committed, uncommitted):
+    return bool(committed), sorted({
+        block_index(block.id) for block in uncommitted
+        if block.size == chunk_length(upload, block_index(block.id))
+    })
+
+def _staged_blocks(upload):
+    """Return (already committed, staged chunk indexes) from one block list request."""
+    try:
+        committed, uncommitted = staging_blob(upload['id']).get_block_list('all')
+    except ResourceNotFoundError:
+        return False, []
+    return _parse_blocks(upload, committed, uncommitted)
+
+def _received(upload, committed, received):
+    if committed:
+        # Already assembled by an earlier commit attempt
+        return list(range(chunk_count(upload['size'], upload['chunk_size'])))
+    return received
+
+def received_chunks(upload):
+    """Return the sorted indexes of the chunks staged so far."""
+    return _received(upload, *_staged_blocks(upload))
+
+def assemble_upload(upload):
+    """Commit the staged chunks as one blob, unless an earlier attempt already did.
+
+    Raises ValueError if chunks are still missing.
+    """
+    count = chunk_count(upload['size'], upload['chunk_size'])
+    committed, received = _staged_blocks(upload)
+    if not committed:
+        missing = sorted(set(range(count)) - set(received))
+        if missing:
+            raise ValueError(f"Missing chunks: {', '.join(map(str, missing[:20]))}")
+        staging_blob(upload['id']).commit_block_list([BlobBlock(block_id=block_id(index)) for index in range(count)])
+
+def open_staged(upload_id):
+    """Open an assembled upload as a seekable stream read in place from storage."""
+    return io.BufferedReader(BlobReader(staging_blob(upload_id)), buffer_size=STAGED_READ_BUFFER)
+
+def commit_upload(job, upload, admission=None):
+    """Hash, zip and store an assembled upload in its case; runs as a background job.
+
+    The upload's id keys the link blob, so a run that overlaps or repeats an
+    earlier one links the file once. The upload slots in admission are held
+    until the file is stored. Returns the new inventory entry, or None if
+    the content is already stored.
+    """
+    try:
+        return _store_staged(upload)
+    finally:
+        if admission is not None:
+            admission.release()
+
+def _store_staged(upload):
+    container_client = get_blob_service_client().get_container_client(upload['container'])
+    inventory = get_inventory(container_client)
+    compression = upload.get('compression') or get_case_compression(upload['container'])
+    with open_staged(upload['id']) as stream:
+        entry = process_file(UploadBatch(container_client, inventory, compression), stream, upload['filename'], upload['id'])
+    if entry:
+        inventory.add(entry)
+        record_change(upload['container'], 1, entry['stored_size'])
+        start_verification(upload['container'], [entry])
+    try:
+        staging_blob(upload['id']).delete_blob()
+    except ResourceNotFoundError:
+        pass
+    return entry
+
+def start_commit(upload, admission=None):
+    """Assemble the staged chunks and start storing the file, unless that already started.
+
+    The job takes the upload's id, so committing again reports the first
+    commit rather than storing the file twice. The job releases admission
+    when it ends; it is released at once if no job is started. Returns the
+    job status. Raises ValueError if chunks are still missing.
+    """
+    started = False
+    try:
+        job = get_job(upload['id'])
+        if job is not None and job['status'] != "failed":
+            return job
+        assemble_upload(upload)
+        params = {"container": upload['container'], "filename": upload['filename']}
+        job = start_job("commit_upload", commit_upload, upload, admission, job_id=upload['id'], params=params)
+        # Otherwise this worker started the same commit meanwhile, and that job is returned
+        started = job.params is params
+        return job.to_dict()
+    finally:
+        if admission is not None and not started:
+            admission.release()
@@ -0,0 +1,85 @@
+from services.db_service import db_connection
+import os
+import zipfile
+import zlib
+
+# ZIP compression methods by name; Zstandard needs a Python whose zipfile supports it
+CODECS = {
+    "store": zipfile.ZIP_STORED,
+    "deflate": zipfile.ZIP_DEFLATED,
+    "bzip2": zipfile.ZIP_BZIP2,
+    "lzma": zipfile.ZIP_LZMA,
+}
+if hasattr(zipfile, "ZIP_ZSTANDARD"):
+    CODECS["zstd"] = zipfile.ZIP_ZSTANDARD
+# Valid compresslevel values per codec; LZMA and store take none
+LEVELS = {"deflate": range(0, 10), "bzip2": range(1, 10), "zstd": range(-7, 23)}
+
+# Compression used unless the case or the upload asks for another, as codec[:level]
+DEFAULT_COMPRESSION = os.environ.get("COMPRESSION", "deflate:6")
+# Store files whose sampled data does not compress instead of burning CPU on them
+COMPRESSION_SKIP_INCOMPRESSIBLE = os.environ.get("COMPRESSION_SKIP_INCOMPRESSIBLE", "1") == "1"
+# Samples spread over the file, compressed at the fastest level to estimate the ratio
+SAMPLE_COUNT = 8
+SAMPLE_SIZE = 64 * 1024
+INCOMPRESSIBLE_RATIO = 0.97
+
+# Choices offered on the admin and upload pages
+COMPRESSION_CHOICES = [
+    ("deflate:1", "Fast"),
+    ("deflate:6", "Balanced"),
+    ("deflate:9", "Best"),
+    ("lzma", "LZMA"),
+    ("store", "None"),
+] + ([("zstd:3", "Zstandard")] if "zstd" in CODECS else [])
+
+def parse_compression(spec):
+    """Return (codec, level) for a 'codec[:level]' spec such as 'deflate:1' or 'store'.
+
+    Raises ValueError for an unknown codec or a level it does not accept.
+    """
+    codec, _, level = spec.strip().lower().partition(':')
+    if codec not in CODECS:
+        raise ValueError(f"Unknown compression: {spec}. Use one of {', '.join(CODECS)}.")
+    if not level:
+        return codec, None
+    if codec not in LEVELS or not level.lstrip('-').isdigit() or int(level) not in LEVELS[codec]:
+        raise ValueError(f"Invalid compression level for {codec}: {level}")
+    return codec, int(level)
+
+def looks_incompressible(stream):
+    """Estimate from a few samples whether compressing the stream would save space, then rewind it."""
+    size = stream.seek(0, os.SEEK_END)
+    step = max(size // SAMPLE_COUNT, SAMPLE_SIZE)
+    sampled = compressed = 0
+    try:
+        for offset in range(0, size, step):
+            stream.seek(offset)
+            sample = stream.read(SAMPLE_SIZE)
+            sampled += len(sample)
+            compressed += len(zlib.compress(sample, 1))
+    finally:
+        stream.seek(0)
+    return sampled > 0 and compressed >= sampled * INCOMPRESSIBLE_RATIO
+
+def choose_compression(stream, spec=None):
+    """Return the (codec, level) to store the stream with."""
+    codec, level = parse_compression(spec or DEFAULT_COMPRESSION)
+    if codec != "store" and COMPRESSION_SKIP_INCOMPRESSIBLE and looks_incompressible(stream):
+        return "store", None
+    return codec, level
+
+def ensure_compression_column(cursor):
+    """Add the per-case compression column to the Cases table if it is missing."""
+    cursor.execute(
+        "IF COL_LENGTH('Cases', 'compression') IS NULL "
+        "ALTER TABLE Cases ADD compression NVARCHAR(32) NULL"
+    )
+
+def get_case_compression(container_name):
+    """Return the compression spec chosen for a case, or None to use the default."""
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT compression FROM Cases WHERE container_name = ?", (container_name,))
+        result = cursor.fetchone()
+    return result[0] if result else None
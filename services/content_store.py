@@ -0,0 +1,173 @@
+from azure.core import MatchConditions
+from azure.core.exceptions import HttpResponseError, ResourceExistsError, ResourceNotFoundError
+from services.archive_rename import rename_member
+from services.blob_service import get_blob_service_client
+from services.db_service import db_connection
+from contextlib import contextmanager
+from datetime import datetime
+import os
+import time
+
+# Shared container holding each distinct file once, named by its SHA-256
+CONTENT_CONTAINER = os.environ.get("CONTENT_CONTAINER", "content")
+# Case blobs that link to shared content are empty and carry these metadata keys
+CONTENT_METADATA_KEY = "content"
+CONTENT_SIZE_METADATA_KEY = "content_size"
+# References are counted under a lease on the content blob, held this long at most
+CONTENT_LEASE_SECONDS = 15
+CONTENT_LEASE_TIMEOUT = float(os.environ.get("CONTENT_LEASE_TIMEOUT", 60))
+
+_container_ready = False
+
+def ensure_content_table(cursor):
+    """Create the table counting the case files that reference each stored content."""
+    cursor.execute(
+        "IF OBJECT_ID('ContentIndex', 'U') IS NULL "
+        "CREATE TABLE ContentIndex (content_hash CHAR(64) NOT NULL PRIMARY KEY, "
+        "ref_count INT NOT NULL, updated_at DATETIME2 NOT NULL)"
+    )
+
+def _content_container():
+    global _container_ready
+    container_client = get_blob_service_client().get_container_client(CONTENT_CONTAINER)
+    if not _container_ready:
+        try:
+            container_client.create_container()
+        except ResourceExistsError:
+            pass
+        _container_ready = True
+    return container_client
+
+def content_blob_client(content_hash):
+    return _content_container().get_blob_client(content_hash)
+
+def linked_content(blob):
+    """Return the content hash a case blob links to, or None for a blob stored in the case itself."""
+    return (getattr(blob, 'metadata', None) or {}).get(CONTENT_METADATA_KEY)
+
+def stored_size(blob):
+    """Size of the data behind a case blob, following a content link."""
+    if linked_content(blob):
+        return int(blob.metadata.get(CONTENT_SIZE_METADATA_KEY, 0))
+    return blob.size
+
+def source_blob_client(container_client, blob):
+    """Return the client of the blob holding a case file's data."""
+    content_hash = linked_content(blob)
+    if content_hash:
+        return content_blob_client(content_hash)
+    return container_client.get_blob_client(blob.name)
+
+def case_file_name(blob_name):
+    """Name of the uploaded file a case blob holds: its blob name without the .zip added on upload."""
+    return blob_name[:-len(".zip")] if blob_name.endswith(".zip") else blob_name
+
+def content_archive(blob_client, properties, blob_name):
+    """Return stored content renamed for the case file blob_name, or None to serve it as stored.
+
+    Archives made on upload name their member after the content hash; an
+    uploaded archive stored as it is keeps the member names it came with.
+    """
+    if (properties.metadata or {}).get("compression") == "passthrough":
+        return None
+    return rename_member(blob_client, properties, case_file_name(blob_name))
+
+def open_case_file(container_client, blob):
+    """Return the size and chunks of a case file as it is downloaded, following a content link."""
+    content_hash = linked_content(blob)
+    if not content_hash:
+        downloader = container_client.get_blob_client(blob.name).download_blob()
+        return downloader.size, downloader.chunks()
+    blob_client = content_blob_client(content_hash)
+    properties = blob_client.get_blob_properties()
+    archive = content_archive(blob_client, properties, blob.name)
+    if archive is not None:
+        return archive.size, archive.chunks()
+    downloader = blob_client.download_blob(etag=properties.etag, match_condition=MatchConditions.IfNotModified)
+    return properties.size, downloader.chunks()
+
+@contextmanager
+def _content_lease(blob_client):
+    """Hold a lease on a content blob; yields None if the blob does not exist."""
+    deadline = time.monotonic() + CONTENT_LEASE_TIMEOUT
+    while True:
+        try:
+            lease = blob_client.acquire_lease(lease_duration=CONTENT_LEASE_SECONDS)
+            break
+        except ResourceNotFoundError:
+            yield None
+            return
+        except HttpResponseError as e:
+            # 409: another worker is changing the references right now
+            if e.status_code != 409 or time.monotonic() > deadline:
+                raise
+            time.sleep(0.2)
+    try:
+        yield lease
+    finally:
+        try:
+            lease.release()
+        except HttpResponseError:
+            pass  # Expired, or the blob was deleted under it
+
+def _increment(cursor, content_hash):
+    cursor.execute(
+        "MERGE ContentIndex WITH (HOLDLOCK) AS target "
+        "USING (SELECT ? AS content_hash) AS source ON target.content_hash = source.content_hash "
+        "WHEN MATCHED THEN UPDATE SET ref_count = target.ref_count + 1, updated_at = ? "
+        "WHEN NOT MATCHED THEN INSERT (content_hash, ref_count, updated_at) VALUES (source.content_hash, 1, ?);",
+        (content_hash, datetime.utcnow(), datetime.utcnow()),
+    )
+
+def add_reference(content_hash):
+    """Count one more case file linking to stored content.
+
+    Returns the content blob's properties, or None if the content is not stored.
+    """
+    blob_client = content_blob_client(content_hash)
+    with _content_lease(blob_client) as lease:
+        if lease is None:
+            return None
+        properties = blob_client.get_blob_properties()
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            _increment(cursor, content_hash)
+            conn.commit()
+        return properties
+
+def store_content(content_hash, writer, **kwargs):
+    """Commit freshly written content and count its first reference.
+
+    Returns the content blob's properties, or None if identical content was
+    stored concurrently; the caller should then add a reference to that.
+    """
+    try:
+        writer.commit(match_condition=MatchConditions.IfMissing, **kwargs)
+    except ResourceExistsError:
+        return None
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        _increment(cursor, content_hash)
+        conn.commit()
+    return writer.blob_client.get_blob_properties()
+
+def release_reference(content_hash):
+    """Drop one reference to stored content, deleting it with the last one."""
+    blob_client = content_blob_client(content_hash)
+    with _content_lease(blob_client) as lease:
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "UPDATE ContentIndex SET ref_count = ref_count - 1, updated_at = ? "
+                "OUTPUT inserted.ref_count WHERE content_hash = ?",
+                (datetime.utcnow(), content_hash),
+            )
+            row = cursor.fetchone()
+            if row is None or row[0] > 0:
+                conn.commit()
+                return
+            # Nobody can add a reference while we hold the lease
+            if lease is not None:
+                blob_client.delete_blob(lease=lease)
+            cursor.execute("DELETE FROM ContentIndex WHERE content_hash = ? AND ref_count <= 0", (content_hash,))
+            conn.commit()
@@ -1,18 +1,65 @@
-import pyodbc
 import os
 import struct
+import threading
+import time
+from contextlib import contextmanager
 from azure.identity import DefaultAzureCredential
 
+# "azure" for Azure SQL, or "sqlite" to keep cases in a local file for development and benchmarks
+DB_BACKEND = os.environ.get("DB_BACKEND", "azure")
+SQLITE_DATABASE = os.environ.get("SQLITE_DATABASE", "./cases.sqlite3")
+
+if DB_BACKEND == "sqlite":
+    from services import sqlite_store
+    DatabaseError = sqlite_store.Error
+    DisconnectErrors = sqlite_store.DisconnectErrors
+else:
+    import pyodbc
+    DatabaseError = pyodbc.Error
+    DisconnectErrors = (pyodbc.OperationalError, pyodbc.InterfaceError)
+
+SQL_COPT_SS_ACCESS_TOKEN = 1256
+TOKEN_SCOPE = "https://database.windows.net/"
+# Refresh the access token this many seconds before it expires
+TOKEN_REFRESH_MARGIN = 300
+
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 5))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", 30))
+# Connections idle for longer than this are health-checked before reuse
+DB_POOL_IDLE_CHECK = float(os.environ.get("DB_POOL_IDLE_CHECK", 60))
+
 def init_db(app):
     app.config['SQL_SERVER'] = os.environ.get("SQL_SERVER")
     app.config['SQL_DATABASE'] = os.environ.get("SQL_DATABASE")
 
-def get_db_connection():
-    credential = DefaultAzureCredential()
-    access_token = credential.get_token("https://database.windows.net/").token.encode("UTF-16-LE")
-    token_struct = struct.pack(f'<I{len(access_token)}s', len(access_token), access_token)
-    SQL_COPT_SS_ACCESS_TOKEN = 1256
+class AccessTokenCache:
+    """Caches the AAD access token for SQL and refreshes it shortly before expiry."""
+
+    def __init__(self, scope=TOKEN_SCOPE, refresh_margin=TOKEN_REFRESH_MARGIN):
+        self.scope = scope
+        self.refresh_margin = refresh_margin
+        self.refreshes = 0
+        self._credential = None
+        self._token = None
+        self._lock = threading.Lock()
+
+    def get_token_struct(self):
+        """Return the token packed the way the ODBC driver expects it."""
+        with self._lock:
+            if self._token is None or self._token.expires_on - self.refresh_margin <= time.time():
+                if self._credential is None:
+                    self._credential = DefaultAzureCredential()
+                self._token = self._credential.get_token(self.scope)
+                self.refreshes += 1
+            access_token = self._token.token.encode("UTF-16-LE")
+        return struct.pack(f'<I{len(access_token)}s', len(access_token), access_token)
 
+token_cache = AccessTokenCache()
+
+def connect():
+    """Open a new connection to the database using the cached access token."""
+    if DB_BACKEND == "sqlite":
+        return sqlite_store.connect(SQLITE_DATABASE)
     connection_string = (
         f"DRIVER={{ODBC Driver 17 for SQL Server}};"
         f"SERVER={os.environ.get('SQL_SERVER')};"
@@ -20,4 +67,140 @@ def get_db_connection():
         f"Encrypt=yes;"
         f"TrustServerCertificate=no;"
     )
-    return pyodbc.connect(connection_string, attrs_before={SQL_COPT_SS_ACCESS_TOKEN: token_struct})
\ No newline at end of file
+    return pyodbc.connect(connection_string, attrs_before={SQL_COPT_SS_ACCESS_TOKEN: token_cache.get_token_struct()})
+
+class PoolTimeout(Exception):
+    """Raised when no connection becomes available within the pool timeout."""
+
+class ConnectionPool:
+    """Thread-safe pool of database connections.
+
+    Connections are opened lazily up to max_size. Idle connections are
+    health-checked before reuse and replaced if they have gone stale.
+    """
+
+    def __init__(self, connect, max_size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT, idle_check=DB_POOL_IDLE_CHECK):
+        self._connect = connect
+        self.max_size = max_size
+        self.timeout = timeout
+        self.idle_check = idle_check
+        self._idle = []  # (connection, last_used) pairs, most recently used last
+        self._size = 0
+        self._condition = threading.Condition()
+        self._metrics = {
+            "checkouts": 0,
+            "waits": 0,
+            "wait_seconds_total": 0.0,
+            "wait_seconds_max": 0.0,
+            "timeouts": 0,
+            "connections_opened": 0,
+            "connections_discarded": 0,
+        }
+
+    def _is_healthy(self, conn):
+        try:
+            conn.cursor().execute("SELECT 1").fetchone()
+            return True
+        except DatabaseError:
+            return False
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except DatabaseError:
+            pass
+        with self._condition:
+            self._metrics["connections_discarded"] += 1
+
+    def _discard(self, conn):
+        self._close(conn)
+        with self._condition:
+            self._size -= 1
+            self._condition.notify()
+
+    def acquire(self):
+        """Check a connection out of the pool, opening one if the pool has room."""
+        started = time.monotonic()
+        waited = False
+        with self._condition:
+            while not self._idle and self._size >= self.max_size:
+                waited = True
+                remaining = self.timeout - (time.monotonic() - started)
+                if remaining <= 0:
+                    self._metrics["timeouts"] += 1
+                    raise PoolTimeout(f"No database connection available after {self.timeout}s")
+                self._condition.wait(remaining)
+            self._metrics["checkouts"] += 1
+            if waited:
+                wait = time.monotonic() - started
+                self._metrics["waits"] += 1
+                self._metrics["wait_seconds_total"] += wait
+                self._metrics["wait_seconds_max"] = max(self._metrics["wait_seconds_max"], wait)
+            if self._idle:
+                conn, last_used = self._idle.pop()
+            else:
+                conn, last_used = None, None
+                self._size += 1
+
+        if conn is not None:
+            if time.monotonic() - last_used < self.idle_check or self._is_healthy(conn):
+                return conn
+            # Stale connection: replace it, keeping its slot in the pool
+            self._close(conn)
+
+        try:
+            conn = self._connect()
+        except Exception:
+            with self._condition:
+                self._size -= 1
+                self._condition.notify()
+            raise
+        with self._condition:
+            self._metrics["connections_opened"] += 1
+        return conn
+
+    def release(self, conn, discard=False):
+        """Return a connection to the pool, rolling back any open transaction."""
+        if not discard:
+            try:
+                conn.rollback()
+            except DatabaseError:
+                discard = True
+        if discard:
+            self._discard(conn)
+            return
+        with self._condition:
+            self._idle.append((conn, time.monotonic()))
+            self._condition.notify()
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        except DisconnectErrors:
+            self.release(conn, discard=True)
+            raise
+        except BaseException:
+            self.release(conn)
+            raise
+        else:
+            self.release(conn)
+
+    def stats(self):
+        """Return pool size and wait metrics."""
+        with self._condition:
+            return {
+                "max_size": self.max_size,
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                "token_refreshes": token_cache.refreshes,
+                **self._metrics,
+            }
+
+db_pool = ConnectionPool(connect)
+
+def db_connection():
+    """Check out a pooled connection for the duration of a with block."""
+    return db_pool.connection()
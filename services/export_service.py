@@ -0,0 +1,149 @@
+from concurrent.futures import ThreadPoolExecutor
+import io
+import json
+import os
+import queue
+import tarfile
+import threading
+import zipfile
+from services.content_store import open_case_file
+
+# Blobs downloaded concurrently ahead of the one being written to the archive
+EXPORT_READ_AHEAD = int(os.environ.get("EXPORT_READ_AHEAD", 4))
+# Chunks buffered per blob being read ahead
+EXPORT_BUFFERED_CHUNKS = 4
+MANIFEST_NAME = "manifest.json"
+
+_DONE = object()
+
+class _ArchiveSink(io.RawIOBase):
+    """Write-only stream that collects archive output until it is drained."""
+
+    def __init__(self):
+        self._parts = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b"".join(self._parts)
+        self._parts.clear()
+        return data
+
+def _download(container_client, blob, chunks, cancelled):
+    try:
+        size, blob_chunks = open_case_file(container_client, blob)
+        # The size goes first; a tar header needs it before the data
+        chunks.put(size)
+        for chunk in blob_chunks:
+            while not cancelled.is_set():
+                try:
+                    chunks.put(chunk, timeout=1)
+                    break
+                except queue.Full:
+                    pass
+            if cancelled.is_set():
+                return
+        chunks.put(_DONE)
+    except Exception as e:
+        chunks.put(e)
+
+def _prefetched(container_client, blobs, read_ahead=EXPORT_READ_AHEAD):
+    """Yield (blob, size, chunk iterator) in order while later blobs download in the background.
+
+    At most read_ahead blobs are in flight and each buffers at most
+    EXPORT_BUFFERED_CHUNKS chunks, which bounds the memory used.
+    """
+    cancelled = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=read_ahead)
+    pending = []
+
+    def submit(blob):
+        chunks = queue.Queue(maxsize=EXPORT_BUFFERED_CHUNKS)
+        executor.submit(_download, container_client, blob, chunks, cancelled)
+        pending.append((blob, chunks))
+
+    def drain(chunks):
+        while True:
+            item = chunks.get()
+            if item is _DONE:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    try:
+        blobs = iter(blobs)
+        for blob in blobs:
+            submit(blob)
+            if len(pending) >= read_ahead:
+                break
+        while pending:
+            blob, chunks = pending.pop(0)
+            next_blob = next(blobs, None)
+            if next_blob is not None:
+                submit(next_blob)
+            size = chunks.get()
+            if isinstance(size, Exception):
+                raise size
+            yield blob, size, drain(chunks)
+    finally:
+        # Unblock any downloads still running if the client went away
+        cancelled.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def _date_time(blob):
+    return blob.last_modified.timetuple()[:6] if blob.last_modified else (1980, 1, 1, 0, 0, 0)
+
+def stream_zip(container_client, blobs, manifest):
+    """Yield a ZIP archive of the blobs (stored, as they are already compressed) plus a manifest."""
+    sink = _ArchiveSink()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_STORED) as zip_file:
+        zip_file.writestr(MANIFEST_NAME, json.dumps(manifest, indent=2))
+        yield sink.drain()
+        for blob, size, chunks in _prefetched(container_client, blobs):
+            zip_info = zipfile.ZipInfo(blob.name, date_time=_date_time(blob))
+            zip_info.file_size = size
+            with zip_file.open(zip_info, 'w') as entry:
+                for chunk in chunks:
+                    entry.write(chunk)
+                    yield sink.drain()
+            yield sink.drain()
+    yield sink.drain()
+
+def _tar_header(name, size, mtime):
+    tar_info = tarfile.TarInfo(name)
+    tar_info.size = size
+    tar_info.mtime = mtime
+    tar_info.mode = 0o644
+    return tar_info.tobuf(format=tarfile.PAX_FORMAT)
+
+def _tar_padding(size):
+    return b"\0" * (-size % tarfile.BLOCKSIZE)
+
+def stream_tar(container_client, blobs, manifest):
+    """Yield a tar archive of the blobs plus a manifest, written one block at a time."""
+    manifest_bytes = json.dumps(manifest, indent=2).encode('utf-8')
+    written = 0
+    for data in (_tar_header(MANIFEST_NAME, len(manifest_bytes), 0), manifest_bytes, _tar_padding(len(manifest_bytes))):
+        written += len(data)
+        yield data
+    for blob, size, chunks in _prefetched(container_client, blobs):
+        mtime = int(blob.last_modified.timestamp()) if blob.last_modified else 0
+        header = _tar_header(blob.name, size, mtime)
+        written += len(header)
+        yield header
+        for chunk in chunks:
+            written += len(chunk)
+            yield chunk
+        padding = _tar_padding(size)
+        written += len(padding)
+        yield padding
+    # End-of-archive marker, padded to a full record like tarfile does
+    end = b"\0" * (2 * tarfile.BLOCKSIZE)
+    written += len(end)
+    yield end + b"\0" * (-written % tarfile.RECORDSIZE)
@@ -0,0 +1,325 @@
+from azure.core import MatchConditions
+from azure.core.exceptions import (
+    HttpResponseError, ResourceExistsError, ResourceModifiedError, ResourceNotFoundError
+)
+from services.metrics import span
+from contextlib import contextmanager
+import json
+import os
+import threading
+import time
+import traceback
+
+INVENTORY_BLOB = '.blobinventory'
+INVENTORY_LOG_BLOB = '.blobinventory.log'
+
+# The log is folded into the snapshot once it holds more operations than
+# this, or than there are entries in the inventory, whichever is larger.
+INVENTORY_COMPACT_MIN_OPS = int(os.environ.get("INVENTORY_COMPACT_MIN_OPS", 1000))
+# Maximum payload of a single append block
+APPEND_BLOCK_SIZE = 4 * 1024 * 1024
+# Compaction holds a lease on the log for this long (the minimum Azure allows),
+# renewed every third of it for as long as the compaction runs
+COMPACTION_LEASE_SECONDS = 15
+# How long a writer keeps retrying an append blocked by a compaction lease
+INVENTORY_APPEND_TIMEOUT = float(os.environ.get("INVENTORY_APPEND_TIMEOUT", 60))
+
+class BlobInventory:
+    """Indexed inventory of the blobs in one case container.
+
+    The inventory is stored as a JSON snapshot (`.blobinventory`, the format
+    older versions wrote, so existing containers need no migration) plus an
+    append blob (`.blobinventory.log`) of JSON lines recording every put and
+    delete since the snapshot was written. Writers append one block per
+    change instead of rewriting the whole file, and readers keep the parsed
+    inventory in memory and only download the part of the log they have not
+    seen yet. Replaying the log is idempotent, so a snapshot that already
+    contains some of the logged operations is harmless.
+
+    Appends are atomic in Blob Storage, so any number of workers can record
+    changes to the same case concurrently without losing entries. Only
+    compaction rewrites the snapshot and resets the log; it does so under a
+    lease on the log, which makes concurrent appends fail with 412 until the
+    new log is in place, and writers retry them.
+    """
+
+    def __init__(self, container_client):
+        self.container_client = container_client
+        self._snapshot_client = container_client.get_blob_client(INVENTORY_BLOB)
+        self._log_client = container_client.get_blob_client(INVENTORY_LOG_BLOB)
+        self._lock = threading.RLock()
+        self._reset()
+        self._snapshot_etag = None
+        self._log_created = None
+
+    def _reset(self, entries=()):
+        self._by_name = {}
+        self._by_unzipped_hash = {}
+        self._by_zipped_hash = {}
+        self._log_offset = 0
+        self._log_ops = 0
+        for entry in entries:
+            self._apply_put(entry)
+
+    @staticmethod
+    def _index_add(index, key, name):
+        if key:
+            index.setdefault(key, {})[name] = None
+
+    @staticmethod
+    def _index_remove(index, key, name):
+        names = index.get(key)
+        if names is not None:
+            names.pop(name, None)
+            if not names:
+                del index[key]
+
+    def _apply_put(self, entry):
+        self._apply_delete(entry['name'])
+        self._by_name[entry['name']] = entry
+        self._index_add(self._by_unzipped_hash, entry.get('unzipped_hash'), entry['name'])
+        self._index_add(self._by_zipped_hash, entry.get('zipped_hash'), entry['name'])
+
+    def _apply_delete(self, name):
+        entry = self._by_name.pop(name, None)
+        if entry is not None:
+            self._index_remove(self._by_unzipped_hash, entry.get('unzipped_hash'), name)
+            self._index_remove(self._by_zipped_hash, entry.get('zipped_hash'), name)
+
+    def _replay(self, data):
+        for line in data.decode('utf-8').splitlines():
+            if not line:
+                continue
+            try:
+                op = json.loads(line)
+            except ValueError:
+                continue
+            if op.get('op') == 'put':
+                self._apply_put(op['entry'])
+            elif op.get('op') == 'delete':
+                self._apply_delete(op['name'])
+            self._log_ops += 1
+
+    @span("inventory.refresh")
+    def refresh(self):
+        """Bring the in-memory inventory up to date with storage."""
+        with self._lock:
+            # Read the log before the snapshot: compaction writes the snapshot
+            # first, so a reset log is never paired with an outdated snapshot.
+            try:
+                log_properties = self._log_client.get_blob_properties()
+            except ResourceNotFoundError:
+                log_properties = None
+            log_created = log_properties.creation_time if log_properties else None
+            full_reload = (
+                log_created != self._log_created
+                or (log_properties is not None and log_properties.size < self._log_offset)
+            )
+
+            try:
+                if full_reload or self._snapshot_etag is None:
+                    downloader = self._snapshot_client.download_blob()
+                else:
+                    downloader = self._snapshot_client.download_blob(
+                        etag=self._snapshot_etag, match_condition=MatchConditions.IfModified
+                    )
+                content = downloader.readall()
+                try:
+                    entries = json.loads(content.decode('utf-8'))
+                except Exception:
+                    entries = []
+                self._snapshot_etag = downloader.properties.etag
+                full_reload = True
+            except ResourceNotFoundError:
+                entries = []
+                full_reload = full_reload or self._snapshot_etag is not None
+                self._snapshot_etag = None
+            except HttpResponseError as e:
+                # The SDK raises a 304 as a plain HttpResponseError, or as
+                # ResourceModifiedError when it carries ConditionNotMet
+                if e.status_code != 304:
+                    raise
+                entries = None
+
+            if full_reload:
+                self._reset(entries or [])
+            self._log_created = log_created
+
+            if log_properties is not None and log_properties.size > self._log_offset:
+                data = self._log_client.download_blob(
+                    offset=self._log_offset, length=log_properties.size - self._log_offset
+                ).readall()
+                self._replay(data)
+                self._log_offset = log_properties.size
+        return self
+
+    def get(self, name):
+        with self._lock:
+            return self._by_name.get(name)
+
+    def _first(self, index, key):
+        names = index.get(key)
+        return self._by_name[next(iter(names))] if names else None
+
+    def find_by_unzipped_hash(self, unzipped_hash):
+        with self._lock:
+            return self._first(self._by_unzipped_hash, unzipped_hash)
+
+    def find_by_zipped_hash(self, zipped_hash):
+        with self._lock:
+            return self._first(self._by_zipped_hash, zipped_hash)
+
+    def entries(self):
+        with self._lock:
+            return list(self._by_name.values())
+
+    def __len__(self):
+        with self._lock:
+            return len(self._by_name)
+
+    def __contains__(self, name):
+        with self._lock:
+            return name in self._by_name
+
+    @span("inventory.append")
+    def _append(self, ops):
+        lines = [json.dumps(op, separators=(',', ':')).encode('utf-8') + b'\n' for op in ops]
+        blocks = []
+        block = b''
+        for line in lines:
+            if block and len(block) + len(line) > APPEND_BLOCK_SIZE:
+                blocks.append(block)
+                block = b''
+            block += line
+        if block:
+            blocks.append(block)
+
+        with self._lock:
+            self._ensure_log()
+            for block in blocks:
+                self._append_block(block)
+            # Pick up our own (and any concurrent) operations from the log
+            self.refresh()
+            if self._log_ops > max(INVENTORY_COMPACT_MIN_OPS, len(self._by_name)):
+                try:
+                    self.compact()
+                except Exception:
+                    # The operations are already in the log; a later append compacts it
+                    traceback.print_exc()
+
+    def _ensure_log(self):
+        if self._log_created is None:
+            try:
+                self._log_client.create_append_blob(match_condition=MatchConditions.IfMissing)
+            except ResourceExistsError:
+                pass  # Created concurrently by another writer
+
+    def _append_block(self, block):
+        deadline = time.monotonic() + INVENTORY_APPEND_TIMEOUT
+        delay = 0.1
+        while True:
+            try:
+                self._log_client.append_block(block)
+                return
+            except ResourceNotFoundError:
+                # The log is being recreated by a compaction
+                self._log_created = None
+                self._ensure_log()
+            except HttpResponseError as e:
+                # 412: another worker holds the compaction lease
+                if e.status_code != 412 or time.monotonic() > deadline:
+                    raise
+            time.sleep(delay)
+            delay = min(delay * 2, 2)
+
+    def add(self, *entries):
+        """Add or replace entries, keyed by blob name."""
+        if entries:
+            self._append([{"op": "put", "entry": entry} for entry in entries])
+
+    def remove(self, *names):
+        if names:
+            self._append([{"op": "delete", "name": name} for name in names])
+
+    def compact(self):
+        """Fold the log into a new snapshot and start an empty log.
+
+        Skipped if another worker is already compacting this inventory.
+        """
+        with self._lock:
+            with self._compaction_lease(wait=False) as lease:
+                if lease is not None:
+                    # Nobody can append while we hold the lease, so this
+                    # refresh sees every operation the new snapshot must hold
+                    self.refresh()
+                    self._write_snapshot(self.entries(), lease)
+
+    @contextmanager
+    def _compaction_lease(self, wait):
+        self._ensure_log()
+        deadline = time.monotonic() + INVENTORY_APPEND_TIMEOUT
+        while True:
+            try:
+                lease = self._log_client.acquire_lease(lease_duration=COMPACTION_LEASE_SECONDS)
+                break
+            except HttpResponseError as e:
+                # 409: the lease is held by another compaction
+                if e.status_code != 409:
+                    raise
+                if not wait or time.monotonic() > deadline:
+                    yield None
+                    return
+                time.sleep(0.5)
+        stopped = threading.Event()
+
+        def renew():
+            while not stopped.wait(COMPACTION_LEASE_SECONDS / 3):
+                try:
+                    lease.renew()
+                except HttpResponseError:
+                    return  # Lost; the conditional snapshot write and the leased log reset will fail
+
+        renewer = threading.Thread(target=renew, daemon=True)
+        renewer.start()
+        try:
+            yield lease
+        finally:
+            stopped.set()
+            renewer.join()
+            try:
+                lease.release()
+            except HttpResponseError:
+                pass  # Expired; the lease is gone either way
+
+    @span("inventory.snapshot")
+    def _write_snapshot(self, entries, lease):
+        content = json.dumps(entries, separators=(',', ':')).encode('utf-8')
+        # Conditional on the snapshot we just read, in case a compaction
+        # elsewhere outlived its lease and wrote it in the meantime
+        if self._snapshot_etag is None:
+            conditions = {"match_condition": MatchConditions.IfMissing}
+        else:
+            conditions = {"etag": self._snapshot_etag, "match_condition": MatchConditions.IfNotModified}
+        try:
+            self._snapshot_client.upload_blob(content, overwrite=True, **conditions)
+        except (ResourceModifiedError, ResourceExistsError):
+            return False
+        self._log_client.create_append_blob(lease=lease)
+        self.refresh()
+        return True
+
+_inventories = {}
+_inventories_lock = threading.Lock()
+
+def get_inventory(container_client):
+    """Return the up-to-date inventory of a container, reusing the parsed copy between requests."""
+    with _inventories_lock:
+        inventory = _inventories.get(container_client.container_name)
+        if inventory is None:
+            inventory = _inventories[container_client.container_name] = BlobInventory(container_client)
+    return inventory.refresh()
+
+def forget_inventory(container_name):
+    """Drop the cached inventory of a deleted container."""
+    with _inventories_lock:
+        _inventories.pop(container_name, None)
@@ -0,0 +1,185 @@
+from azure.core.exceptions import ResourceExistsError, ResourceNotFoundError
+from services.blob_service import get_blob_service_client
+from datetime import datetime
+import json
+import os
+import queue
+import re
+import threading
+import time
+import traceback
+import uuid
+
+# Job status documents are mirrored to this container so any worker can report them
+JOBS_CONTAINER = os.environ.get("JOBS_CONTAINER", "jobs")
+# Minimum seconds between progress writes to storage
+JOB_SAVE_INTERVAL = 2
+# Finished jobs kept in memory per worker; older ones are only in storage
+MAX_JOBS_IN_MEMORY = 100
+
+_jobs = {}
+_jobs_lock = threading.Lock()
+_container_ready = False
+
+def _utcnow():
+    return datetime.utcnow().isoformat() + "Z"
+
+class Job:
+    """A long-running operation executed on a background thread.
+
+    Progress is kept in memory and periodically written to the jobs
+    container, so the status endpoint works no matter which worker serves it.
+    """
+
+    def __init__(self, kind, params=None, job_id=None):
+        self.id = job_id or uuid.uuid4().hex
+        self.kind = kind
+        self.params = params or {}
+        self.status = "queued"
+        self.total = 0
+        self.done = 0
+        self.failed = 0
+        self.message = ""
+        self.result = None
+        self.error = None
+        self.created_at = _utcnow()
+        self.updated_at = self.created_at
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._last_saved = 0
+
+    def add_total(self, count):
+        with self._lock:
+            self.total += count
+        self.save()
+
+    def advance(self, count=1, failed=False, message=None):
+        with self._lock:
+            self.done += count
+            if failed:
+                self.failed += count
+            if message is not None:
+                self.message = message
+        self.save()
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "id": self.id,
+                "kind": self.kind,
+                "params": self.params,
+                "status": self.status,
+                "total": self.total,
+                "done": self.done,
+                "failed": self.failed,
+                "message": self.message,
+                "result": self.result,
+                "error": self.error,
+                "created_at": self.created_at,
+                "updated_at": self.updated_at,
+            }
+
+    def save(self, force=False):
+        """Write the job status to storage, at most every JOB_SAVE_INTERVAL seconds unless forced."""
+        now = time.monotonic()
+        with self._lock:
+            if not force and now - self._last_saved < JOB_SAVE_INTERVAL:
+                return
+            self._last_saved = now
+            self.updated_at = _utcnow()
+        # Serialize writes so a slow progress update cannot overwrite the final status
+        if not self._save_lock.acquire(blocking=force):
+            return
+        try:
+            _jobs_container().upload_blob(f"{self.id}.json", json.dumps(self.to_dict()).encode('utf-8'), overwrite=True)
+        except Exception:
+            pass  # Status persistence is best effort; the in-memory copy stays authoritative
+        finally:
+            self._save_lock.release()
+
+    def _run(self, target, args, kwargs):
+        with self._lock:
+            self.status = "running"
+        self.save(force=True)
+        try:
+            result = target(self, *args, **kwargs)
+            with self._lock:
+                self.result = result
+                self.status = "completed"
+        except Exception as e:
+            with self._lock:
+                self.error = f"{e}"
+                self.status = "failed"
+            traceback.print_exc()
+        self.save(force=True)
+
+def _jobs_container():
+    global _container_ready
+    container_client = get_blob_service_client().get_container_client(JOBS_CONTAINER)
+    if not _container_ready:
+        try:
+            container_client.create_container()
+        except ResourceExistsError:
+            pass
+        _container_ready = True
+    return container_client
+
+class JobRunner:
+    """A fixed number of daemon threads running jobs in turn; jobs wait as queued until one is free."""
+
+    def __init__(self, workers, name):
+        self.workers = workers
+        self.name = name
+        self._queue = queue.Queue()
+        self._started = False
+        self._lock = threading.Lock()
+
+    def submit(self, job, target, args, kwargs):
+        with self._lock:
+            if not self._started:
+                for index in range(self.workers):
+                    threading.Thread(target=self._work, name=f"{self.name}-{index}", daemon=True).start()
+                self._started = True
+        self._queue.put((job, target, args, kwargs))
+
+    def _work(self):
+        while True:
+            job, target, args, kwargs = self._queue.get()
+            job._run(target, args, kwargs)
+
+def start_job(kind, target, *args, params=None, job_id=None, runner=None, **kwargs):
+    """Run target(job, *args, **kwargs) on a background thread and return the job.
+
+    A job_id names the job instead of a random one; if this worker already
+    runs or ran that job without failing, it is returned and not started again.
+    With a runner, the job waits for one of the runner's threads instead of
+    getting its own.
+    """
+    job = Job(kind, params, job_id)
+    with _jobs_lock:
+        existing = _jobs.get(job.id)
+        if existing is not None and existing.status != "failed":
+            return existing
+        finished = [job_id for job_id, other in _jobs.items() if other.status in ("completed", "failed")]
+        for job_id in finished[:max(0, len(_jobs) - MAX_JOBS_IN_MEMORY + 1)]:
+            del _jobs[job_id]
+        _jobs[job.id] = job
+    if runner is not None:
+        runner.submit(job, target, args, kwargs)
+    else:
+        threading.Thread(target=job._run, args=(target, args, kwargs), name=f"job-{kind}-{job.id[:8]}", daemon=True).start()
+    return job
+
+def get_job(job_id):
+    """Return the status of a job started by any worker, or None if it is unknown."""
+    if not re.fullmatch(r"[0-9a-f]{32}", job_id):
+        return None
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+    if job is not None:
+        return job.to_dict()
+    try:
+        content = _jobs_container().get_blob_client(f"{job_id}.json").download_blob().readall()
+        return json.loads(content.decode('utf-8'))
+    except (ResourceNotFoundError, ValueError):
+        return None
@@ -0,0 +1,474 @@
+"""Filesystem stand-in for the Azure Blob Storage clients.
+
+Implements the part of the BlobServiceClient, ContainerClient and
+BlobClient API this app uses (block and append blobs, metadata, ETag
+conditions, leases, paged listings and batch deletes) on a local directory,
+so the app can run and be benchmarked without a storage account. Each
+container is a directory; each blob is a data file plus a JSON properties
+file, updated under an exclusive flock on the blob so several threads and
+processes can share the tree.
+"""
+from azure.core import MatchConditions
+from azure.core.exceptions import (
+    HttpResponseError, ResourceExistsError, ResourceModifiedError, ResourceNotFoundError
+)
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from urllib.parse import quote, unquote
+import fcntl
+import json
+import os
+import shutil
+import uuid
+
+DATA_SUFFIX = ".blob"
+PROPERTIES_SUFFIX = ".json"
+BLOCKS_DIR = ".blocks"
+LOCKS_DIR = ".locks"
+
+# Conditional keyword arguments the SDK accepts but this stand-in does not implement
+UNSUPPORTED_CONDITIONS = ("if_match", "if_none_match", "if_modified_since", "if_unmodified_since", "if_tags_match_condition")
+
+def _http_error(status_code, message, error_type=HttpResponseError):
+    error = error_type(message=message)
+    error.status_code = status_code
+    return error
+
+def _new_etag():
+    return f'"0x{uuid.uuid4().hex[:15].upper()}"'
+
+def _utcnow():
+    return datetime.now(timezone.utc)
+
+def _write_file(path, data):
+    """Write a file atomically, so readers see the old or the new content."""
+    temp = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(temp, 'wb') as f:
+        f.write(data)
+    os.replace(temp, path)
+
+def _properties(name, container, stored):
+    return SimpleNamespace(
+        name=name,
+        container=container,
+        size=stored["size"],
+        etag=stored["etag"],
+        last_modified=datetime.fromisoformat(stored["last_modified"]),
+        creation_time=datetime.fromisoformat(stored["creation_time"]),
+        metadata=dict(stored["metadata"]),
+        blob_type=stored["blob_type"],
+        content_settings=SimpleNamespace(content_type=stored.get("content_type") or "application/octet-stream"),
+        lease=SimpleNamespace(state="leased" if _lease_active(stored) else "available"),
+    )
+
+def _lease_active(stored):
+    lease = stored.get("lease")
+    return lease is not None and datetime.fromisoformat(lease["expires"]) > _utcnow()
+
+def _lease_id(lease):
+    return getattr(lease, 'id', lease)
+
+def _conditions(kwargs):
+    """Take the etag/match_condition keyword arguments of a call the way the SDK does.
+
+    Like the SDK, only IfNotModified and IfModified consume etag; any other
+    use of it is forwarded to the HTTP transport there, which rejects it.
+    """
+    for name in UNSUPPORTED_CONDITIONS:
+        if kwargs.get(name) is not None:
+            raise TypeError(f"Local storage does not implement the {name} condition.")
+    match_condition = kwargs.pop("match_condition", None)
+    etag = None
+    if match_condition in (MatchConditions.IfNotModified, MatchConditions.IfModified):
+        etag = kwargs.pop("etag", None)
+        if not etag:
+            raise ValueError("'match_condition' specified without 'etag'.")
+    elif match_condition is None:
+        if kwargs.get("etag"):
+            raise ValueError("'etag' specified without 'match_condition'.")
+    elif match_condition not in (MatchConditions.IfMissing, MatchConditions.IfPresent):
+        raise TypeError(f"Invalid match condition: {match_condition}")
+    if "etag" in kwargs:
+        raise TypeError("Session.request() got an unexpected keyword argument 'etag'")
+    return etag, match_condition
+
+def _check_conditions(stored, etag, match_condition):
+    """Apply an ETag condition the way Blob Storage does, raising what the SDK raises; a 304 is a plain HttpResponseError."""
+    if match_condition == MatchConditions.IfMissing:
+        if stored is not None:
+            raise _http_error(409, "The specified blob already exists.", ResourceExistsError)
+    elif match_condition == MatchConditions.IfNotModified:
+        if stored is None:
+            raise _http_error(404, "The specified blob does not exist.", ResourceNotFoundError)
+        if stored["etag"] != etag:
+            raise _http_error(412, "The condition specified using HTTP conditional header(s) is not met.", ResourceModifiedError)
+    elif match_condition == MatchConditions.IfModified:
+        if stored is not None and stored["etag"] == etag:
+            raise _http_error(304, "Operation returned an invalid status 'Not Modified'")
+    elif match_condition == MatchConditions.IfPresent and stored is None:
+        raise _http_error(404, "The specified blob does not exist.", ResourceNotFoundError)
+
+class LocalLease:
+    def __init__(self, blob_client, lease_id):
+        self.blob_client = blob_client
+        self.id = lease_id
+
+    def release(self):
+        self.blob_client._release_lease(self.id)
+
+    def renew(self):
+        self.blob_client._renew_lease(self.id)
+
+class LocalDownloader:
+    def __init__(self, data_file, properties, offset, length, chunk_size):
+        self._file = data_file
+        self.properties = properties
+        self.size = length
+        self._offset = offset
+        self._chunk_size = chunk_size
+
+    def chunks(self):
+        try:
+            self._file.seek(self._offset)
+            remaining = self.size
+            while remaining > 0:
+                chunk = self._file.read(min(self._chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+        finally:
+            self._file.close()
+
+    def readall(self):
+        return b"".join(self.chunks())
+
+class LocalBlobClient:
+    def __init__(self, container_client, blob_name):
+        self.container_client = container_client
+        self.container_name = container_client.container_name
+        self.blob_name = blob_name
+        quoted = quote(blob_name, safe='')
+        self._data_path = os.path.join(container_client.path, quoted + DATA_SUFFIX)
+        self._properties_path = os.path.join(container_client.path, quoted + PROPERTIES_SUFFIX)
+        self._blocks_path = os.path.join(container_client.path, BLOCKS_DIR, quoted)
+        self._lock_path = os.path.join(container_client.path, LOCKS_DIR, quoted)
+
+    @property
+    def url(self):
+        return f"file://{os.path.abspath(self._data_path)}"
+
+    @contextmanager
+    def _locked(self, exclusive=True):
+        if not os.path.isdir(self.container_client.path):
+            raise _http_error(404, "The specified container does not exist.", ResourceNotFoundError)
+        with open(self._lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            yield
+
+    def _load(self):
+        try:
+            with open(self._properties_path, 'rb') as f:
+                return json.loads(f.read())
+        except FileNotFoundError:
+            return None
+
+    def _save(self, stored):
+        _write_file(self._properties_path, json.dumps(stored).encode('utf-8'))
+
+    def _check_lease(self, stored, lease):
+        if stored is not None and _lease_active(stored) and _lease_id(lease) != stored["lease"]["id"]:
+            raise _http_error(412, "There is currently a lease on the blob and no lease ID was specified in the request.")
+
+    def _write(self, stored, data_source, blob_type, metadata=None, content_settings=None, recreate=False):
+        """Replace the blob's data and properties; data_source writes the data file."""
+        now = _utcnow().isoformat()
+        temp = f"{self._data_path}.{uuid.uuid4().hex}.tmp"
+        with open(temp, 'wb') as f:
+            data_source(f)
+            size = f.tell()
+        os.replace(temp, self._data_path)
+        content_type = getattr(content_settings, 'content_type', None)
+        new = {
+            "etag": _new_etag(),
+            "size": size,
+            "blob_type": blob_type,
+            "metadata": dict(metadata or {}),
+            "content_type": content_type,
+            "creation_time": stored["creation_time"] if stored and not recreate else now,
+            "last_modified": now,
+            "lease": stored.get("lease") if stored else None,
+        }
+        self._save(new)
+        return {"etag": new["etag"], "last_modified": datetime.fromisoformat(now)}
+
+    def exists(self):
+        return os.path.exists(self._properties_path)
+
+    def get_blob_properties(self, **kwargs):
+        with self._locked(exclusive=False):
+            stored = self._load()
+        if stored is None:
+            raise _http_error(404, "The specified blob does not exist.", ResourceNotFoundError)
+        return _properties(self.blob_name, self.container_name, stored)
+
+    def upload_blob(self, data, overwrite=False, metadata=None, lease=None, content_settings=None, **kwargs):
+        etag, match_condition = _conditions(kwargs)
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        with self._locked():
+            stored = self._load()
+            if stored is not None and not overwrite and match_condition is None:
+                raise _http_error(409, "The specified blob already exists.", ResourceExistsError)
+            _check_conditions(stored, etag, match_condition)
+            self._check_lease(stored, lease)
+            if isinstance(data, (bytes, bytearray, memoryview)):
+                source = lambda f: f.write(data)
+            else:
+                source = lambda f: shutil.copyfileobj(data, f)
+            return self._write(stored, source, "BlockBlob", metadata, content_settings)
+
+    def stage_block(self, block_id, data, length=None, validate_content=False, **kwargs):
+        os.makedirs(self._blocks_path, exist_ok=True)
+        _write_file(os.path.join(self._blocks_path, quote(block_id, safe='')), bytes(data))
+
+    def get_block_list(self, block_list_type="committed", **kwargs):
+        with self._locked(exclusive=False):
+            stored = self._load()
+        if stored is None and not os.path.isdir(self._blocks_path):
+            raise _http_error(404, "The specified blob does not exist.", ResourceNotFoundError)
+        committed = [SimpleNamespace(id=block_id, size=size) for block_id, size in (stored or {}).get("blocks", [])]
+        uncommitted = []
+        if block_list_type in ("all", "uncommitted") and os.path.isdir(self._blocks_path):
+            for entry in sorted(os.scandir(self._blocks_path), key=lambda entry: entry.name):
+                if not entry.name.endswith('.tmp'):
+                    uncommitted.append(SimpleNamespace(id=unquote(entry.name), size=entry.stat().st_size))
+        return committed, uncommitted
+
+    def commit_block_list(self, block_list, metadata=None, lease=None, content_settings=None, **kwargs):
+        etag, match_condition = _conditions(kwargs)
+        block_ids = [getattr(block, 'id', block) for block in block_list]
+        with self._locked():
+            stored = self._load()
+            _check_conditions(stored, etag, match_condition)
+            self._check_lease(stored, lease)
+            paths = [os.path.join(self._blocks_path, quote(block_id, safe='')) for block_id in block_ids]
+            missing = [block_id for block_id, path in zip(block_ids, paths) if not os.path.exists(path)]
+            if missing:
+                raise _http_error(400, f"The specified block list is invalid: {missing[0]} was not staged.")
+            sizes = [os.path.getsize(path) for path in paths]
+
+            def source(f):
+                for path in paths:
+                    with open(path, 'rb') as block:
+                        shutil.copyfileobj(block, f)
+
+            result = self._write(stored, source, "BlockBlob", metadata, content_settings)
+            stored = self._load()
+            stored["blocks"] = list(zip(block_ids, sizes))
+            self._save(stored)
+        shutil.rmtree(self._blocks_path, ignore_errors=True)
+        return result
+
+    def download_blob(self, offset=None, length=None, **kwargs):
+        etag, match_condition = _conditions(kwargs)
+        with self._locked(exclusive=False):
+            stored = self._load()
+            if stored is None:
+                raise _http_error(404, "The specified blob does not exist.", ResourceNotFoundError)
+            _check_conditions(stored, etag, match_condition)
+            data_file = open(self._data_path, 'rb')
+        offset = offset or 0
+        length = stored["size"] - offset if length is None else min(length, stored["size"] - offset)
+        properties = _properties(self.blob_name, self.container_name, stored)
+        return LocalDownloader(data_file, properties, offset, max(0, length), self.container_client.max_chunk_get_size)
+
+    def delete_blob(self, lease=None, **kwargs):
+        with self._locked():
+            stored = self._load()
+            if stored is None:
+                raise _http_error(404, "The specified blob does not exist.", ResourceNotFoundError)
+            self._check_lease(stored, lease)
+            os.remove(self._properties_path)
+            os.remove(self._data_path)
+        shutil.rmtree(self._blocks_path, ignore_errors=True)
+
+    def acquire_lease(self, lease_duration=-1, lease_id=None, **kwargs):
+        with self._locked():
+            stored = self._load()
+            if stored is None:
+                raise _http_error(404, "The specified blob does not exist.", ResourceNotFoundError)
+            if _lease_active(stored) and stored["lease"]["id"] != lease_id:
+                raise _http_error(409, "There is already a lease present.")
+            duration = lease_duration if lease_duration > 0 else 365 * 24 * 3600
+            stored["lease"] = {
+                "id": lease_id or str(uuid.uuid4()),
+                "duration": duration,
+                "expires": (_utcnow() + timedelta(seconds=duration)).isoformat(),
+            }
+            self._save(stored)
+        return LocalLease(self, stored["lease"]["id"])
+
+    def _renew_lease(self, lease_id):
+        with self._locked():
+            stored = self._load()
+            if stored is None:
+                raise ResourceNotFoundError("The specified blob does not exist.")
+            lease = stored.get("lease")
+            # An expired lease can be renewed as long as nobody else took the blob meanwhile
+            if lease is None or lease["id"] != lease_id:
+                raise _http_error(409, "The lease ID specified did not match the lease ID for the blob.")
+            lease["expires"] = (_utcnow() + timedelta(seconds=lease["duration"])).isoformat()
+            self._save(stored)
+
+    def _release_lease(self, lease_id):
+        with self._locked():
+            stored = self._load()
+            lease = stored.get("lease") if stored else None
+            if lease is None or lease["id"] != lease_id:
+                raise _http_error(409, "The lease ID specified did not match the lease ID for the blob.")
+            stored["lease"] = None
+            self._save(stored)
+
+    def create_append_blob(self, lease=None, metadata=None, **kwargs):
+        etag, match_condition = _conditions(kwargs)
+        with self._locked():
+            stored = self._load()
+            _check_conditions(stored, etag, match_condition)
+            self._check_lease(stored, lease)
+            return self._write(stored, lambda f: None, "AppendBlob", metadata, recreate=True)
+
+    def append_block(self, data, lease=None, **kwargs):
+        with self._locked():
+            stored = self._load()
+            if stored is None:
+                raise _http_error(404, "The specified blob does not exist.", ResourceNotFoundError)
+            if stored["blob_type"] != "AppendBlob":
+                raise _http_error(409, "The blob type is invalid for this operation.")
+            self._check_lease(stored, lease)
+            with open(self._data_path, 'ab') as f:
+                f.write(data)
+                stored["size"] = f.tell()
+            stored["etag"] = _new_etag()
+            stored["last_modified"] = _utcnow().isoformat()
+            self._save(stored)
+            return {"etag": stored["etag"], "last_modified": datetime.fromisoformat(stored["last_modified"])}
+
+class LocalItemPaged:
+    """Listing that can be iterated directly or page by page with continuation tokens."""
+
+    def __init__(self, container_client, name_starts_with, results_per_page):
+        self._container_client = container_client
+        self._prefix = name_starts_with or ""
+        self._page_size = results_per_page or 5000
+
+    def __iter__(self):
+        for page in self.by_page():
+            yield from page
+
+    def by_page(self, continuation_token=None):
+        return LocalPageIterator(self._container_client, self._prefix, self._page_size, continuation_token)
+
+class LocalPageIterator:
+    def __init__(self, container_client, prefix, page_size, continuation_token):
+        self._container_client = container_client
+        self._prefix = prefix
+        self._page_size = page_size
+        self.continuation_token = continuation_token
+        self._started = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._started and self.continuation_token is None:
+            raise StopIteration
+        self._started = True
+        names = self._container_client._blob_names(self._prefix)
+        if self.continuation_token:
+            names = [name for name in names if name > self.continuation_token]
+        page = names[:self._page_size]
+        self.continuation_token = page[-1] if len(names) > self._page_size else None
+        blobs = []
+        for name in page:
+            try:
+                blobs.append(self._container_client.get_blob_client(name).get_blob_properties())
+            except ResourceNotFoundError:
+                pass  # Deleted since the directory was read
+        return iter(blobs)
+
+class LocalContainerClient:
+    def __init__(self, service_client, container_name):
+        self.container_name = container_name
+        self.path = os.path.join(service_client.root, container_name)
+        self.max_chunk_get_size = service_client.max_chunk_get_size
+
+    def exists(self):
+        return os.path.isdir(self.path)
+
+    def create_container(self, **kwargs):
+        try:
+            os.makedirs(self.path)
+        except FileExistsError:
+            raise _http_error(409, "The specified container already exists.", ResourceExistsError)
+        os.makedirs(os.path.join(self.path, BLOCKS_DIR), exist_ok=True)
+        os.makedirs(os.path.join(self.path, LOCKS_DIR), exist_ok=True)
+
+    def delete_container(self, **kwargs):
+        if not self.exists():
+            raise _http_error(404, "The specified container does not exist.", ResourceNotFoundError)
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def get_blob_client(self, blob):
+        return LocalBlobClient(self, getattr(blob, 'name', blob))
+
+    def _blob_names(self, prefix=""):
+        if not self.exists():
+            raise _http_error(404, "The specified container does not exist.", ResourceNotFoundError)
+        names = []
+        for entry in os.scandir(self.path):
+            if entry.name.endswith(PROPERTIES_SUFFIX):
+                name = unquote(entry.name[:-len(PROPERTIES_SUFFIX)])
+                if name.startswith(prefix):
+                    names.append(name)
+        return sorted(names)
+
+    def list_blobs(self, name_starts_with=None, include=None, results_per_page=None, **kwargs):
+        return LocalItemPaged(self, name_starts_with, results_per_page)
+
+    def upload_blob(self, name, data, **kwargs):
+        blob_client = self.get_blob_client(name)
+        blob_client.upload_blob(data, **kwargs)
+        return blob_client
+
+    def delete_blob(self, blob, **kwargs):
+        self.get_blob_client(blob).delete_blob(**kwargs)
+
+    def delete_blobs(self, *blobs, raise_on_any_failure=True, **kwargs):
+        responses = []
+        for blob in blobs:
+            try:
+                self.get_blob_client(blob).delete_blob()
+                responses.append(SimpleNamespace(status_code=202))
+            except ResourceNotFoundError:
+                if raise_on_any_failure:
+                    raise
+                responses.append(SimpleNamespace(status_code=404))
+        return iter(responses)
+
+class LocalBlobServiceClient:
+    def __init__(self, root, max_chunk_get_size=4 * 1024 * 1024):
+        self.root = root
+        self.account_name = "local"
+        self.max_chunk_get_size = max_chunk_get_size
+        os.makedirs(root, exist_ok=True)
+
+    def get_container_client(self, container):
+        return LocalContainerClient(self, container)
+
+    def get_blob_client(self, container, blob):
+        return self.get_container_client(container).get_blob_client(blob)
+
+    def get_user_delegation_key(self, *args, **kwargs):
+        raise NotImplementedError("SAS URLs need Azure Storage; keep DOWNLOAD_SAS_REDIRECT off with local storage.")
@@ -0,0 +1,115 @@
+"""Per-process timings and counters of the hot paths, in the Prometheus text format.
+
+Code wraps each stage in span("area.stage") and adds to the counters below
+with count(). Spans of a request being profiled are also collected for it.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from urllib.parse import parse_qs, urlsplit
+import threading
+import time
+
+# Upper bounds, in seconds, of the stage duration histogram buckets
+SPAN_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+STAGE_SECONDS = "artifact_stage_seconds"
+BYTES_HASHED = "artifact_bytes_hashed_total"
+BYTES_COMPRESSED = "artifact_bytes_compressed_total"
+BYTES_TRANSFERRED = "artifact_bytes_transferred_total"
+AZURE_CALLS = "artifact_azure_calls_total"
+UPLOADS_REJECTED = "artifact_uploads_rejected_total"
+
+DESCRIPTIONS = {
+    STAGE_SECONDS: "Time spent in each stage of uploads, downloads, the admin portal and inventory rebuilds.",
+    BYTES_HASHED: "Bytes run through SHA-256.",
+    BYTES_COMPRESSED: "Bytes fed to the compressor.",
+    BYTES_TRANSFERRED: "Bytes sent to storage (upload) or to clients (download).",
+    AZURE_CALLS: "Azure Storage requests, including retries, by operation and response status.",
+    UPLOADS_REJECTED: "Uploads turned away by admission control, by limit and reason.",
+}
+
+_lock = threading.Lock()
+# (name, labels) -> value
+_counters = {}
+# stage -> [per-bucket counts, sum, count]
+_histograms = {}
+# (stage, seconds) spans of the request being profiled, or None
+_profile = ContextVar("profile", default=None)
+
+def count(name, value=1, **labels):
+    """Add value to a counter."""
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+def observe(stage, seconds):
+    """Record how long one run of a stage took."""
+    with _lock:
+        histogram = _histograms.get(stage)
+        if histogram is None:
+            histogram = _histograms[stage] = [[0] * (len(SPAN_BUCKETS) + 1), 0.0, 0]
+        bucket = next((i for i, bound in enumerate(SPAN_BUCKETS) if seconds <= bound), len(SPAN_BUCKETS))
+        histogram[0][bucket] += 1
+        histogram[1] += seconds
+        histogram[2] += 1
+    spans = _profile.get()
+    if spans is not None:
+        spans.append((stage, seconds))
+
+@contextmanager
+def span(stage):
+    """Time the enclosed block as one run of stage. Spans may nest."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - started)
+
+def start_profile():
+    """Collect the spans of the current context, and of threads started with a copy of it."""
+    return _profile.set([])
+
+def finish_profile(token):
+    """Stop collecting and return {stage: (total seconds, runs)} in order of first appearance."""
+    spans = _profile.get() or []
+    _profile.reset(token)
+    totals = {}
+    for stage, seconds in spans:
+        total, runs = totals.get(stage, (0.0, 0))
+        totals[stage] = (total + seconds, runs + 1)
+    return totals
+
+def count_azure_call(response):
+    """raw_response_hook for the Storage clients: count each request by operation and status."""
+    request = response.http_request
+    comp = parse_qs(urlsplit(request.url).query).get("comp")
+    operation = f"{request.method} {comp[0]}" if comp else request.method
+    count(AZURE_CALLS, operation=operation, status=str(response.http_response.status_code))
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+def render():
+    """The current values in the Prometheus text exposition format."""
+    with _lock:
+        counters = sorted(_counters.items())
+        histograms = sorted((stage, ([*counts], total, runs)) for stage, (counts, total, runs) in _histograms.items())
+    lines = []
+    described = set()
+    for (name, labels), value in counters:
+        if name not in described:
+            described.add(name)
+            lines += [f"# HELP {name} {DESCRIPTIONS.get(name, name)}", f"# TYPE {name} counter"]
+        lines.append(f"{name}{_format_labels(labels)} {value}")
+    if histograms:
+        lines += [f"# HELP {STAGE_SECONDS} {DESCRIPTIONS[STAGE_SECONDS]}", f"# TYPE {STAGE_SECONDS} histogram"]
+    for stage, (counts, total, runs) in histograms:
+        cumulative = 0
+        for bound, bucket_count in zip([*SPAN_BUCKETS, "+Inf"], counts):
+            cumulative += bucket_count
+            lines.append(f'{STAGE_SECONDS}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+        lines.append(f'{STAGE_SECONDS}_sum{{stage="{stage}"}} {total:.6f}')
+        lines.append(f'{STAGE_SECONDS}_count{{stage="{stage}"}} {runs}')
+    return "\n".join(lines) + "\n"
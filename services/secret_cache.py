@@ -0,0 +1,151 @@
+from services.db_service import DatabaseError, db_connection
+from collections import OrderedDict
+import os
+import threading
+import time
+import traceback
+
+SECRET_CACHE_SIZE = int(os.environ.get("SECRET_CACHE_SIZE", 1024))
+SECRET_CACHE_TTL = float(os.environ.get("SECRET_CACHE_TTL", 60))
+SECRET_CACHE_NEGATIVE_TTL = float(os.environ.get("SECRET_CACHE_NEGATIVE_TTL", 30))
+# Seconds between checks of the shared version that invalidations in any worker bump
+SECRET_CACHE_SYNC_INTERVAL = float(os.environ.get("SECRET_CACHE_SYNC_INTERVAL", 2))
+
+MISSING = object()
+
+def ensure_secret_cache_table(cursor):
+    """Create the table holding the version every worker's secret cache follows."""
+    cursor.execute(
+        "IF OBJECT_ID('SecretCacheVersion', 'U') IS NULL "
+        "CREATE TABLE SecretCacheVersion (id INT NOT NULL PRIMARY KEY, version BIGINT NOT NULL)"
+    )
+
+def _shared_version():
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT version FROM SecretCacheVersion WHERE id = 1")
+        row = cursor.fetchone()
+    return row[0] if row else 0
+
+def _bump_shared_version():
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("UPDATE SecretCacheVersion SET version = version + 1 WHERE id = 1")
+        if cursor.rowcount == 0:
+            try:
+                cursor.execute("INSERT INTO SecretCacheVersion (id, version) VALUES (1, 1)")
+            except DatabaseError:
+                # Inserted concurrently by another worker
+                conn.rollback()
+                cursor.execute("UPDATE SecretCacheVersion SET version = version + 1 WHERE id = 1")
+        conn.commit()
+
+class SecretCache:
+    """In-process TTL/LRU cache of case secret to container name lookups.
+
+    Unknown secrets are cached as well (with a shorter TTL) so repeated
+    guesses do not reach the database. The cache is local to each worker;
+    an invalidation also bumps a version in the database, and every worker
+    that sees it change within sync_interval drops all its entries.
+    """
+
+    def __init__(self, max_size=SECRET_CACHE_SIZE, ttl=SECRET_CACHE_TTL, negative_ttl=SECRET_CACHE_NEGATIVE_TTL,
+                 sync_interval=SECRET_CACHE_SYNC_INTERVAL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.sync_interval = sync_interval
+        self._entries = OrderedDict()  # secret -> (container_name or None, expires_at)
+        self._lock = threading.Lock()
+        self._version = None
+        self._next_sync = 0.0
+        self._metrics = {"hits": 0, "negative_hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def _sync(self):
+        """Drop every entry if another worker invalidated since the last check."""
+        with self._lock:
+            if time.monotonic() < self._next_sync:
+                return
+            self._next_sync = time.monotonic() + self.sync_interval
+        try:
+            version = _shared_version()
+        except Exception:
+            return  # Entries still expire after their TTL
+        with self._lock:
+            if version != self._version:
+                if self._version is not None:
+                    self._metrics["invalidations"] += len(self._entries)
+                    self._entries.clear()
+                self._version = version
+
+    def _publish(self):
+        try:
+            _bump_shared_version()
+        except Exception:
+            # Other workers then see the change once their entries expire
+            traceback.print_exc()
+
+    def get(self, secret):
+        """Return the cached container name (None for a known-bad secret) or MISSING."""
+        self._sync()
+        with self._lock:
+            entry = self._entries.get(secret)
+            if entry is None or entry[1] <= time.monotonic():
+                if entry is not None:
+                    del self._entries[secret]
+                self._metrics["misses"] += 1
+                return MISSING
+            self._entries.move_to_end(secret)
+            self._metrics["hits" if entry[0] is not None else "negative_hits"] += 1
+            return entry[0]
+
+    @property
+    def version(self):
+        return self._version
+
+    def put(self, secret, container_name, version=MISSING):
+        """Cache a lookup; one started before version changed is dropped."""
+        ttl = self.ttl if container_name is not None else self.negative_ttl
+        with self._lock:
+            if version is not MISSING and version != self._version:
+                return
+            self._entries[secret] = (container_name, time.monotonic() + ttl)
+            self._entries.move_to_end(secret)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._metrics["evictions"] += 1
+
+    def invalidate(self, secret):
+        with self._lock:
+            if self._entries.pop(secret, None) is not None:
+                self._metrics["invalidations"] += 1
+        self._publish()
+
+    def invalidate_container(self, container_name):
+        """Drop every cached secret that maps to the given container."""
+        with self._lock:
+            stale = [secret for secret, (name, _) in self._entries.items() if name == container_name]
+            for secret in stale:
+                del self._entries[secret]
+            self._metrics["invalidations"] += len(stale)
+        self._publish()
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._entries), "max_size": self.max_size, **self._metrics}
+
+secret_cache = SecretCache()
+
+def lookup_container(secret):
+    """Return the container name for a case secret, or None if no case matches or it is being deleted."""
+    container_name = secret_cache.get(secret)
+    if container_name is not MISSING:
+        return container_name
+    version = secret_cache.version
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT container_name FROM Cases WHERE secret = ? AND delete_job IS NULL", (secret,))
+        result = cursor.fetchone()
+    container_name = result[0] if result else None
+    secret_cache.put(secret, container_name, version)
+    return container_name
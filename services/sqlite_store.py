@@ -0,0 +1,93 @@
+"""SQLite stand-in for the Azure SQL case store.
+
+Connections speak the DB-API subset the app uses through pyodbc. The few
+T-SQL constructs in the app are translated: the startup schema checks are
+skipped because the full schema is created on connect, MERGE becomes an
+upsert and OUTPUT becomes RETURNING.
+"""
+from datetime import datetime
+import re
+import sqlite3
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS Cases ("
+    "id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, container_name TEXT UNIQUE NOT NULL, "
+    "secret TEXT UNIQUE NOT NULL, file_count INTEGER NULL, total_size INTEGER NULL, "
+    "stats_updated_at TIMESTAMP NULL, compression TEXT NULL, delete_job TEXT NULL)",
+    "CREATE TABLE IF NOT EXISTS ContentIndex ("
+    "content_hash TEXT NOT NULL PRIMARY KEY, ref_count INTEGER NOT NULL, updated_at TIMESTAMP NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS SecretCacheVersion (id INTEGER NOT NULL PRIMARY KEY, version INTEGER NOT NULL)",
+)
+
+# Errors the connection pool treats as a broken connection
+DisconnectErrors = (sqlite3.OperationalError, sqlite3.InterfaceError)
+Error = sqlite3.Error
+
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(" "))
+sqlite3.register_converter("TIMESTAMP", lambda value: datetime.fromisoformat(value.decode()))
+
+_OUTPUT = re.compile(r"^(UPDATE .*?) OUTPUT inserted\.(\w+) (WHERE .*)$", re.IGNORECASE | re.DOTALL)
+
+def _increment_content(params):
+    content_hash, updated_at, _ = params
+    return (
+        "INSERT INTO ContentIndex (content_hash, ref_count, updated_at) VALUES (?, 1, ?) "
+        "ON CONFLICT(content_hash) DO UPDATE SET ref_count = ref_count + 1, updated_at = excluded.updated_at",
+        (content_hash, updated_at),
+    )
+
+def translate(sql, params=()):
+    """Return the SQLite statement and parameters for a T-SQL statement, or None to skip it."""
+    if sql.startswith(("IF COL_LENGTH(", "IF OBJECT_ID(")):
+        return None
+    if sql.startswith("MERGE ContentIndex"):
+        return _increment_content(params)
+    match = _OUTPUT.match(sql)
+    if match:
+        return f"{match.group(1)} {match.group(3)} RETURNING {match.group(2)}", params
+    return sql, params
+
+class Cursor:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, sql, params=()):
+        statement = translate(sql, params)
+        if statement is not None:
+            self._cursor.execute(*statement)
+        return self
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+class Connection:
+    def __init__(self, conn):
+        self._conn = conn
+
+    def cursor(self):
+        return Cursor(self._conn.cursor())
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def close(self):
+        self._conn.close()
+
+def connect(path):
+    """Open the database file, creating the schema on first use."""
+    conn = sqlite3.connect(path, timeout=30, check_same_thread=False, detect_types=sqlite3.PARSE_DECLTYPES)
+    conn.execute("PRAGMA journal_mode=WAL")
+    for statement in SCHEMA:
+        conn.execute(statement)
+    conn.commit()
+    return Connection(conn)
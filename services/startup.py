@@ -0,0 +1,75 @@
+from azure.core.exceptions import ResourceExistsError
+from services.blob_service import create_container
+from services.case_deletion import ensure_deletion_column
+from services.case_stats import ensure_stats_columns
+from services.compression_service import ensure_compression_column
+from services.content_store import ensure_content_table
+from services.db_service import db_connection
+from services.secret_cache import ensure_secret_cache_table
+import os
+import threading
+import time
+import traceback
+
+# Seconds to wait after a failed startup before a request tries it again
+STARTUP_RETRY_DELAY = float(os.environ.get("STARTUP_RETRY_DELAY", 15))
+
+DEFAULT_CASE = ("default", "uploads", "0000-0000-0000-0000")
+
+_started = False
+_next_attempt = 0.0
+_lock = threading.Lock()
+
+def ensure_schema():
+    """Add the tables and columns newer versions rely on to an existing database."""
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        ensure_stats_columns(cursor)
+        ensure_content_table(cursor)
+        ensure_compression_column(cursor)
+        ensure_deletion_column(cursor)
+        ensure_secret_cache_table(cursor)
+        conn.commit()
+
+def ensure_default_case():
+    """Create the default case and its container unless they exist; safe to run from several workers at once."""
+    name, container_name, secret = DEFAULT_CASE
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT 1 FROM Cases WHERE container_name = ?", (container_name,))
+        if cursor.fetchone():
+            return
+        try:
+            create_container(container_name)
+        except ResourceExistsError:
+            pass
+        try:
+            cursor.execute("INSERT INTO Cases (name, container_name, secret) VALUES (?, ?, ?)", (name, container_name, secret))
+            conn.commit()
+        except Exception:
+            # Inserted concurrently by another worker, or a real failure
+            conn.rollback()
+            cursor.execute("SELECT 1 FROM Cases WHERE container_name = ?", (container_name,))
+            if not cursor.fetchone():
+                raise
+
+def run_startup():
+    """Run the one-time startup tasks unless they already succeeded in this process.
+
+    Called before each request. A failure, e.g. while SQL is briefly
+    unavailable, is printed rather than failing the request, and tried again
+    after STARTUP_RETRY_DELAY.
+    """
+    global _started, _next_attempt
+    if _started:
+        return
+    with _lock:
+        if _started or time.monotonic() < _next_attempt:
+            return
+        try:
+            ensure_schema()
+            ensure_default_case()
+            _started = True
+        except Exception:
+            traceback.print_exc()
+            _next_attempt = time.monotonic() + STARTUP_RETRY_DELAY
@@ -0,0 +1,293 @@
+"""Admission control for form uploads.
+
+Uploads take a slot of their case and a slot of the worker process before
+their files are read, and wait a bounded time in a bounded queue for one;
+beyond that they are rejected at once so the client can retry later. The
+request body is read in small chunks no faster than the byte-rate limits,
+so a fast client is slowed down by TCP backpressure instead of being
+buffered, and files are spooled to disk as Flask's own form parser does.
+Chunk uploads and the commits that store them take the same slots.
+
+Slots and rates are counted in each worker process and not shared across
+them, so a case can have UPLOAD_MAX_ACTIVE_PER_CASE uploads in progress
+on every worker at once.
+"""
+from services.metrics import UPLOADS_REJECTED, count, span
+from werkzeug.datastructures import FileStorage, MultiDict
+from werkzeug.exceptions import BadRequest, RequestEntityTooLarge
+from werkzeug.formparser import default_stream_factory
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
+from contextlib import contextmanager
+import os
+import threading
+import time
+
+# Form uploads handled at once by one worker process, across all cases and per case
+UPLOAD_MAX_ACTIVE = int(os.environ.get("UPLOAD_MAX_ACTIVE", 8))
+UPLOAD_MAX_ACTIVE_PER_CASE = int(os.environ.get("UPLOAD_MAX_ACTIVE_PER_CASE", 2))
+# Uploads that may wait for a slot, across all cases and per case; more are rejected at once
+UPLOAD_MAX_WAITING = int(os.environ.get("UPLOAD_MAX_WAITING", 16))
+UPLOAD_MAX_WAITING_PER_CASE = int(os.environ.get("UPLOAD_MAX_WAITING_PER_CASE", 4))
+# Seconds an upload waits for a slot before it is rejected
+UPLOAD_MAX_WAIT = float(os.environ.get("UPLOAD_MAX_WAIT", 30))
+# Retry-After, in seconds, sent with a rejection
+UPLOAD_RETRY_AFTER = int(os.environ.get("UPLOAD_RETRY_AFTER", 10))
+# Request body bytes read per second by one worker process, and per case; 0 is unlimited
+UPLOAD_BYTES_PER_SECOND = int(os.environ.get("UPLOAD_BYTES_PER_SECOND", 0))
+UPLOAD_CASE_BYTES_PER_SECOND = int(os.environ.get("UPLOAD_CASE_BYTES_PER_SECOND", 0))
+
+# Bytes read from the request body at a time
+READ_SIZE = 64 * 1024
+# Limits on the form itself, as Flask applies by default
+MAX_FORM_MEMORY_SIZE = 500_000
+MAX_FORM_PARTS = 1000
+
+class UploadRejected(Exception):
+    """No upload slot is available; the client should retry after retry_after seconds."""
+
+    def __init__(self, message, retry_after=UPLOAD_RETRY_AFTER):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class Slots:
+    """Counting semaphore whose waiters are bounded in number and in time."""
+
+    def __init__(self, limit, max_waiting, scope):
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self.scope = scope
+        self.active = 0
+        self.waiting = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, timeout=UPLOAD_MAX_WAIT):
+        with self._condition:
+            if self.active >= self.limit:
+                if self.waiting >= self.max_waiting:
+                    count(UPLOADS_REJECTED, scope=self.scope, reason="queue_full")
+                    raise UploadRejected(f"Too many uploads are in progress for this {self.scope}. Try again shortly.")
+                deadline = time.monotonic() + timeout
+                self.waiting += 1
+                try:
+                    while self.active >= self.limit:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            count(UPLOADS_REJECTED, scope=self.scope, reason="timeout")
+                            raise UploadRejected(f"Timed out waiting for other uploads to this {self.scope}. Try again shortly.")
+                        self._condition.wait(remaining)
+                finally:
+                    self.waiting -= 1
+            self.active += 1
+
+    def release(self):
+        with self._condition:
+            self.active -= 1
+            self._condition.notify()
+
+class RateLimit:
+    """Token bucket pacing reads to a byte rate, allowing one second's worth of burst."""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self._tokens = rate
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, amount):
+        """Account for amount bytes, sleeping until the rate allows them."""
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # Going into debt makes later readers wait their turn behind this one
+            self._tokens -= amount
+            delay = -self._tokens / self.rate
+        if delay > 0:
+            time.sleep(delay)
+
+_process_slots = Slots(UPLOAD_MAX_ACTIVE, UPLOAD_MAX_WAITING, "server")
+_process_rate = RateLimit(UPLOAD_BYTES_PER_SECOND)
+# container name -> (Slots, RateLimit); one entry per case that has uploaded to this process
+_cases = {}
+_cases_lock = threading.Lock()
+
+def _case_limits(container_name):
+    with _cases_lock:
+        limits = _cases.get(container_name)
+        if limits is None:
+            limits = _cases[container_name] = (
+                Slots(UPLOAD_MAX_ACTIVE_PER_CASE, UPLOAD_MAX_WAITING_PER_CASE, "case"),
+                RateLimit(UPLOAD_CASE_BYTES_PER_SECOND),
+            )
+        return limits
+
+class AdmittedUpload:
+    """The form of an upload read under the admission limits."""
+
+    def __init__(self):
+        self.form = MultiDict()
+        self.files = MultiDict()
+        self.container_name = None
+        self._rates = [_process_rate]
+        self._case_slots = None
+        self._has_process_slot = False
+
+    def admit_case(self, container_name):
+        """Take the case's slot, then the process slot unless already held.
+
+        Slots are always taken case first: a process slot taken for files
+        sent before the secret is given back while waiting for the case, so
+        no upload holds a process slot while it queues behind its own case.
+        """
+        if container_name and self._case_slots is None:
+            slots, rate = _case_limits(container_name)
+            self._release_process()
+            with span("upload.admission_wait"):
+                slots.acquire()
+            self._case_slots = slots
+            self._rates.append(rate)
+        self.container_name = container_name
+        self.admit_process()
+
+    def admit_process(self):
+        if not self._has_process_slot:
+            with span("upload.admission_wait"):
+                _process_slots.acquire()
+            self._has_process_slot = True
+
+    def _release_process(self):
+        if self._has_process_slot:
+            self._has_process_slot = False
+            _process_slots.release()
+
+    def read(self, stream):
+        """Read the next chunk of the body at the allowed rate; b'' at its end."""
+        chunk = stream.read(READ_SIZE)
+        for rate in self._rates:
+            rate.consume(len(chunk))
+        return chunk
+
+    def release(self):
+        self._release_process()
+        if self._case_slots is not None:
+            self._case_slots.release()
+            self._case_slots = None
+
+def admit_case(container_name):
+    """Take the case's slot, then the process slot, for an upload that is not a form.
+
+    Returns the AdmittedUpload holding them; the caller must release it,
+    possibly from the background job that finishes the upload. Raises
+    UploadRejected if no slot is available.
+    """
+    upload = AdmittedUpload()
+    try:
+        upload.admit_case(container_name)
+    except BaseException:
+        upload.release()
+        raise
+    return upload
+
+def _charset(headers):
+    charset = parse_options_header(headers.get("content-type"))[1].get("charset", "").lower()
+    return charset if charset in ("ascii", "us-ascii", "utf-8", "iso-8859-1") else "utf-8"
+
+def _events(decoder, data):
+    """Feed data (None at the end of the body) to the decoder; return the events it completes and whether the form ended."""
+    try:
+        decoder.receive_data(data)
+        events = []
+        event = decoder.next_event()
+        while not isinstance(event, (NeedData, Epilogue)):
+            events.append(event)
+            event = decoder.next_event()
+    except ValueError as e:
+        raise BadRequest(f"Invalid upload form: {e}")
+    return events, isinstance(event, Epilogue)
+
+@contextmanager
+def admit_upload(stream, content_type, content_length, resolve_case):
+    """Read a multipart upload form under the admission limits, holding its slots until the block exits.
+
+    resolve_case(secret) returns the container name of the case the secret
+    field names, or None; reading stops at an unknown secret and the form
+    read so far is yielded once the rest of the body has been discarded, so
+    a keep-alive connection is left at the next request. The case's slot is
+    taken as soon as the secret has been read, so forms that send it before
+    their files, as the upload page does, queue per case before any file
+    data is read.
+
+    Yields an AdmittedUpload. Raises UploadRejected if no slot is available.
+    """
+    mimetype, options = parse_options_header(content_type)
+    boundary = options.get("boundary", "").encode()
+    if mimetype != "multipart/form-data" or not boundary:
+        raise BadRequest("Expected a multipart/form-data upload.")
+
+    upload = AdmittedUpload()
+    decoder = MultipartDecoder(boundary, max_form_memory_size=MAX_FORM_MEMORY_SIZE, max_parts=MAX_FORM_PARTS)
+    fields = []
+    files = []
+    part = container = field_size = None
+    resolved = finished = unknown_case = False
+    try:
+        while not finished:
+            chunk = upload.read(stream)
+            events, finished = _events(decoder, chunk or None)
+            finished = finished or not chunk
+            for event in events:
+                if isinstance(event, Field):
+                    part, container, field_size = event, [], 0
+                elif isinstance(event, File):
+                    # Files sent before the secret are read under the process limits only
+                    upload.admit_process()
+                    part, field_size = event, None
+                    container = default_stream_factory(
+                        total_content_length=content_length,
+                        content_type=event.headers.get("content-type"),
+                        filename=event.filename,
+                    )
+                elif isinstance(event, Data):
+                    if field_size is None:
+                        container.write(event.data)
+                    else:
+                        field_size += len(event.data)
+                        if field_size > MAX_FORM_MEMORY_SIZE:
+                            raise RequestEntityTooLarge()
+                        container.append(event.data)
+                    if event.more_data:
+                        continue
+                    if isinstance(part, File):
+                        container.seek(0)
+                        files.append((part.name, FileStorage(container, part.filename, part.name, headers=part.headers)))
+                        continue
+                    value = b"".join(container).decode(_charset(part.headers), "replace")
+                    fields.append((part.name, value))
+                    if part.name == "secret" and not resolved:
+                        resolved = True
+                        container_name = resolve_case(value)
+                        if container_name is None:
+                            unknown_case = finished = True
+                            break
+                        upload.admit_case(container_name)
+
+        if unknown_case:
+            # Discarded at the same rate limits, without parsing
+            while upload.read(stream):
+                pass
+        upload.form, upload.files = MultiDict(fields), MultiDict(files)
+        if not resolved and upload.form.get("secret"):
+            container_name = resolve_case(upload.form["secret"])
+            if container_name:
+                upload.admit_case(container_name)
+        yield upload
+    finally:
+        # Includes a file whose part was cut short
+        if field_size is None and container is not None:
+            container.close()
+        for _, file in files:
+            file.close()
+        upload.release()
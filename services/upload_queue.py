@@ -0,0 +1,285 @@
+"""Durable local queue for upload post-processing.
+
+Uploads are saved to UPLOAD_FOLDER and recorded as jobs in a SQLite
+database next to them. Worker threads, in the web process or in a separate
+``python -m services.upload_queue`` process on the same host, claim jobs
+and run the hashing, zipping, storage and inventory work with retries.
+Both files and jobs are local to the host, so a job's status is only known
+to the instance that took the upload.
+"""
+from services.blob_service import get_blob_service_client
+from services.case_stats import record_change
+from services.chunked_upload_service import open_staged, staging_blob
+from services.compression_service import get_case_compression
+from services.inventory_service import get_inventory
+from services.startup import run_startup
+from services.upload_service import UPLOAD_WORKERS, UploadBatch, describe_upload, process_file, start_verification
+from azure.core.exceptions import ResourceNotFoundError
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import json
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+
+UPLOAD_FOLDER = os.environ.get("UPLOAD_FOLDER", "./uploads")
+UPLOAD_QUEUE_DB = os.path.join(UPLOAD_FOLDER, "queue.sqlite3")
+# Process uploads through the queue; 0 keeps the work inside the upload request.
+# Jobs live in a SQLite file on this host, so only enable it where every
+# request for a job reaches the host that queued it
+UPLOAD_QUEUE = os.environ.get("UPLOAD_QUEUE", "0") == "1"
+# Worker threads started in the web process; 0 when a separate worker process runs the queue
+UPLOAD_QUEUE_WORKERS = int(os.environ.get("UPLOAD_QUEUE_WORKERS", 2))
+UPLOAD_QUEUE_MAX_ATTEMPTS = int(os.environ.get("UPLOAD_QUEUE_MAX_ATTEMPTS", 3))
+# Seconds before the first retry, doubled for each further attempt
+UPLOAD_QUEUE_RETRY_DELAY = float(os.environ.get("UPLOAD_QUEUE_RETRY_DELAY", 30))
+# A running job whose worker stops renewing its claim this long is picked up again
+CLAIM_SECONDS = 120
+POLL_INTERVAL = 1
+
+_schema_ready = False
+_schema_lock = threading.Lock()
+_workers_started = False
+
+def _utcnow():
+    return datetime.utcnow().isoformat() + "Z"
+
+def _connect():
+    global _schema_ready
+    conn = sqlite3.connect(UPLOAD_QUEUE_DB, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    with _schema_lock:
+        if not _schema_ready:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS upload_jobs ("
+                "id TEXT PRIMARY KEY, container_name TEXT NOT NULL, compression TEXT, "
+                "items TEXT NOT NULL, result TEXT NOT NULL, status TEXT NOT NULL, "
+                "attempts INTEGER NOT NULL DEFAULT 0, not_before REAL NOT NULL, claimed_until REAL, "
+                "error TEXT, created_at TEXT NOT NULL, updated_at TEXT NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS upload_jobs_pending ON upload_jobs (status, not_before)")
+            _schema_ready = True
+    return conn
+
+def _insert(job_id, container_name, items, compression, skipped=()):
+    now = _utcnow()
+    conn = _connect()
+    try:
+        conn.execute(
+            "INSERT OR IGNORE INTO upload_jobs (id, container_name, compression, items, result, status, not_before, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, 'queued', ?, ?, ?)",
+            (job_id, container_name, compression, json.dumps(items),
+             json.dumps({"uploaded": [], "duplicates": list(skipped)}), time.time(), now, now),
+        )
+    finally:
+        conn.close()
+    return job_id
+
+def enqueue_files(container_name, files, compression=None, skipped=()):
+    """Save uploaded files to UPLOAD_FOLDER and queue them; returns the job id."""
+    job_id = uuid.uuid4().hex
+    job_folder = os.path.join(UPLOAD_FOLDER, job_id)
+    os.makedirs(job_folder)
+    items = []
+    for index, file in enumerate(files):
+        path = os.path.join(job_folder, str(index))
+        file.save(path)
+        items.append({"path": path, "filename": file.filename, "key": f"{job_id}-{index}"})
+    return _insert(job_id, container_name, items, compression, skipped)
+
+def enqueue_staged(upload):
+    """Queue an assembled chunked upload; returns the job id.
+
+    The job takes the upload's id, so committing the same upload twice queues it once.
+    """
+    item = {"staging": upload['id'], "filename": upload['filename'], "key": upload['id']}
+    return _insert(upload['id'], upload['container'], [item], upload.get('compression'))
+
+def get_upload_job(job_id):
+    """Return the status of an upload job, or None if it is unknown."""
+    if not re.fullmatch(r"[0-9a-f]{32}", job_id):
+        return None
+    conn = _connect()
+    try:
+        row = conn.execute("SELECT * FROM upload_jobs WHERE id = ?", (job_id,)).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        return None
+    return {
+        "id": row["id"],
+        "status": row["status"],
+        "attempts": row["attempts"],
+        "pending": len(json.loads(row["items"])),
+        "result": json.loads(row["result"]),
+        "error": row["error"],
+        "created_at": row["created_at"],
+        "updated_at": row["updated_at"],
+    }
+
+def _claim():
+    """Take the oldest due job, or one whose worker died, and mark it running."""
+    now = time.time()
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute(
+            "SELECT * FROM upload_jobs WHERE (status = 'queued' AND not_before <= ?) "
+            "OR (status = 'running' AND claimed_until < ?) ORDER BY created_at LIMIT 1",
+            (now, now),
+        ).fetchone()
+        if row is not None:
+            conn.execute(
+                "UPDATE upload_jobs SET status = 'running', attempts = attempts + 1, claimed_until = ?, updated_at = ? "
+                "WHERE id = ?",
+                (now + CLAIM_SECONDS, _utcnow(), row["id"]),
+            )
+        conn.execute("COMMIT")
+        return dict(row) if row is not None else None
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+def _update(job_id, **fields):
+    fields["updated_at"] = _utcnow()
+    conn = _connect()
+    try:
+        conn.execute(
+            f"UPDATE upload_jobs SET {', '.join(f'{name} = ?' for name in fields)} WHERE id = ?",
+            (*fields.values(), job_id),
+        )
+    finally:
+        conn.close()
+
+def _keep_claimed(job_id, stopped):
+    while not stopped.wait(CLAIM_SECONDS / 3):
+        _update(job_id, claimed_until=time.time() + CLAIM_SECONDS)
+
+def _open_item(item):
+    if "path" in item:
+        return open(item["path"], 'rb')
+    return open_staged(item["staging"])
+
+def _discard_item(item):
+    try:
+        if "path" in item:
+            os.remove(item["path"])
+        else:
+            staging_blob(item["staging"]).delete_blob()
+    except (FileNotFoundError, ResourceNotFoundError):
+        pass
+
+def process_job(job):
+    """Store every pending file of a job in its case.
+
+    Finished files are recorded and removed from the job, so a retry only
+    processes the files that failed. Each file is stored under its item key,
+    so a retry of a file whose link blob was already written reuses that
+    blob. Returns the files still pending and the first error.
+    """
+    items = json.loads(job["items"])
+    result = json.loads(job["result"])
+    container_client = get_blob_service_client().get_container_client(job["container_name"])
+    inventory = get_inventory(container_client)
+    compression = job["compression"] or get_case_compression(job["container_name"])
+    batch = UploadBatch(container_client, inventory, compression)
+
+    entries = []
+    pending = []
+    error = None
+    streams = [_open_item(item) for item in items]
+    try:
+        with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as executor:
+            futures = [
+                (item, executor.submit(process_file, batch, stream, item["filename"], item.get("key")))
+                for item, stream in zip(items, streams)
+            ]
+            for item, future in futures:
+                try:
+                    entry = future.result()
+                except Exception as e:
+                    error = error or e
+                    pending.append(item)
+                    continue
+                if entry:
+                    entries.append(entry)
+                    result["uploaded"].append(describe_upload(entry))
+                else:
+                    result["duplicates"].append(item["filename"])
+    finally:
+        for stream in streams:
+            stream.close()
+
+    inventory.add(*entries)
+    record_change(job["container_name"], len(entries), sum(entry['stored_size'] for entry in entries))
+    start_verification(job["container_name"], entries)
+    for item in items:
+        if item not in pending:
+            _discard_item(item)
+    _update(job["id"], items=json.dumps(pending), result=json.dumps(result))
+    return pending, error
+
+def _run(job):
+    stopped = threading.Event()
+    threading.Thread(target=_keep_claimed, args=(job["id"], stopped), daemon=True).start()
+    try:
+        try:
+            pending, error = process_job(job)
+        except Exception as e:
+            pending, error = json.loads(job["items"]), e
+    finally:
+        stopped.set()
+
+    if not error:
+        _update(job["id"], status="completed", error=None, claimed_until=None)
+        shutil.rmtree(os.path.join(UPLOAD_FOLDER, job["id"]), ignore_errors=True)
+    elif job["attempts"] + 1 < UPLOAD_QUEUE_MAX_ATTEMPTS:
+        delay = UPLOAD_QUEUE_RETRY_DELAY * 2 ** job["attempts"]
+        _update(job["id"], status="queued", error=f"{error}", not_before=time.time() + delay, claimed_until=None)
+    else:
+        traceback.print_exception(error)
+        _update(job["id"], status="failed", error=f"{error}", claimed_until=None)
+        for item in pending:
+            _discard_item(item)
+        shutil.rmtree(os.path.join(UPLOAD_FOLDER, job["id"]), ignore_errors=True)
+
+def run_worker(stop=None):
+    """Process queued upload jobs until stop is set."""
+    stop = stop or threading.Event()
+    while not stop.is_set():
+        # A worker process may start before any web request has run the startup tasks
+        run_startup()
+        try:
+            job = _claim()
+        except sqlite3.Error:
+            traceback.print_exc()
+            job = None
+        if job is None:
+            stop.wait(POLL_INTERVAL)
+            continue
+        _run(job)
+
+def start_workers(count=UPLOAD_QUEUE_WORKERS):
+    """Start queue worker threads in this process, once."""
+    global _workers_started
+    if _workers_started or not UPLOAD_QUEUE:
+        return
+    _workers_started = True
+    for index in range(count):
+        threading.Thread(target=run_worker, name=f"upload-queue-{index}", daemon=True).start()
+
+if __name__ == '__main__':
+    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+    threads = [threading.Thread(target=run_worker, daemon=True) for _ in range(max(1, UPLOAD_QUEUE_WORKERS))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
@@ -0,0 +1,317 @@
+from azure.core.exceptions import ResourceExistsError
+from services.blob_service import BLOCK_SIZE, BlobReader, BlockBlobWriter, get_blob_service_client
+from services.compression_service import CODECS, choose_compression
+from services.inventory_service import get_inventory
+from services.job_service import JobRunner, start_job
+from services.content_store import (
+    CONTENT_METADATA_KEY, CONTENT_SIZE_METADATA_KEY, add_reference, content_blob_client, release_reference, store_content,
+)
+from services.metrics import BYTES_COMPRESSED, BYTES_HASHED, count, span
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from datetime import datetime
+import hashlib
+import io
+import os
+import threading
+import time
+import zipfile
+
+# Files of one upload request processed concurrently. hashlib and zlib release
+# the GIL on large buffers, so threads overlap both blob I/O and CPU work.
+UPLOAD_WORKERS = int(os.environ.get("UPLOAD_WORKERS", 4))
+# Fully test pre-zipped uploads in a background job once they are stored
+VERIFY_PASSTHROUGH_ARCHIVES = os.environ.get("VERIFY_PASSTHROUGH_ARCHIVES", "1") == "1"
+# Archives verified at once by each worker process; the others wait their turn
+VERIFY_ARCHIVE_WORKERS = int(os.environ.get("VERIFY_ARCHIVE_WORKERS", 2))
+# Link blobs written for a queued upload item carry its key, so a retry finds them
+UPLOAD_KEY_METADATA_KEY = "upload"
+
+def iter_chunks(stream, chunk_size=BLOCK_SIZE):
+    """Yield successive chunks from a file-like object until it is exhausted."""
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+def hash_stream(stream, chunk_size=BLOCK_SIZE):
+    """Return the SHA-256 hex digest and size of a stream, then rewind it."""
+    stream.seek(0)
+    digest = hashlib.sha256()
+    size = 0
+    for chunk in iter_chunks(stream, chunk_size):
+        digest.update(chunk)
+        size += len(chunk)
+    stream.seek(0)
+    count(BYTES_HASHED, size)
+    return digest.hexdigest(), size
+
+def copy_stream(stream, output, chunk_size=BLOCK_SIZE):
+    """Copy a stream to output chunk by chunk."""
+    for chunk in iter_chunks(stream, chunk_size):
+        output.write(chunk)
+
+def compress_and_secure_file(file, output, arcname=None, password="infected", chunk_size=BLOCK_SIZE,
+                             codec="deflate", level=None):
+    """Compress and secure the file with a password, streaming the archive into output."""
+    with zipfile.ZipFile(output, 'w', CODECS[codec], compresslevel=level) as zip_file:
+        zip_file.setpassword(password.encode())
+        with zip_file.open(arcname or file.filename, 'w', force_zip64=True) as entry:
+            copy_stream(file, entry, chunk_size)
+
+def is_compressed_with_password(file, password="infected"):
+    """Check if the file is a ZIP archive that can be stored as it is.
+
+    Only the central directory is read, plus the encryption header of one
+    encrypted member to check the password; no member is decompressed.
+    verify_archive does the full check after upload.
+    """
+    try:
+        with zipfile.ZipFile(file) as zip_file:
+            members = zip_file.infolist()
+            if any(info.compress_type not in CODECS.values() for info in members):
+                return False
+            encrypted = next((info for info in members if info.flag_bits & 0x1), None)
+            if encrypted:
+                # Raises RuntimeError if the password does not match
+                zip_file.open(encrypted, pwd=password.encode()).close()
+        return True
+    except (zipfile.BadZipFile, RuntimeError, zipfile.LargeZipFile, NotImplementedError):
+        return False
+    finally:
+        file.seek(0)
+
+def verify_archive(job, container_name, entry, password="infected"):
+    """Decompress and CRC-check every member of a stored archive.
+
+    Runs as a background job after a pre-zipped file was stored as it is, and
+    records the outcome in the file's inventory entry.
+    """
+    stream = io.BufferedReader(BlobReader(content_blob_client(entry['content'])), buffer_size=BLOCK_SIZE)
+    error = None
+    try:
+        with zipfile.ZipFile(stream) as zip_file:
+            zip_file.setpassword(password.encode())
+            members = zip_file.infolist()
+            job.add_total(len(members))
+            for info in members:
+                try:
+                    with zip_file.open(info) as member:
+                        for _ in iter_chunks(member):
+                            pass
+                except Exception as e:
+                    error = f"{info.filename}: {e}"
+                    break
+                job.advance(message=info.filename)
+    except zipfile.BadZipFile as e:
+        error = f"{e}"
+
+    verification = {
+        "status": "failed" if error else "ok",
+        "error": error,
+        "checked_at": datetime.utcnow().isoformat() + "Z",
+    }
+    inventory = get_inventory(get_blob_service_client().get_container_client(container_name))
+    current = inventory.get(entry['name'])
+    if current and current.get('etag') == entry['etag']:
+        inventory.add({**current, "verification": verification})
+    return verification
+
+_verify_runner = JobRunner(VERIFY_ARCHIVE_WORKERS, "verify-archive")
+
+def start_verification(container_name, entries):
+    """Queue a verify_archive job for each entry stored as it was uploaded."""
+    if not VERIFY_PASSTHROUGH_ARCHIVES:
+        return
+    for entry in entries:
+        if (entry.get("compression") or {}).get("method") == "passthrough":
+            start_job("verify_archive", verify_archive, container_name, entry, runner=_verify_runner,
+                      params={"container": container_name, "name": entry['name']})
+
+class UploadBatch:
+    """Shared state for the files of one upload request processed concurrently."""
+
+    def __init__(self, container_client, inventory, compression=None):
+        self.container_client = container_client
+        self.inventory = inventory
+        # codec[:level] spec for new content; None uses the default
+        self.compression = compression
+        self._reserved_names = set()
+        # base name -> blob names listed after a clash
+        self._listed_names = {}
+        self._lock = threading.Lock()
+
+    def find_duplicate(self, unzipped_hash):
+        """Return the inventory entry of a stored blob with this content, if any."""
+        # A pass-through archive is stored as-is, so its zipped hash is its raw hash
+        return self.inventory.find_by_unzipped_hash(unzipped_hash) or self.inventory.find_by_zipped_hash(unzipped_hash)
+
+    def name_taken(self, filename, upload_key=None):
+        """List the blobs named like filename after creating one found its name taken.
+
+        Later names for the file are picked from the listing. Returns the link
+        blob an earlier attempt at the upload upload_key created, if any.
+        """
+        base_name, _ = os.path.splitext(filename)
+        blobs = list(self.container_client.list_blobs(name_starts_with=base_name, include=['metadata']))
+        with self._lock:
+            self._listed_names.setdefault(base_name, set()).update(blob.name for blob in blobs)
+        for blob in blobs:
+            if upload_key and (blob.metadata or {}).get(UPLOAD_KEY_METADATA_KEY) == upload_key:
+                return blob
+        return None
+
+    def allocate_name(self, filename):
+        """Pick a blob name for the file that is free in the batch, and reserve it.
+
+        The container is only listed once a name turns out to be taken, so
+        most files cost a single request. The caller must create the blob
+        conditionally and call name_taken before asking again.
+        """
+        base_name, extension = os.path.splitext(filename)
+        counter = 0
+        with self._lock:
+            existing = self._listed_names.get(base_name, ())
+            while True:
+                name = f"{filename}.zip" if counter == 0 else f"{base_name}_{counter}{extension}.zip"
+                counter += 1
+                if name not in self._reserved_names and name not in existing and name not in self.inventory:
+                    self._reserved_names.add(name)
+                    return name
+
+def _entry(blob_name, unzipped_hash, file_size, content, etag, elapsed):
+    return {
+        "name": blob_name,
+        "unzipped_hash": unzipped_hash,
+        "zipped_hash": content.metadata.get("zipped_hash"),
+        "size": file_size,
+        "stored_size": content.size,
+        "etag": etag.strip('"'),
+        "content": unzipped_hash,
+        "upload_date": datetime.utcnow().isoformat() + "Z",
+        # Taken from the stored content, so it reads the same whether this
+        # upload stored it or linked to a copy another case already held
+        "compression": {
+            "method": content.metadata.get("compression") or "unknown",
+            "ratio": round(content.size / file_size, 4) if file_size else 1,
+            "seconds": round(elapsed, 3),
+            "mb_per_second": round(file_size / elapsed / 1e6, 1) if elapsed else None,
+        },
+    }
+
+def process_file(batch, file, filename=None, upload_key=None):
+    """Hash, compress and upload one file.
+
+    file is any seekable stream; filename defaults to its filename attribute.
+    The data goes to the shared content store, or is linked from it if another
+    case already holds the same content, and the case gets a link blob.
+    upload_key identifies an upload across retries and concurrent attempts:
+    if another attempt already wrote its link blob, that blob's entry is
+    returned and no further reference to the content is kept.
+
+    Returns the new inventory entry, or None if the case already has the content.
+    """
+    filename = filename or file.filename
+    started = time.monotonic()
+    # Hash the raw stream chunk by chunk; nothing is held in memory
+    with span("upload.hash"):
+        unzipped_hash, file_size = hash_stream(file)
+
+    if batch.find_duplicate(unzipped_hash):
+        return None
+
+    with span("upload.add_reference"):
+        content = add_reference(unzipped_hash)
+    while content is None:
+        file.seek(0)
+        # Stream the (compressed) file to storage as staged blocks
+        writer = BlockBlobWriter(content_blob_client(unzipped_hash))
+        with span("upload.zip_check"):
+            passthrough = is_compressed_with_password(file)
+        if passthrough:
+            method = "passthrough"
+            with span("upload.copy"):
+                copy_stream(file, writer)
+        else:
+            codec, level = choose_compression(file, batch.compression)
+            method = codec if level is None else f"{codec}:{level}"
+            # Includes staging the compressed blocks, which happens as the archive is written
+            with span("upload.compress"):
+                # Named after the content, which other cases may link to; downloads put back each case's name
+                compress_and_secure_file(file, writer, arcname=unzipped_hash, codec=codec, level=level)
+            count(BYTES_COMPRESSED, file_size)
+        with span("upload.store_content"):
+            content = store_content(unzipped_hash, writer, metadata={
+                "zipped_hash": writer.hexdigest(), "size": str(file_size), "compression": method,
+            })
+        if content is None:
+            # Stored concurrently by another upload; link to that copy instead
+            with span("upload.add_reference"):
+                content = add_reference(unzipped_hash)
+
+    metadata = {CONTENT_METADATA_KEY: unzipped_hash, CONTENT_SIZE_METADATA_KEY: str(content.size)}
+    if upload_key:
+        metadata[UPLOAD_KEY_METADATA_KEY] = upload_key
+    linked = None
+    try:
+        with span("upload.link_blob"):
+            while True:
+                blob_name = batch.allocate_name(filename)
+                try:
+                    # Create only if missing, so a name taken meanwhile is never overwritten
+                    etag = batch.container_client.get_blob_client(blob_name).upload_blob(
+                        b"", overwrite=False, metadata=metadata,
+                    )['etag']
+                    break
+                except ResourceExistsError:
+                    # The name stays reserved, so the next attempt picks another
+                    linked = batch.name_taken(filename, upload_key)
+                    if linked is not None:
+                        blob_name, etag = linked.name, linked.etag
+                        break
+    except Exception:
+        release_reference(unzipped_hash)
+        raise
+    if linked is not None:
+        # Linked by another attempt at this upload, which holds the reference
+        release_reference(unzipped_hash)
+
+    return _entry(blob_name, unzipped_hash, file_size, content, etag, time.monotonic() - started)
+
+def describe_upload(entry):
+    """Name of an uploaded file with how its compression performed, for result messages."""
+    compression = entry.get("compression")
+    if not compression:
+        return entry["name"]
+    details = f"{compression['method']}, {compression['ratio']:.0%} of original size"
+    if compression["mb_per_second"] is not None:
+        details += f", {compression['mb_per_second']} MB/s"
+    return f"{entry['name']} ({details})"
+
+def process_files(batch, files, max_workers=UPLOAD_WORKERS):
+    """Process files concurrently on a bounded thread pool.
+
+    Returns (new inventory entries, uploaded blob names, duplicate file names)
+    in the order the files were submitted, plus the first error raised by any
+    file so the caller can still record the entries that did succeed.
+    """
+    entries = []
+    uploaded_files = []
+    duplicate_files = []
+    error = None
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # Each file runs in a copy of this context, so a profiled request sees its spans
+        futures = [(file.filename, executor.submit(copy_context().run, process_file, batch, file)) for file in files]
+        for filename, future in futures:
+            try:
+                entry = future.result()
+            except Exception as e:
+                error = error or e
+                continue
+            if entry is None:
+                duplicate_files.append(filename)
+            else:
+                entries.append(entry)
+                uploaded_files.append(entry['name'])
+    return entries, uploaded_files, duplicate_files, error
@@ -1,26 +1,118 @@
-const caseApp = Vue.createApp({
-  data() {
-    return {
-      blobs: [],
-    };
-  },
-  async mounted() {
-    await this.fetchBlobs();
-  },
-  methods: {
-    async fetchBlobs() {
-      try {
-        const response = await fetch(window.location.href);
-        const html = await response.text();
-        const parser = new DOMParser();
-        const doc = parser.parseFromString(html, 'text/html');
-        const blobElements = doc.querySelectorAll('.file-list > li');
-        this.blobs = Array.from(blobElements).map((el) => el.innerText);
-      } catch (error) {
-        console.error('Error fetching blobs:', error);
-      }
-    },
-  },
+// The case page lists its files page by page from the JSON listing API. The
+// next page is fetched when the end of the list scrolls into view, and the
+// filter form restarts the listing with the new filters.
+const fileList = document.querySelector('.file-list');
+const listStatus = document.getElementById('file-list-status');
+const loadMoreButton = document.getElementById('load-more');
+const filterForm = document.getElementById('filter-form');
+
+let listing = { query: '', cursor: null, loading: false, done: false, count: 0, generation: 0 };
+
+function buildQuery() {
+  const params = new URLSearchParams();
+  for (const [name, value] of new FormData(filterForm)) {
+    if (value) {
+      params.set(name, value);
+    }
+  }
+  return params;
+}
+
+function iconButton(className, icon, label, onClick) {
+  const button = document.createElement('button');
+  button.className = `${className} flex items-center space-x-2`;
+  button.onclick = onClick;
+  const img = document.createElement('img');
+  img.src = icon;
+  img.alt = label;
+  img.className = 'h-5 w-5';
+  const span = document.createElement('span');
+  span.textContent = label;
+  button.append(img, span);
+  return button;
+}
+
+function fileItem(file) {
+  const containerName = fileList.dataset.container;
+  const item = document.createElement('li');
+  item.className = 'flex justify-between items-center';
+  item.dataset.name = file.name;
+
+  const label = document.createElement('span');
+  const checkbox = document.createElement('input');
+  checkbox.type = 'checkbox';
+  checkbox.className = 'export-select mr-2';
+  checkbox.value = file.name;
+  const name = document.createElement('strong');
+  name.textContent = file.name;
+  label.append(checkbox, name, ` (${file.size} bytes)`);
+
+  const actions = document.createElement('div');
+  actions.className = 'flex space-x-2';
+  actions.append(
+    iconButton('btn-primary', fileList.dataset.downloadIcon, 'Download', () => downloadFile(containerName, file.name)),
+    iconButton('btn-secondary', fileList.dataset.deleteIcon, 'Delete', () => deleteFile(containerName, file.name)),
+  );
+  item.append(label, actions);
+  return item;
+}
+
+async function loadPage() {
+  if (listing.loading || listing.done) {
+    return;
+  }
+  listing.loading = true;
+  const generation = listing.generation;
+  const params = new URLSearchParams(listing.query);
+  if (listing.cursor) {
+    params.set('cursor', listing.cursor);
+  }
+  listStatus.textContent = 'Loading files...';
+  try {
+    const response = await fetch(`/case/${fileList.dataset.container}/files?${params}`);
+    const data = await response.json();
+    if (generation !== listing.generation) {
+      return; // The filters changed while this page was loading
+    }
+    if (!response.ok) {
+      throw new Error(data.error || `Request failed with status ${response.status}`);
+    }
+    fileList.append(...data.files.map(fileItem));
+    listing.count += data.files.length;
+    listing.cursor = data.cursor;
+    listing.done = !data.cursor;
+    listStatus.textContent = listing.done ? `${listing.count} files.` : `${listing.count} files loaded.`;
+  } catch (error) {
+    console.error('Error fetching files:', error);
+    listStatus.textContent = `Error fetching files: ${error.message}`;
+  } finally {
+    if (generation === listing.generation) {
+      listing.loading = false;
+      loadMoreButton.classList.toggle('hidden', listing.done);
+    }
+  }
+}
+
+function resetListing() {
+  listing = {
+    query: buildQuery().toString(), cursor: null, loading: false, done: false, count: 0,
+    generation: listing.generation + 1,
+  };
+  fileList.replaceChildren();
+  loadPage();
+}
+
+filterForm.addEventListener('submit', (event) => {
+  event.preventDefault();
+  resetListing();
 });
+loadMoreButton.addEventListener('click', loadPage);
+
+// Fetch the next page as the bottom of the list comes into view
+new IntersectionObserver((observed) => {
+  if (observed.some((entry) => entry.isIntersecting)) {
+    loadPage();
+  }
+}).observe(loadMoreButton);
 
-caseApp.mount('#app');
\ No newline at end of file
+resetListing();
@@ -0,0 +1,126 @@
+// Web Worker that computes the SHA-256 of files in the browser, reading them
+// a slice at a time so even multi-gigabyte files are never held in memory.
+// WebCrypto cannot hash incrementally, hence the small implementation below.
+const HASH_SLICE_SIZE = 4 * 1024 * 1024;
+
+const K = new Int32Array([
+  0x428a2f98, 0x71374491, 0xb5c0fbcf, 0xe9b5dba5, 0x3956c25b, 0x59f111f1, 0x923f82a4, 0xab1c5ed5,
+  0xd807aa98, 0x12835b01, 0x243185be, 0x550c7dc3, 0x72be5d74, 0x80deb1fe, 0x9bdc06a7, 0xc19bf174,
+  0xe49b69c1, 0xefbe4786, 0x0fc19dc6, 0x240ca1cc, 0x2de92c6f, 0x4a7484aa, 0x5cb0a9dc, 0x76f988da,
+  0x983e5152, 0xa831c66d, 0xb00327c8, 0xbf597fc7, 0xc6e00bf3, 0xd5a79147, 0x06ca6351, 0x14292967,
+  0x27b70a85, 0x2e1b2138, 0x4d2c6dfc, 0x53380d13, 0x650a7354, 0x766a0abb, 0x81c2c92e, 0x92722c85,
+  0xa2bfe8a1, 0xa81a664b, 0xc24b8b70, 0xc76c51a3, 0xd192e819, 0xd6990624, 0xf40e3585, 0x106aa070,
+  0x19a4c116, 0x1e376c08, 0x2748774c, 0x34b0bcb5, 0x391c0cb3, 0x4ed8aa4a, 0x5b9cca4f, 0x682e6ff3,
+  0x748f82ee, 0x78a5636f, 0x84c87814, 0x8cc70208, 0x90befffa, 0xa4506ceb, 0xbef9a3f7, 0xc67178f2,
+]);
+
+class Sha256 {
+  constructor() {
+    this.state = new Uint32Array([
+      0x6a09e667, 0xbb67ae85, 0x3c6ef372, 0xa54ff53a, 0x510e527f, 0x9b05688c, 0x1f83d9ab, 0x5be0cd19,
+    ]);
+    this.buffer = new Uint8Array(64);
+    this.bufferLength = 0;
+    this.length = 0;
+    this.words = new Int32Array(64);
+  }
+
+  update(data) {
+    this.length += data.length;
+    let offset = 0;
+    if (this.bufferLength) {
+      offset = Math.min(64 - this.bufferLength, data.length);
+      this.buffer.set(data.subarray(0, offset), this.bufferLength);
+      this.bufferLength += offset;
+      if (this.bufferLength < 64) {
+        return;
+      }
+      this.block(this.buffer, 0);
+      this.bufferLength = 0;
+    }
+    for (; offset + 64 <= data.length; offset += 64) {
+      this.block(data, offset);
+    }
+    this.buffer.set(data.subarray(offset), 0);
+    this.bufferLength = data.length - offset;
+  }
+
+  block(data, offset) {
+    const w = this.words;
+    for (let t = 0; t < 16; t++) {
+      const i = offset + t * 4;
+      w[t] = (data[i] << 24) | (data[i + 1] << 16) | (data[i + 2] << 8) | data[i + 3];
+    }
+    for (let t = 16; t < 64; t++) {
+      const x = w[t - 15];
+      const y = w[t - 2];
+      const s0 = ((x >>> 7) | (x << 25)) ^ ((x >>> 18) | (x << 14)) ^ (x >>> 3);
+      const s1 = ((y >>> 17) | (y << 15)) ^ ((y >>> 19) | (y << 13)) ^ (y >>> 10);
+      w[t] = (w[t - 16] + s0 + w[t - 7] + s1) | 0;
+    }
+    const state = this.state;
+    let a = state[0] | 0;
+    let b = state[1] | 0;
+    let c = state[2] | 0;
+    let d = state[3] | 0;
+    let e = state[4] | 0;
+    let f = state[5] | 0;
+    let g = state[6] | 0;
+    let h = state[7] | 0;
+    for (let t = 0; t < 64; t++) {
+      const S1 = ((e >>> 6) | (e << 26)) ^ ((e >>> 11) | (e << 21)) ^ ((e >>> 25) | (e << 7));
+      const t1 = (h + S1 + ((e & f) ^ (~e & g)) + K[t] + w[t]) | 0;
+      const S0 = ((a >>> 2) | (a << 30)) ^ ((a >>> 13) | (a << 19)) ^ ((a >>> 22) | (a << 10));
+      const t2 = (S0 + ((a & b) ^ (a & c) ^ (b & c))) | 0;
+      h = g;
+      g = f;
+      f = e;
+      e = (d + t1) | 0;
+      d = c;
+      c = b;
+      b = a;
+      a = (t1 + t2) | 0;
+    }
+    state[0] += a;
+    state[1] += b;
+    state[2] += c;
+    state[3] += d;
+    state[4] += e;
+    state[5] += f;
+    state[6] += g;
+    state[7] += h;
+  }
+
+  hexdigest() {
+    const bits = this.length * 8;
+    const padLength = (this.bufferLength < 56 ? 56 : 120) - this.bufferLength;
+    const padding = new Uint8Array(padLength + 8);
+    padding[0] = 0x80;
+    const view = new DataView(padding.buffer);
+    view.setUint32(padLength, Math.floor(bits / 0x100000000));
+    view.setUint32(padLength + 4, bits >>> 0);
+    this.update(padding);
+    return Array.from(this.state, (word) => word.toString(16).padStart(8, '0')).join('');
+  }
+}
+
+function hashFile(file, onProgress) {
+  const reader = new FileReaderSync();
+  const digest = new Sha256();
+  for (let offset = 0; offset < file.size; offset += HASH_SLICE_SIZE) {
+    digest.update(new Uint8Array(reader.readAsArrayBuffer(file.slice(offset, offset + HASH_SLICE_SIZE))));
+    onProgress(Math.min(offset + HASH_SLICE_SIZE, file.size));
+  }
+  return digest.hexdigest();
+}
+
+// Receives {id, file}; replies with {id, progress} updates, then {id, hash} or {id, error}
+self.onmessage = (event) => {
+  const { id, file } = event.data;
+  try {
+    const hash = hashFile(file, (progress) => self.postMessage({ id, progress }));
+    self.postMessage({ id, hash });
+  } catch (error) {
+    self.postMessage({ id, error: error.message });
+  }
+};
@@ -0,0 +1,327 @@
+// Files are hashed in the browser first and those the case already holds are
+// not sent at all. Large files are sent through the resumable chunked upload
+// API; the others still go in one multipart request. Chunks are uploaded in
+// parallel and retried, and the upload id is remembered so a reload can resume.
+const CHUNKED_THRESHOLD = 64 * 1024 * 1024;
+const PARALLEL_CHUNKS = 4;
+const CHUNK_RETRIES = 5;
+// Hashes sent per "have you got this?" check
+const CHECK_BATCH_SIZE = 500;
+// Milliseconds between checks on a queued upload
+const JOB_POLL_INTERVAL = 2000;
+
+function uploadKey(secret, file) {
+  return `chunked-upload:${secret}:${file.name}:${file.size}:${file.lastModified}`;
+}
+
+async function jsonRequest(url, options) {
+  const response = await fetch(url, options);
+  const data = await response.json().catch(() => ({}));
+  if (!response.ok) {
+    const error = new Error(data.error || `Request failed with status ${response.status}`);
+    error.status = response.status;
+    error.retryAfter = Number(response.headers.get('Retry-After')) || 10;
+    throw error;
+  }
+  return data;
+}
+
+// Repeat a request the server turned away for lack of upload slots, after the delay it asks for
+async function whenAdmitted(request) {
+  for (;;) {
+    try {
+      return await request();
+    } catch (error) {
+      if (error.status !== 429) {
+        throw error;
+      }
+      await new Promise((resolve) => setTimeout(resolve, 1000 * error.retryAfter));
+    }
+  }
+}
+
+async function startOrResume(secret, file, compression) {
+  const key = uploadKey(secret, file);
+  const uploadId = localStorage.getItem(key);
+  if (uploadId) {
+    try {
+      const status = await jsonRequest(`/upload/chunked/${uploadId}`, { headers: { 'X-Case-Secret': secret } });
+      return { uploadId, ...status };
+    } catch (error) {
+      localStorage.removeItem(key);
+    }
+  }
+  const upload = await jsonRequest('/upload/chunked', {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ secret, filename: file.name, size: file.size, compression }),
+  });
+  localStorage.setItem(key, upload.upload_id);
+  return { uploadId: upload.upload_id, chunk_size: upload.chunk_size, chunk_count: upload.chunk_count, received: [] };
+}
+
+async function putChunk(secret, file, upload, index) {
+  const start = index * upload.chunk_size;
+  const body = file.slice(start, Math.min(start + upload.chunk_size, file.size));
+  for (let attempt = 0; ; attempt++) {
+    try {
+      return await whenAdmitted(() => jsonRequest(`/upload/chunked/${upload.uploadId}/chunks/${index}`, {
+        method: 'PUT',
+        headers: { 'X-Case-Secret': secret, 'Content-Type': 'application/octet-stream' },
+        body,
+      }));
+    } catch (error) {
+      if (attempt + 1 >= CHUNK_RETRIES || (error.status >= 400 && error.status < 500)) {
+        throw error;
+      }
+      await new Promise((resolve) => setTimeout(resolve, 1000 * 2 ** attempt));
+    }
+  }
+}
+
+async function chunkedUpload(secret, file, compression, onProgress, onProcessing) {
+  const upload = await startOrResume(secret, file, compression);
+  const received = new Set(upload.received);
+  const pending = [];
+  for (let index = 0; index < upload.chunk_count; index++) {
+    if (!received.has(index)) {
+      pending.push(index);
+    }
+  }
+  let done = received.size;
+  onProgress(done, upload.chunk_count);
+
+  const worker = async () => {
+    while (pending.length) {
+      await putChunk(secret, file, upload, pending.shift());
+      onProgress(++done, upload.chunk_count);
+    }
+  };
+  await Promise.all(Array.from({ length: PARALLEL_CHUNKS }, worker));
+
+  let result = await whenAdmitted(() => jsonRequest(`/upload/chunked/${upload.uploadId}/commit`, {
+    method: 'POST',
+    headers: { 'X-Case-Secret': secret },
+  }));
+  // The file is hashed and zipped by a background job on the server
+  while (result.status === 'processing') {
+    onProcessing();
+    await new Promise((resolve) => setTimeout(resolve, JOB_POLL_INTERVAL));
+    result = await jsonRequest(`/upload/chunked/${upload.uploadId}/commit`, { headers: { 'X-Case-Secret': secret } });
+  }
+  localStorage.removeItem(uploadKey(secret, file));
+  return result;
+}
+
+// Send files as one multipart upload, as the form does, and wait for the outcome.
+// Resolves to the files uploaded and found to be duplicates, with the error of a
+// queued upload that failed part way; rejects if nothing was stored.
+async function formUpload(form, secret, files, compression) {
+  const body = new FormData();
+  // The secret goes first, so the server admits the upload before reading files
+  body.append('secret', secret);
+  body.append('compression', compression);
+  files.forEach((file) => body.append('files', file));
+  const response = await fetch(form.action, { method: 'POST', headers: { Accept: 'application/json' }, body });
+  const data = await response.json().catch(() => ({}));
+  if (!response.ok || data.message_type === 'error') {
+    throw new Error(data.message || `Request failed with status ${response.status}`);
+  }
+  if (!data.job_id) {
+    return data;
+  }
+  showMessage(form, data.message, 'success');
+  const job = await waitForJob(data.job_id, () => {});
+  return { ...job.result, error: job.status === 'failed' ? job.error : null };
+}
+
+// Wait for a queued upload to finish processing; resolves to the final job status
+async function waitForJob(jobId, onProgress) {
+  for (;;) {
+    const job = await jsonRequest(`/upload/jobs/${jobId}`);
+    if (job.status === 'completed' || job.status === 'failed') {
+      return job;
+    }
+    onProgress(job);
+    await new Promise((resolve) => setTimeout(resolve, JOB_POLL_INTERVAL));
+  }
+}
+
+async function showJobResult(form, jobId) {
+  try {
+    const job = await waitForJob(jobId, (status) => {
+      const retry = status.attempts > 1 ? ` (attempt ${status.attempts})` : '';
+      showMessage(form, `Processing uploaded files: ${status.pending} remaining${retry}`, 'success');
+    });
+    showMessage(form, job.message, job.message_type);
+  } catch (error) {
+    showMessage(form, `Error checking upload status: ${error.message}`, 'error');
+  }
+}
+
+function showMessage(form, text, type) {
+  let alert = document.getElementById('chunked-upload-message');
+  if (!alert) {
+    alert = document.createElement('div');
+    alert.id = 'chunked-upload-message';
+    alert.onclick = () => alert.remove();
+    form.parentNode.insertBefore(alert, form);
+  }
+  alert.className = `alert alert-${type} mb-4`;
+  alert.textContent = text;
+}
+
+// Hash files one after another in a Web Worker; resolves to one hash per file
+function hashFiles(files, onProgress) {
+  return new Promise((resolve, reject) => {
+    const worker = new Worker('/static/js/hash-worker.js');
+    const hashes = [];
+    worker.onmessage = (event) => {
+      const { id, progress, hash, error } = event.data;
+      if (error) {
+        worker.terminate();
+        reject(new Error(error));
+      } else if (progress !== undefined) {
+        onProgress(files[id], progress);
+      } else {
+        hashes.push(hash);
+        if (hashes.length === files.length) {
+          worker.terminate();
+          resolve(hashes);
+        } else {
+          worker.postMessage({ id: id + 1, file: files[id + 1] });
+        }
+      }
+    };
+    worker.onerror = (event) => {
+      worker.terminate();
+      reject(new Error(event.message));
+    };
+    worker.postMessage({ id: 0, file: files[0] });
+  });
+}
+
+// Return the files whose content the case already holds; none if the check fails
+async function findKnownFiles(form, secret, files) {
+  if (!window.Worker || !files.length) {
+    return new Set();
+  }
+  try {
+    const hashes = await hashFiles(files, (file, progress) => {
+      showMessage(form, `Checking ${file.name}: ${Math.floor((100 * progress) / file.size)}%`, 'success');
+    });
+    const known = new Set();
+    for (let start = 0; start < hashes.length; start += CHECK_BATCH_SIZE) {
+      const result = await jsonRequest('/upload/check', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ secret, hashes: hashes.slice(start, start + CHECK_BATCH_SIZE) }),
+      });
+      result.present.forEach((hash) => known.add(hash));
+    }
+    return new Set(files.filter((file, index) => known.has(hashes[index])));
+  } catch (error) {
+    console.error('Error checking for known files:', error);
+    return new Set();
+  }
+}
+
+function initUploadForm(form) {
+  const secretInput = form.querySelector('#secret');
+  const fileInput = form.querySelector('#files');
+  const compressionInput = form.querySelector('#compression');
+  const submitButton = form.querySelector('button[type="submit"]');
+
+  // A form upload was queued; report its outcome once processed
+  if (form.dataset.jobId) {
+    document.getElementById('upload-message')?.remove();
+    showJobResult(form, form.dataset.jobId);
+  }
+
+  form.addEventListener('submit', async (event) => {
+    event.preventDefault();
+    submitButton.disabled = true;
+
+    const secret = secretInput.value;
+    const files = Array.from(fileInput.files);
+    const known = await findKnownFiles(form, secret, files);
+    const remaining = files.filter((file) => !known.has(file));
+    const duplicates = files.filter((file) => known.has(file)).map((file) => file.name);
+
+    if (remaining.length && !remaining.some((file) => file.size >= CHUNKED_THRESHOLD)) {
+      // Small uploads keep using the plain form post, minus the known files
+      const transfer = new DataTransfer();
+      remaining.forEach((file) => transfer.items.add(file));
+      fileInput.files = transfer.files;
+      for (const name of duplicates) {
+        const input = document.createElement('input');
+        input.type = 'hidden';
+        input.name = 'skipped';
+        input.value = name;
+        form.appendChild(input);
+      }
+      form.submit();
+      return;
+    }
+
+    const uploaded = [];
+    const failed = [];
+    // Only the large files are chunked; the rest go in one multipart request
+    const small = remaining.filter((file) => file.size < CHUNKED_THRESHOLD);
+    if (small.length) {
+      showMessage(form, `Uploading ${small.length} smaller files...`, 'success');
+      try {
+        const result = await formUpload(form, secret, small, compressionInput.value);
+        uploaded.push(...result.uploaded);
+        duplicates.push(...result.duplicates);
+        if (result.error) {
+          failed.push(`${small.map((file) => file.name).join(', ')} (${result.error})`);
+        }
+      } catch (error) {
+        failed.push(`${small.map((file) => file.name).join(', ')} (${error.message})`);
+      }
+    }
+    for (const file of remaining.filter((file) => file.size >= CHUNKED_THRESHOLD)) {
+      try {
+        const result = await chunkedUpload(
+          secret,
+          file,
+          compressionInput.value,
+          (done, total) => showMessage(form, `Uploading ${file.name}: ${done} of ${total} chunks`, 'success'),
+          () => showMessage(form, `Processing ${file.name}...`, 'success'),
+        );
+        if (result.status === 'queued') {
+          showMessage(form, `Processing ${file.name}...`, 'success');
+          const job = await waitForJob(result.job_id, () => {});
+          uploaded.push(...job.result.uploaded);
+          duplicates.push(...job.result.duplicates);
+          if (job.status === 'failed') {
+            failed.push(`${file.name} (${job.error})`);
+          }
+        } else if (result.status === 'duplicate') {
+          duplicates.push(file.name);
+        } else {
+          uploaded.push(result.description);
+        }
+      } catch (error) {
+        failed.push(`${file.name} (${error.message})`);
+      }
+    }
+
+    const parts = [];
+    if (uploaded.length) {
+      parts.push(`Files uploaded successfully: ${uploaded.join(', ')}.`);
+    }
+    if (duplicates.length) {
+      parts.push(`The following files were not uploaded because duplicates already exist: ${duplicates.join(', ')}.`);
+    }
+    if (failed.length) {
+      parts.push(`Error uploading files: ${failed.join(', ')}. Upload them again to resume.`);
+    }
+    const type = failed.length ? 'error' : duplicates.length ? 'warning' : 'success';
+    showMessage(form, parts.join(' ') || 'No files were uploaded.', type);
+    submitButton.disabled = false;
+  });
+}
+
+initUploadForm(document.getElementById('upload-form'));
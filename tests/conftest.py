@@ -0,0 +1,17 @@
+import os
+import sys
+import tempfile
+
+# The app's modules are imported from the repository root, as app.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Tests that import the app's services run against local storage and SQLite
+# in a scratch directory; this must happen before those modules are imported
+_workdir = tempfile.mkdtemp(prefix="artifact-collection-tests-")
+os.environ.update({
+    "STORAGE_BACKEND": "local",
+    "LOCAL_STORAGE_PATH": os.path.join(_workdir, "storage"),
+    "DB_BACKEND": "sqlite",
+    "SQLITE_DATABASE": os.path.join(_workdir, "cases.sqlite3"),
+    "UPLOAD_FOLDER": os.path.join(_workdir, "uploads"),
+})
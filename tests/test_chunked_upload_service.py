@@ -0,0 +1,30 @@
+from services.blob_service import get_blob_service_client
+from services.chunked_upload_service import stage_chunk, start_commit
+from services.job_service import get_job
+from services.startup import run_startup
+import time
+import uuid
+
+def test_repeated_commit_stores_the_file_once():
+    run_startup()
+    container_name = f"case-{uuid.uuid4().hex[:8]}"
+    container_client = get_blob_service_client().get_container_client(container_name)
+    container_client.create_container()
+    data = b"chunked artifact" * 1000
+    upload = {
+        "id": uuid.uuid4().hex, "container": container_name, "filename": "big.bin",
+        "size": len(data), "chunk_size": 10000, "compression": None,
+    }
+    for index in range(0, len(data), upload["chunk_size"]):
+        stage_chunk(upload, index // upload["chunk_size"], data[index:index + upload["chunk_size"]])
+
+    first, second = start_commit(upload), start_commit(upload)
+    assert first["id"] == second["id"] == upload["id"]
+    deadline = time.monotonic() + 10
+    while get_job(upload["id"])["status"] not in ("completed", "failed") and time.monotonic() < deadline:
+        time.sleep(0.05)
+    job = get_job(upload["id"])
+    assert job["status"] == "completed"
+    assert job["result"]["name"] == "big.bin.zip"
+    assert start_commit(upload)["result"]["name"] == "big.bin.zip"
+    assert [blob.name for blob in container_client.list_blobs() if not blob.name.startswith(".")] == ["big.bin.zip"]
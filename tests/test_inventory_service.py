@@ -0,0 +1,67 @@
+from services import inventory_service
+from services.inventory_service import BlobInventory
+from services.local_storage import LocalBlobServiceClient
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+import pytest
+
+WORKERS = 16
+FILES_PER_WORKER = 40
+
+@pytest.fixture
+def container(tmp_path):
+    container_client = LocalBlobServiceClient(str(tmp_path)).get_container_client("case")
+    container_client.create_container()
+    return container_client
+
+def entry(name):
+    return {"name": name, "unzipped_hash": f"hash-{name}", "zipped_hash": f"zipped-{name}"}
+
+def test_concurrent_writers_keep_every_entry(container, monkeypatch):
+    # Compact often, so appends race with compactions as well as with each other
+    monkeypatch.setattr(inventory_service, "INVENTORY_COMPACT_MIN_OPS", 25)
+
+    def upload(worker):
+        # Each writer has its own inventory, as separate worker processes do
+        inventory = BlobInventory(container).refresh()
+        for i in range(FILES_PER_WORKER):
+            inventory.add(entry(f"{worker}-{i}.zip"))
+            if i % 4 == 3:
+                inventory.remove(f"{worker}-{i - 1}.zip")
+
+    with ThreadPoolExecutor(WORKERS) as pool:
+        list(pool.map(upload, range(WORKERS)))
+
+    inventory = BlobInventory(container).refresh()
+    expected = {
+        f"{worker}-{i}.zip" for worker in range(WORKERS) for i in range(FILES_PER_WORKER) if i % 4 != 2
+    }
+    assert {e["name"] for e in inventory.entries()} == expected
+    assert inventory.find_by_unzipped_hash("hash-0-0.zip")["name"] == "0-0.zip"
+    assert inventory.find_by_unzipped_hash("hash-0-2.zip") is None
+
+def test_slow_compaction_keeps_its_lease(container, monkeypatch):
+    monkeypatch.setattr(inventory_service, "COMPACTION_LEASE_SECONDS", 0.3)
+    compactor = BlobInventory(container).refresh()
+    compactor.add(entry("before.zip"))
+
+    write_snapshot = BlobInventory._write_snapshot
+    snapshot_started = threading.Event()
+
+    def slow_write_snapshot(self, entries, lease):
+        snapshot_started.set()
+        # Several lease periods; without renewal another writer could append
+        # to the log here, and the reset log would lose its entry
+        time.sleep(1)
+        return write_snapshot(self, entries, lease)
+
+    monkeypatch.setattr(BlobInventory, "_write_snapshot", slow_write_snapshot)
+    compaction = threading.Thread(target=compactor.compact)
+    compaction.start()
+    snapshot_started.wait()
+    BlobInventory(container).refresh().add(entry("during.zip"))
+    compaction.join()
+
+    names = {e["name"] for e in BlobInventory(container).refresh().entries()}
+    assert names == {"before.zip", "during.zip"}
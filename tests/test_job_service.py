@@ -0,0 +1,28 @@
+from services.job_service import JobRunner, get_job, start_job
+import threading
+import time
+
+def test_runner_bounds_the_jobs_running_at_once():
+    runner = JobRunner(2, "test-runner")
+    release = threading.Event()
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    def work(job):
+        with lock:
+            running.append(job.id)
+            peak.append(len(running))
+        release.wait(5)
+        with lock:
+            running.remove(job.id)
+
+    jobs = [start_job("test", work, runner=runner) for _ in range(6)]
+    time.sleep(0.2)
+    assert sorted(job.status for job in jobs) == ["queued"] * 4 + ["running"] * 2
+    release.set()
+    deadline = time.monotonic() + 5
+    while any(get_job(job.id)["status"] != "completed" for job in jobs) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert all(get_job(job.id)["status"] == "completed" for job in jobs)
+    assert max(peak) == 2
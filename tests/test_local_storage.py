@@ -0,0 +1,40 @@
+from azure.core import MatchConditions
+from azure.core.exceptions import HttpResponseError, ResourceExistsError, ResourceModifiedError, ResourceNotModifiedError
+from services.local_storage import LocalBlobServiceClient
+import pytest
+
+@pytest.fixture
+def blob(tmp_path):
+    container_client = LocalBlobServiceClient(str(tmp_path)).get_container_client("case")
+    container_client.create_container()
+    return container_client.get_blob_client("blob")
+
+def test_etag_is_only_consumed_by_conditions_that_compare_it(blob):
+    # The SDK forwards it to the HTTP transport, which rejects it
+    with pytest.raises(TypeError):
+        blob.create_append_blob(etag='*', match_condition=MatchConditions.IfMissing)
+    with pytest.raises(TypeError):
+        blob.upload_blob(b"data", etag='*', match_condition=MatchConditions.IfMissing)
+    with pytest.raises(ValueError):
+        blob.upload_blob(b"data", overwrite=True, etag='"0x1"')
+    with pytest.raises(ValueError):
+        blob.download_blob(match_condition=MatchConditions.IfModified)
+
+def test_unimplemented_conditions_are_rejected(blob):
+    with pytest.raises(TypeError):
+        blob.upload_blob(b"data", overwrite=True, if_none_match='*')
+
+def test_condition_failures_raise_what_the_sdk_raises(blob):
+    etag = blob.upload_blob(b"data", match_condition=MatchConditions.IfMissing)["etag"]
+    with pytest.raises(ResourceExistsError) as exists:
+        blob.upload_blob(b"other", overwrite=True, match_condition=MatchConditions.IfMissing)
+    assert exists.value.status_code == 409
+    with pytest.raises(ResourceModifiedError) as modified:
+        blob.upload_blob(b"other", overwrite=True, etag='"0x1"', match_condition=MatchConditions.IfNotModified)
+    assert modified.value.status_code == 412
+
+    with pytest.raises(HttpResponseError) as not_modified:
+        blob.download_blob(etag=etag, match_condition=MatchConditions.IfModified)
+    assert not_modified.value.status_code == 304
+    assert not isinstance(not_modified.value, ResourceNotModifiedError)
+    assert blob.download_blob(etag='"0x1"', match_condition=MatchConditions.IfModified).readall() == b"data"
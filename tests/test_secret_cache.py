@@ -0,0 +1,28 @@
+from services.secret_cache import MISSING, SecretCache
+from services.startup import run_startup
+import pytest
+
+@pytest.fixture
+def workers():
+    run_startup()
+    # Two workers' caches, checking the shared version on every lookup
+    return SecretCache(sync_interval=0), SecretCache(sync_interval=0)
+
+def test_invalidation_reaches_other_workers(workers):
+    admin, uploads = workers
+    assert uploads.get("1111-1111-1111-1111") is MISSING
+    uploads.put("1111-1111-1111-1111", "rotated-case", uploads.version)
+    assert uploads.get("1111-1111-1111-1111") == "rotated-case"
+
+    admin.invalidate_container("rotated-case")
+    assert uploads.get("1111-1111-1111-1111") is MISSING
+
+def test_lookup_started_before_an_invalidation_is_not_cached(workers):
+    admin, uploads = workers
+    uploads.get("2222-2222-2222-2222")
+    version = uploads.version
+    # The secret is rotated while this worker is still reading the old row
+    admin.invalidate("2222-2222-2222-2222")
+    uploads.get("3333-3333-3333-3333")
+    uploads.put("2222-2222-2222-2222", "old-case", version)
+    assert uploads.get("2222-2222-2222-2222") is MISSING
@@ -0,0 +1,55 @@
+from services import upload_admission
+from services.upload_admission import admit_upload
+import io
+import threading
+import time
+
+BOUNDARY = "boundary"
+CONTENT_TYPE = f"multipart/form-data; boundary={BOUNDARY}"
+
+def form(*parts):
+    body = b""
+    for name, value, filename in parts:
+        disposition = f'form-data; name="{name}"' + (f'; filename="{filename}"' if filename else "")
+        body += f"--{BOUNDARY}\r\nContent-Disposition: {disposition}\r\n\r\n".encode() + value + b"\r\n"
+    return io.BytesIO(body + f"--{BOUNDARY}--\r\n".encode())
+
+def test_files_before_secret_wait_for_their_case_without_a_process_slot():
+    case_slots, _ = upload_admission._case_limits("busy-case")
+    for _ in range(case_slots.limit):
+        case_slots.acquire()
+    stream = form(("files", b"data" * 100, "a.txt"), ("secret", b"1111-1111-1111-1111", None))
+    admitted = threading.Event()
+
+    def upload():
+        with admit_upload(stream, CONTENT_TYPE, None, lambda secret: "busy-case"):
+            admitted.set()
+
+    thread = threading.Thread(target=upload)
+    thread.start()
+    deadline = time.monotonic() + 5
+    while case_slots.waiting == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert case_slots.waiting == 1
+    assert upload_admission._process_slots.active == 0
+
+    case_slots.release()
+    thread.join(5)
+    assert admitted.is_set()
+    for _ in range(case_slots.limit - 1):
+        case_slots.release()
+    assert (case_slots.active, upload_admission._process_slots.active) == (0, 0)
+
+def test_unknown_secret_discards_the_rest_of_the_body():
+    stream = form(("secret", b"0000-0000-0000-0000", None), ("files", b"x" * 500_000, "a.txt"))
+    with admit_upload(stream, CONTENT_TYPE, None, lambda secret: None) as upload:
+        assert upload.container_name is None
+        assert "files" not in upload.files
+        assert stream.read() == b""
+
+def test_case_admission_outside_forms_holds_both_slots_until_released():
+    case_slots, _ = upload_admission._case_limits("chunked-case")
+    admission = upload_admission.admit_case("chunked-case")
+    assert (case_slots.active, upload_admission._process_slots.active) == (1, 1)
+    admission.release()
+    assert (case_slots.active, upload_admission._process_slots.active) == (0, 0)
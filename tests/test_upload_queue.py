@@ -0,0 +1,60 @@
+from services import upload_queue
+from services.blob_service import get_blob_service_client
+from services.db_service import db_connection
+from services.inventory_service import BlobInventory
+from services.startup import run_startup
+import hashlib
+import os
+import pytest
+
+class SavedFile:
+    """Stands in for an uploaded werkzeug FileStorage."""
+
+    def __init__(self, filename, data):
+        self.filename = filename
+        self.data = data
+
+    def save(self, path):
+        with open(path, 'wb') as file:
+            file.write(self.data)
+
+@pytest.fixture
+def container():
+    os.makedirs(upload_queue.UPLOAD_FOLDER, exist_ok=True)
+    run_startup()
+    container_client = get_blob_service_client().get_container_client("queued-case")
+    container_client.create_container()
+    return container_client
+
+def test_retry_reuses_links_written_before_the_failure(container, monkeypatch):
+    files = [SavedFile("a.txt", b"alpha" * 1000), SavedFile("b.txt", b"beta" * 1000)]
+    job_id = upload_queue.enqueue_files(container.container_name, files)
+
+    add = BlobInventory.add
+    calls = []
+
+    def add_failing_once(self, *entries):
+        # Fails after every link blob of the job was written
+        calls.append(entries)
+        if len(calls) == 1:
+            raise RuntimeError("inventory unavailable")
+        return add(self, *entries)
+
+    monkeypatch.setattr(BlobInventory, "add", add_failing_once)
+    upload_queue._run(upload_queue._claim())
+    assert upload_queue.get_upload_job(job_id)["status"] == "queued"
+
+    upload_queue._update(job_id, not_before=0)
+    upload_queue._run(upload_queue._claim())
+
+    job = upload_queue.get_upload_job(job_id)
+    assert job["status"] == "completed"
+    assert [name.split(" ")[0] for name in job["result"]["uploaded"]] == ["a.txt.zip", "b.txt.zip"]
+    assert sorted(blob.name for blob in container.list_blobs() if not blob.name.startswith(".")) == [
+        "a.txt.zip", "b.txt.zip",
+    ]
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        for file in files:
+            cursor.execute("SELECT ref_count FROM ContentIndex WHERE content_hash = ?", (hashlib.sha256(file.data).hexdigest(),))
+            assert cursor.fetchone()[0] == 1
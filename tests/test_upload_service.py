@@ -0,0 +1,53 @@
+from services.blob_service import get_blob_service_client
+from services.db_service import db_connection
+from services.inventory_service import BlobInventory
+from services.startup import run_startup
+from services.upload_service import UploadBatch, process_file
+import hashlib
+import io
+import pytest
+import uuid
+
+@pytest.fixture
+def batch(monkeypatch):
+    run_startup()
+    container_client = get_blob_service_client().get_container_client(f"case-{uuid.uuid4().hex[:8]}")
+    container_client.create_container()
+    listings = []
+    list_blobs = container_client.list_blobs
+
+    def counted_list_blobs(*args, **kwargs):
+        listings.append(kwargs.get("name_starts_with"))
+        return list_blobs(*args, **kwargs)
+
+    monkeypatch.setattr(container_client, "list_blobs", counted_list_blobs)
+    batch = UploadBatch(container_client, BlobInventory(container_client).refresh())
+    batch.listings = listings
+    return batch
+
+def upload(batch, name, data, upload_key=None):
+    return process_file(batch, io.BytesIO(data), name, upload_key)
+
+def test_container_is_listed_only_after_a_name_clash(batch):
+    names = [upload(batch, f"file-{i}.txt", f"data {i}".encode())["name"] for i in range(5)]
+    assert names == [f"file-{i}.txt.zip" for i in range(5)]
+    assert batch.listings == []
+
+    # Another upload already holds the name; the batch does not know it yet
+    other = UploadBatch(batch.container_client, BlobInventory(batch.container_client).refresh())
+    upload(other, "report.txt", b"first report")
+    assert upload(batch, "report.txt", b"second report")["name"] == "report_1.txt.zip"
+    assert batch.listings == ["report"]
+
+def test_concurrent_attempt_at_the_same_upload_reuses_its_link(batch):
+    first = upload(batch, "artifact.bin", b"artifact", upload_key="upload-1")
+    # A second attempt, with its own batch as a retried commit has
+    again = UploadBatch(batch.container_client, BlobInventory(batch.container_client))
+    second = upload(again, "artifact.bin", b"artifact", upload_key="upload-1")
+    assert second["name"] == first["name"] == "artifact.bin.zip"
+    names = [blob.name for blob in batch.container_client.list_blobs() if blob.name.startswith("artifact")]
+    assert names == ["artifact.bin.zip"]
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT ref_count FROM ContentIndex WHERE content_hash = ?", (hashlib.sha256(b"artifact").hexdigest(),))
+        assert cursor.fetchone()[0] == 1